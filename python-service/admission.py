@@ -0,0 +1,318 @@
+"""
+重いリクエストの受付制御 (コストの事前見積もり・メモリ / CPU の予算・優先度別の待ち行列)
+
+    cost = estimate_pdf_cost(pdf_bytes, use_ocr=True)        # ページ数と OCR の有無から見積もる
+    cost = estimate_sheet_cost(xlsx_bytes, "orders.xlsx")    # シートの寸法 (行数) から見積もる
+    cost = estimate_export_cost(len(diff_rows))              # 突合結果の書き出しは行数から見積もる
+    async with get_controller().admit(cost):                 # 予算に空きができるまで待つ
+        ...
+
+見積もり (Cost) はメモリ[MB] と CPU 時間[秒] の概算で、実行中のリクエストの合計を
+ADMISSION_MEMORY_MB / ADMISSION_CPU_SEC 以内に抑える。
+CPU 時間の見積もりが ADMISSION_BULK_CPU_SEC 以上のリクエスト (ページ数の多い OCR など) は bulk、
+それ以外は interactive のレーンで受け付ける:
+  - bulk は各予算の ADMISSION_BULK_SHARE までしか使わない (残りは interactive のために空けておく)
+  - 予算に空きができた際は interactive の待ちを先に通す
+  - 待ち行列が ADMISSION_MAX_QUEUE 件を超える場合、またはレーンごとの待ち時間の上限を過ぎた場合は
+    AdmissionRejected にする (main.py で 429 + Retry-After を返す)
+予算の使用状況は snapshot() で取得できる (GET /api/v1/metrics)。
+イベントループ内からのみ呼び出すこと (スレッドセーフではない)。
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque, namedtuple
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+ADMISSION_MEMORY_MB = float(os.getenv("ADMISSION_MEMORY_MB", "2048"))
+# 実行中のリクエストの CPU 時間の見積もりの合計 (既定: 1コアあたり60秒分)
+ADMISSION_CPU_SEC = float(os.getenv("ADMISSION_CPU_SEC", str((os.cpu_count() or 1) * 60)))
+ADMISSION_BULK_CPU_SEC = float(os.getenv("ADMISSION_BULK_CPU_SEC", "10"))
+ADMISSION_BULK_SHARE = float(os.getenv("ADMISSION_BULK_SHARE", "0.75"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# レーンごとの待ち時間の上限 (秒)
+QUEUE_TIMEOUT = {
+    "interactive": float(os.getenv("ADMISSION_INTERACTIVE_TIMEOUT", "10")),
+    "bulk": float(os.getenv("ADMISSION_BULK_TIMEOUT", "60")),
+}
+# Retry-After の上限 (秒)
+RETRY_AFTER_MAX = 300
+
+LANES = ("interactive", "bulk")
+
+# コストの概算に使う係数
+# OCR: 200dpi の RGB ページ画像 (A4 で約12MB) + pdftoppm の中間画像 + tesseract
+OCR_PAGE_MEMORY_MB = 40
+OCR_PAGE_CPU_SEC = 3.0
+TEXT_PAGE_MEMORY_MB = 1
+TEXT_PAGE_CPU_SEC = 0.05
+# 発注データ1行あたり (openpyxl のセル + 行の dict)
+ROW_MEMORY_MB = 0.005
+ROW_CPU_SEC = 0.0005
+# 書き出しの前に突合する場合の1行あたりの CPU 時間の倍率 (名称の正規化・類似度・明細の検索)
+EXPORT_MATCH_CPU_FACTOR = 4
+# リクエストごとの固定分 (アップロードの保持・レスポンスの組み立て)
+BASE_MEMORY_MB = 10
+BASE_CPU_SEC = 0.05
+# シートの寸法が記録されていない XLSX の行数の概算 (圧縮後の1行あたりのバイト数)
+XLSX_BYTES_PER_ROW = 30
+
+Cost = namedtuple("Cost", ["memory_mb", "cpu_sec", "pages", "rows", "ocr"])
+
+
+def estimate_pdf_cost(pdf_bytes, use_ocr=False, pages=None):
+    """PDF のページ数 (pages の指定があればその範囲) と OCR の有無からコストを見積もる"""
+    from pdf_text import page_count, parse_page_range
+
+    try:
+        count = page_count(pdf_bytes)
+    except Exception:
+        # 壊れた PDF は処理側でエラーにするため、ここでは1ページとして扱う
+        count = 1
+    try:
+        count = len(parse_page_range(pages, count))
+    except ValueError:
+        pass
+    page_memory, page_cpu = (OCR_PAGE_MEMORY_MB, OCR_PAGE_CPU_SEC) if use_ocr else (TEXT_PAGE_MEMORY_MB, TEXT_PAGE_CPU_SEC)
+    return Cost(
+        memory_mb=BASE_MEMORY_MB + len(pdf_bytes) / (1024 * 1024) + count * page_memory,
+        cpu_sec=BASE_CPU_SEC + count * page_cpu,
+        pages=count,
+        rows=0,
+        ocr=bool(use_ocr),
+    )
+
+
+def sheet_rows(file_bytes, filename, sheet_names=None):
+    """CSV は行数、XLSX は対象シートの寸法 (max_row) の合計。読み込めない場合は大きさから概算する"""
+    if filename.endswith(".csv"):
+        return file_bytes.count(b"\n") + 1
+    try:
+        import openpyxl
+
+        wb = openpyxl.load_workbook(BytesIO(file_bytes), read_only=True)
+        try:
+            rows = 0
+            for ws in wb.worksheets:
+                if sheet_names and ws.title not in sheet_names:
+                    continue
+                if ws.max_row is None:
+                    return len(file_bytes) // XLSX_BYTES_PER_ROW
+                rows += ws.max_row
+            return rows
+        finally:
+            wb.close()
+    except Exception:
+        return len(file_bytes) // XLSX_BYTES_PER_ROW
+
+
+def estimate_sheet_cost(file_bytes, filename, sheet_names=None):
+    """発注データ (CSV / XLSX) の行数からコストを見積もる"""
+    rows = sheet_rows(file_bytes, filename, sheet_names)
+    return Cost(
+        memory_mb=BASE_MEMORY_MB + len(file_bytes) / (1024 * 1024) + rows * ROW_MEMORY_MB,
+        cpu_sec=BASE_CPU_SEC + rows * ROW_CPU_SEC,
+        pages=0,
+        rows=rows,
+        ocr=False,
+    )
+
+
+def estimate_export_cost(rows, match=False):
+    """
+    突合結果の書き出し (XLSX / CSV) のコストを行数から見積もる。
+    match=True (書き出しの前に突合する) の場合、rows は発注データと請求明細の行数の合計。
+    """
+    cpu_per_row = ROW_CPU_SEC * (EXPORT_MATCH_CPU_FACTOR if match else 1)
+    return Cost(
+        memory_mb=BASE_MEMORY_MB + rows * ROW_MEMORY_MB,
+        cpu_sec=BASE_CPU_SEC + rows * cpu_per_row,
+        pages=0,
+        rows=rows,
+        ocr=False,
+    )
+
+
+def combine_costs(costs, concurrency=None):
+    """
+    複数の処理をまとめたコスト。CPU 時間は合計、メモリは同時に実行される最大 concurrency 件の合計
+    (省略時は全件の合計)。
+    """
+    costs = list(costs)
+    memory = sorted((cost.memory_mb for cost in costs), reverse=True)
+    return Cost(
+        memory_mb=sum(memory[:concurrency] if concurrency else memory),
+        cpu_sec=sum(cost.cpu_sec for cost in costs),
+        pages=sum(cost.pages for cost in costs),
+        rows=sum(cost.rows for cost in costs),
+        ocr=any(cost.ocr for cost in costs),
+    )
+
+
+class AdmissionRejected(Exception):
+    """予算に空きがなく受け付けられない。retry_after 秒後の再試行を促す"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """受け付けたリクエストが確保している予算"""
+
+    def __init__(self, lane, amounts, cost):
+        self.lane = lane
+        self.amounts = amounts
+        self.cost = cost
+        self.released = False
+
+
+class AdmissionController:
+    """メモリ / CPU 時間の予算と、interactive / bulk の待ち行列"""
+
+    def __init__(self, memory_mb=None, cpu_sec=None, bulk_cpu_sec=None, bulk_share=None,
+                 max_queue=None, queue_timeout=None):
+        self.capacity = {
+            "memory_mb": ADMISSION_MEMORY_MB if memory_mb is None else memory_mb,
+            "cpu_sec": ADMISSION_CPU_SEC if cpu_sec is None else cpu_sec,
+        }
+        self.bulk_cpu_sec = ADMISSION_BULK_CPU_SEC if bulk_cpu_sec is None else bulk_cpu_sec
+        self.bulk_share = ADMISSION_BULK_SHARE if bulk_share is None else bulk_share
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = dict(QUEUE_TIMEOUT, **(queue_timeout or {}))
+        self.in_use = dict.fromkeys(self.capacity, 0.0)
+        self._queues = {lane: deque() for lane in LANES}
+        self._lanes = {lane: {
+            "running": 0, "admitted": 0, "rejected": 0, "wait_sec_total": 0.0, "max_wait_sec": 0.0,
+            "in_use": dict.fromkeys(self.capacity, 0.0),
+        } for lane in LANES}
+
+    def lane_for(self, cost, priority=None):
+        """レーンを決める。priority="bulk" の指定で bulk に下げられる (interactive への引き上げはしない)"""
+        if priority == "bulk" or cost.cpu_sec >= self.bulk_cpu_sec:
+            return "bulk"
+        return "interactive"
+
+    def _limit(self, lane, key):
+        return self.capacity[key] * (self.bulk_share if lane == "bulk" else 1.0)
+
+    def _fits(self, lane, amounts):
+        return all(self.in_use[key] + value <= self._limit(lane, key) + 1e-9 for key, value in amounts.items())
+
+    def _blocked(self, lane):
+        # 同じレーンに先に待っているものがある、または bulk で interactive が待っている場合は後ろに並ぶ
+        return bool(self._queues[lane]) or (lane == "bulk" and bool(self._queues["interactive"]))
+
+    def retry_after(self):
+        """実行中の CPU 時間の見積もりをコア数で消化し終えるまでの秒数"""
+        seconds = math.ceil(self.in_use["cpu_sec"] / (os.cpu_count() or 1))
+        return max(1, min(RETRY_AFTER_MAX, seconds))
+
+    def _take(self, reservation):
+        lane = self._lanes[reservation.lane]
+        for key, value in reservation.amounts.items():
+            self.in_use[key] += value
+            lane["in_use"][key] += value
+        lane["running"] += 1
+        lane["admitted"] += 1
+
+    def _reject(self, lane, message):
+        self._lanes[lane]["rejected"] += 1
+        return AdmissionRejected(message, self.retry_after())
+
+    async def acquire(self, cost, priority=None):
+        """予算を確保する。空きがなければ待ち行列に並び、通らない場合は AdmissionRejected"""
+        lane = self.lane_for(cost, priority)
+        # 1件で予算を超える見積もりは予算いっぱいとして扱う (他に実行中のものがなくなれば通す)
+        amounts = {
+            "memory_mb": min(cost.memory_mb, self._limit(lane, "memory_mb")),
+            "cpu_sec": min(cost.cpu_sec, self._limit(lane, "cpu_sec")),
+        }
+        reservation = Reservation(lane, amounts, cost)
+        if not self._blocked(lane) and self._fits(lane, amounts):
+            self._take(reservation)
+            return reservation
+
+        queue = self._queues[lane]
+        if len(queue) >= self.max_queue:
+            raise self._reject(lane, "混雑しているため受け付けられません。しばらくしてから再度お試しください。")
+        entry = (reservation, asyncio.get_running_loop().create_future())
+        queue.append(entry)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(entry[1], self.queue_timeout[lane])
+        except asyncio.TimeoutError:
+            raise self._reject(lane, "処理待ちの時間が上限を超えました。しばらくしてから再度お試しください。")
+        finally:
+            waited = time.monotonic() - started
+            stats = self._lanes[lane]
+            stats["wait_sec_total"] += waited
+            stats["max_wait_sec"] = max(stats["max_wait_sec"], waited)
+            if entry in queue:
+                # タイムアウト・取り消しで抜けた場合は、後ろに並んでいるものを通せるか確認する
+                queue.remove(entry)
+                self._grant()
+        return reservation
+
+    def release(self, reservation):
+        """確保した予算を返す (2回目以降の呼び出しは何もしない)"""
+        if reservation.released:
+            return
+        reservation.released = True
+        lane = self._lanes[reservation.lane]
+        for key, value in reservation.amounts.items():
+            self.in_use[key] = max(0.0, self.in_use[key] - value)
+            lane["in_use"][key] = max(0.0, lane["in_use"][key] - value)
+        lane["running"] -= 1
+        self._grant()
+
+    def _grant(self):
+        """待ち行列の先頭から、予算に収まるものを interactive → bulk の順に通す"""
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue:
+                reservation, future = queue[0]
+                if future.done():
+                    queue.popleft()
+                    continue
+                if not self._fits(lane, reservation.amounts):
+                    break
+                queue.popleft()
+                self._take(reservation)
+                future.set_result(True)
+            if queue:
+                # interactive が待っている間は bulk を通さない
+                return
+
+    @asynccontextmanager
+    async def admit(self, cost, priority=None):
+        reservation = await self.acquire(cost, priority)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+    def snapshot(self):
+        """予算とレーンごとの使用状況"""
+        return {
+            "budgets": {key: {
+                "capacity": capacity,
+                "in_use": self.in_use[key],
+                "utilization": self.in_use[key] / capacity if capacity else 0.0,
+            } for key, capacity in self.capacity.items()},
+            "lanes": {lane: dict(stats, queued=len(self._queues[lane]), in_use=dict(stats["in_use"]))
+                      for lane, stats in self._lanes.items()},
+        }
+
+
+_controller = None
+
+
+def get_controller():
+    """プロセス共通の AdmissionController (初回呼び出し時に環境変数の設定で作る)"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
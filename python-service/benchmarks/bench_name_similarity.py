@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+業者名の類似度判定のベンチマーク (n-gram コサイン類似度 vs レーベンシュタイン距離の総当たり)
+
+    cd python-service
+    python -m benchmarks.bench_name_similarity [--names 100000] [--nested-sample 200] [--top-k 5]
+
+target に N 件の業者名、query にその表記ゆれ (法人格の表記違い・OCR の誤認識1文字) を N 件用意し、
+  vectorized: name_similarity.top_k_similar による N×N の上位 k 件検索
+  nested    : match_lambda.within_distance による総当たり (nested-sample 件の query で計測し N 件に換算)
+の所要時間、ピークメモリ、正解 (同じ番号の target) を拾えた割合を JSON で出力する。
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from match_lambda import remove_spaces_and_to_fullwidth, within_distance
+from name_similarity import top_k_similar
+
+# 人名・地名でよく使われる漢字 + カタカナ
+CHARS = (
+    "山田本川中村井上小林佐藤高橋伊藤渡辺加藤吉木松清水森池石原藤岡野東西南北大和光栄"
+    "新日丸三菱住友富士平安長谷部岩崎島宮城福浜横千葉沢口谷坂内外金銀鈴竹梅桜松菊"
+    "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+)
+KINDS = ["工務店", "建設", "設備", "電気", "塗装", "リフォーム", "管工業", "内装", "住建", "産業"]
+LEGAL_FORMS = [("株式会社", ""), ("", "(株)"), ("有限会社", ""), ("", "(有)"), ("", "")]
+OCR_CONFUSIONS = {"工": "エ", "力": "カ", "口": "ロ", "二": "ニ", "田": "由", "木": "本", "ー": "一"}
+
+
+def make_names(count, rng):
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(CHARS) for _ in range(rng.randint(2, 4))) + rng.choice(KINDS))
+    return sorted(names)
+
+
+def make_variant(name, rng):
+    """法人格の表記を付け替え、OCR で誤りやすい文字を1つ置き換える"""
+    chars = list(name)
+    positions = [i for i, ch in enumerate(chars) if ch in OCR_CONFUSIONS]
+    if positions:
+        i = rng.choice(positions)
+        chars[i] = OCR_CONFUSIONS[chars[i]]
+    prefix, suffix = rng.choice(LEGAL_FORMS)
+    return prefix + "".join(chars) + suffix
+
+
+def bench_vectorized(queries, targets, top_k):
+    started = time.perf_counter()
+    indexes, _ = top_k_similar(queries, targets, k=top_k, min_score=0.5)
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc は処理を遅くするため、ピークメモリは別の実行で計測する
+    tracemalloc.start()
+    top_k_similar(queries, targets, k=top_k, min_score=0.5)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    recall = sum(i in row for i, row in enumerate(indexes.tolist())) / len(queries)
+    return {"elapsed_sec": elapsed, "peak_mb": peak / (1024 * 1024), "recall": recall}
+
+
+def bench_nested(queries, targets, sample):
+    queries = [remove_spaces_and_to_fullwidth(q) for q in queries]
+    targets = [remove_spaces_and_to_fullwidth(t) for t in targets]
+    sampled = list(range(0, len(queries), max(1, len(queries) // sample)))[:sample]
+    started = time.perf_counter()
+    hits = 0
+    for qi in sampled:
+        matched = [ti for ti, target in enumerate(targets) if within_distance(queries[qi], target)]
+        hits += qi in matched
+    elapsed = time.perf_counter() - started
+    return {
+        "sampled_queries": len(sampled),
+        "elapsed_sec": elapsed,
+        "estimated_full_sec": elapsed * len(queries) / len(sampled),
+        "recall": hits / len(sampled),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--names", type=int, default=100000)
+    parser.add_argument("--nested-sample", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    targets = make_names(args.names, rng)
+    queries = [make_variant(name, rng) for name in targets]
+
+    result = {
+        "names": args.names,
+        "vectorized": bench_vectorized(queries, targets, args.top_k),
+        "nested": bench_nested(queries, targets, args.nested_sample),
+    }
+    result["speedup"] = result["nested"]["estimated_full_sec"] / result["vectorized"]["elapsed_sec"]
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+ページ画像のワーカープロセスへの受け渡しコストのベンチマーク
+
+    cd python-service
+    python -m benchmarks.bench_page_handoff [--pages 40] [--workers 4] [--dpi 200]
+
+以下の方式で同じページ (OCR と同じグレースケール(L)の画像) をワーカーに渡し、
+ワーカー側でタイルを切り出して画素を読む:
+  pickle : PIL Image をそのまま submit (pickle でコピー)
+  png    : 親で PNG エンコード → bytes を submit → ワーカーでデコード (旧実装の方式)
+  shared : page_buffers のリングに書き込み、パスとサイズだけを submit
+1ページあたりのコピー量 (プロセス間で pickle されたバイト数 + 共有バッファへの書き込み量
++ PNG の展開量) と
+スループット (pages/s) を JSON で出力する。OCR 自体の時間は含まない。
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from ocr_tiling import plan_tiles
+from page_buffers import PageBufferRing, open_page_view
+
+
+def make_page(dpi):
+    """A4 サイズの白地に文字行を並べたページ画像 (ラスタライズと同じグレースケール(L))"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    image = Image.new("L", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(dpi // 2, height - dpi // 2, dpi // 6):
+        draw.text((dpi // 2, y), f"請求書 明細 {y:06d} 金額 100,000 円 サンプルマンション 101号室" * 2, fill="black")
+    return image
+
+
+def _touch(image):
+    # OCR の代わりにタイルを切り出して画素を読む
+    tile = plan_tiles(image.width, image.height)[0]
+    return sum(image.crop((0, tile.top, image.width, tile.bottom)).histogram())
+
+
+def work_pickle(image):
+    return _touch(image)
+
+
+def work_png(data):
+    return _touch(Image.open(io.BytesIO(data)))
+
+
+def work_shared(path, width, height):
+    with open_page_view(path, width, height) as page:
+        return _touch(page)
+
+
+def run(mode, page, pages, pool, workers):
+    ipc_bytes = 0
+    buffer_bytes = 0
+    decoded_bytes = 0
+    started = time.perf_counter()
+
+    if mode == "shared":
+        with PageBufferRing(workers * 2) as ring:
+            futures = []
+            for _ in range(pages):
+                buf = ring.acquire()
+                buf.write(page)
+                buffer_bytes += buf.width * buf.height
+                args = (buf.path, buf.width, buf.height)
+                ipc_bytes += len(pickle.dumps(args))
+                future = pool.submit(work_shared, *args)
+                future.add_done_callback(lambda _, buf=buf: ring.release(buf))
+                futures.append(future)
+            for future in futures:
+                future.result()
+    else:
+        futures = []
+        for _ in range(pages):
+            if mode == "png":
+                output = io.BytesIO()
+                page.save(output, format="PNG")
+                args = (output.getvalue(),)
+                func = work_png
+                # ワーカー側で PNG を展開した画素
+                decoded_bytes += page.width * page.height * len(page.getbands())
+            else:
+                args = (page,)
+                func = work_pickle
+            ipc_bytes += len(pickle.dumps(args))
+            futures.append(pool.submit(func, *args))
+        for future in futures:
+            future.result()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "pages_per_sec": pages / elapsed,
+        "ipc_bytes_per_page": ipc_bytes // pages,
+        "buffer_write_bytes_per_page": buffer_bytes // pages,
+        "decoded_bytes_per_page": decoded_bytes // pages,
+        "bytes_copied_per_page": (ipc_bytes + buffer_bytes + decoded_bytes) // pages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dpi", type=int, default=200)
+    args = parser.parse_args()
+
+    # 画像の形式による差が混ざらないよう、全方式で同じページを渡す
+    page = make_page(args.dpi)
+
+    results = {}
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # ワーカー起動コストを計測から除外する
+        list(pool.map(work_pickle, [page] * args.workers))
+        for mode in ("pickle", "png", "shared"):
+            results[mode] = run(mode, page, args.pages, pool, args.workers)
+
+    print(json.dumps({
+        "page_size": list(page.size),
+        "mode": page.mode,
+        "pages": args.pages,
+        "workers": args.workers,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
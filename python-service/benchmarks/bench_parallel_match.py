@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+突合の明細検索の並列化 (parallel_match.shard_matches) のベンチマーク
+
+    cd python-service
+    python -m benchmarks.bench_parallel_match [--rows 200000] [--workers 1,2,4,8] [--tolerance 100]
+
+発注 N 行と、その請求明細 N 行 (業者名の表記ゆれ・金額のずれ・突合できない行を含む) を用意し、
+  prepare : 名称の正規化・類似度・インデックス作成 (match_lambda.prepare_match。逐次・共通)
+  serial  : InvoiceMatcher.first_match を CSV の行順に呼ぶ逐次処理
+  workers : shard_matches をワーカー数ごとに実行 (受け渡しを含む。cold はプロセスプールの起動も含む)
+の所要時間、逐次処理に対する速度向上、区間の境界をまたいで親プロセスで処理した行の割合を JSON で出力する。
+並列の結果が逐次処理と一致しない場合はエラーにする。
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from match_lambda import InvoiceIndex, prepare_match
+from parallel_match import AMOUNT_BUCKET, SHARDS_PER_WORKER, partition, shard_matches
+
+VENDORS = ["山田工務店", "佐藤設備", "高橋電気", "鈴木塗装", "田中リフォーム", "伊藤管工業", "渡辺内装", "中村住建"]
+BUILDINGS = ["サンプルマンション", "グリーンハイツ", "パークコート", "リバーサイド", "サンライズ"]
+
+
+def make_rows(count, rng):
+    orders, invoices = [], []
+    for n in range(count):
+        vendor = rng.choice(VENDORS) + str(n % 50)
+        building = rng.choice(BUILDINGS) + str(n % 200)
+        room = rng.randint(101, 1210)
+        amount = rng.randint(50, 20000) * 100
+        orders.append({"業者ID": n, "業者名": vendor, "建物名": building, "番号": room, "支払金額": amount})
+        # 約1割は突合できない (金額違い)、一部は法人格付き・金額の端数ずれ
+        invoices.append({
+            "発注番号": f"A-{n}", "物件名": building, "部屋番号": f"{room}号室",
+            "工事業者名": rng.choice([vendor, vendor, "株式会社" + vendor]),
+            "金額": amount + (50000 if rng.random() < 0.1 else rng.choice([0, 0, 0, 100])),
+        })
+    rng.shuffle(invoices)
+    return orders, invoices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8) if n <= (os.cpu_count() or 1) * 2))
+    parser.add_argument("--tolerance", type=int, default=100)
+    parser.add_argument("--amount-bucket", type=int, default=AMOUNT_BUCKET)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    orders, invoices = make_rows(args.rows, random.Random(args.seed))
+
+    started = time.perf_counter()
+    index = InvoiceIndex(invoices)
+    keys, matcher = prepare_match(orders, index, args.tolerance, 0, 0.8, False)
+    prepare_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    serial = [matcher.first_match(key) for key in keys]
+    serial_sec = time.perf_counter() - started
+
+    result = {
+        "rows": args.rows,
+        "cpu_count": os.cpu_count(),
+        "matched": sum(i is not None for i in serial),
+        "prepare_sec": prepare_sec,
+        "serial_sec": serial_sec,
+        "workers": {},
+    }
+    for workers in [int(n) for n in args.workers.split(",") if n]:
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            matches = shard_matches(keys, matcher, workers, args.amount_bucket)
+            timings.append(time.perf_counter() - started)
+            if matches != serial:
+                raise SystemExit(f"workers={workers}: 結果が逐次処理と一致しません")
+        _, fallback = partition(keys, index, workers * SHARDS_PER_WORKER, args.amount_bucket)
+        result["workers"][workers] = {
+            "fallback_ratio": len(fallback) / len(keys),
+            "cold_sec": timings[0],
+            "elapsed_sec": timings[1],
+            "speedup": serial_sec / timings[1],
+        }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+PDF テキスト抽出バックエンドの比較ベンチマーク
+
+    cd python-service
+    python -m benchmarks.bench_pdf_text [--pdf tests/data/sample_invoice.pdf]
+                                        [--reference tests/data/sample_invoice.txt] [--repeat 20]
+
+インストール済みのバックエンド (pdf_text.BACKENDS) ごとに以下を JSON で出力する:
+  pages_per_sec : 全ページ抽出のスループット
+  first_page_ms : 先頭ページのみ抽出 (pages="1") にかかる時間
+  fidelity      : 正解テキストとの文字一致度 (空白を除いた SequenceMatcher の ratio)
+  char_recall   : 正解テキストの文字 (多重集合) のうち抽出結果に含まれる割合
+"""
+import argparse
+import difflib
+import json
+import os
+import re
+import time
+from collections import Counter
+
+from pdf_text import BACKENDS, extract_pages, page_count
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PDF = os.path.join(SERVICE_DIR, "tests", "data", "sample_invoice.pdf")
+SAMPLE_TEXT = os.path.join(SERVICE_DIR, "tests", "data", "sample_invoice.txt")
+
+
+def _strip_spaces(text):
+    return re.sub(r"\s+", "", text)
+
+
+def fidelity(extracted, reference):
+    a, b = _strip_spaces(extracted), _strip_spaces(reference)
+    ratio = difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+    expected = Counter(b)
+    found = Counter(a)
+    recall = sum(min(count, found[ch]) for ch, count in expected.items()) / max(1, sum(expected.values()))
+    return ratio, recall
+
+
+def bench(backend_cls, pdf_bytes, reference, repeat):
+    backend = backend_cls()
+    pages = page_count(pdf_bytes, backend)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        texts = extract_pages(pdf_bytes, backend=backend)
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        extract_pages(pdf_bytes, pages="1", backend=backend)
+    first_page = (time.perf_counter() - started) / repeat
+
+    result = {
+        "pages": pages,
+        "pages_per_sec": pages * repeat / elapsed,
+        "first_page_ms": first_page * 1000,
+        "chars": sum(len(t) for t in texts),
+    }
+    if reference is not None:
+        result["fidelity"], result["char_recall"] = fidelity("\n".join(texts), reference)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default=SAMPLE_PDF)
+    parser.add_argument("--reference", default=SAMPLE_TEXT, help="正解テキスト (省略時は fidelity を計測しない)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+    reference = None
+    if args.reference:
+        with open(args.reference, encoding="utf-8") as f:
+            reference = f.read()
+
+    results = {}
+    for name, backend_cls in BACKENDS.items():
+        if not backend_cls.available():
+            results[name] = {"available": False}
+            continue
+        try:
+            results[name] = bench(backend_cls, pdf_bytes, reference, args.repeat)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    print(json.dumps({"pdf": args.pdf, "repeat": args.repeat, "backends": results}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+起動時間ベンチマーク
+
+    cd python-service
+    python -m benchmarks.bench_startup [--runs 5] [--warm-up]
+
+1) python -X importtime で各エントリーポイントの import 時間を計測
+2) uvicorn を起動してから /api/v1/health が最初に 200 を返すまでの時間を計測
+結果は JSON で標準出力に書き出す (経時比較用)。
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["main", "parse_order_lambda", "parse_invoice_lambda", "match_lambda", "wrapper"]
+
+
+def measure_import(module, env):
+    """-X importtime の出力から (累積時間[us], self時間の上位モジュール) を返す"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    entries = []
+    total_us = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+        if name.strip() == module:
+            total_us = int(cumulative_us)
+    top = sorted(entries, key=lambda e: e[1], reverse=True)[:5]
+    return total_us, [{"module": n, "self_us": s} for n, s, _ in top]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_health(env, timeout=30.0):
+    """uvicorn 起動から /api/v1/health の最初の 200 応答までの秒数"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/api/v1/health"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as res:
+                    if res.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("health check did not respond in time")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true", help="WARM_UP_ON_STARTUP=1 で計測する")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["WARM_UP_ON_STARTUP"] = "1" if args.warm_up else "0"
+
+    imports = {}
+    for module in MODULES:
+        totals = []
+        top = []
+        for _ in range(args.runs):
+            total_us, top = measure_import(module, env)
+            totals.append(total_us)
+        imports[module] = {"median_ms": statistics.median(totals) / 1000, "top_self": top}
+
+    health = [measure_first_health(env) for _ in range(args.runs)]
+
+    print(json.dumps({
+        "python": sys.version.split()[0],
+        "warm_up": args.warm_up,
+        "runs": args.runs,
+        "import_time": imports,
+        "first_health_ms": {
+            "median": statistics.median(health) * 1000,
+            "min": min(health) * 1000,
+            "max": max(health) * 1000,
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
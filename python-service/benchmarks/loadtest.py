@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+FastAPI アプリ (main.py) の負荷試験
+
+    cd python-service
+    python -m benchmarks.loadtest [--server asgi|uvicorn] [--concurrency 8] [--requests 200]
+                                  [--mix health=1,orders=4,invoices=2,invoices_ocr=1,match=1]
+                                  [--llm-latency 0.5] [--llm-rate-limit-ratio 0.0]
+                                  [--orders-rows 200] [--orders-format csv|xlsx] [--output result.json]
+
+- asgi   : 同一プロセス内で httpx.ASGITransport 経由でアプリを呼び出す
+- uvicorn: uvicorn をサブプロセスで起動して HTTP で呼び出す
+OpenAI は mock_openai のモックサーバーで代替する (遅延と 429 の割合を指定可能)。
+エンドポイントごとの p50/p95/p99 レイテンシ・スループット・エラー率と、サーバープロセスのピーク RSS を
+JSON で出力する。RSS は全エンドポイントで共有するプロセスの値のため、エンドポイントごとのメモリ使用量は
+--mix で1種類だけを指定して (例: --mix orders=1) 個別に計測する。
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_INVOICE = os.path.join(SERVICE_DIR, "tests", "data", "sample_invoice.pdf")
+ORDER_HEADERS = ["業者ID", "業者名", "建物名", "番号", "受付内容", "支払金額", "完工日", "支払日", "請求日"]
+DEFAULT_MIX = "health=1,orders=4,invoices=2,invoices_ocr=1,match=1"
+
+
+def generate_orders(rows, fmt):
+    """発注データ (CSV / Excel) を生成して (ファイル名, バイト列) を返す"""
+    data = [
+        [10000 + i, f"テスト工事会社{i % 50}", f"サンプルマンション{i % 30}", 101 + i % 20, "修繕工事",
+         10000 * (1 + i % 40), "2025-02-21", "2025-03-21", "2025-02-21"]
+        for i in range(rows)
+    ]
+    if fmt == "xlsx":
+        import openpyxl
+
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["会社別発注リスト"])
+        ws.append(ORDER_HEADERS)
+        for row in data:
+            ws.append(row)
+        output = io.BytesIO()
+        wb.save(output)
+        return "orders.xlsx", output.getvalue()
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(ORDER_HEADERS)
+    writer.writerows(data)
+    return "orders.csv", output.getvalue().encode("utf-8")
+
+
+def build_requests(orders_file, invoice_pdf):
+    """エンドポイント名 → httpx.request に渡す引数"""
+    orders_name, orders_bytes = orders_file
+    orders_type = "text/csv" if orders_name.endswith(".csv") else "application/octet-stream"
+    return {
+        "health": lambda: ("GET", "/api/v1/health", {}),
+        "orders": lambda: ("POST", "/api/v1/orders/parse", {
+            "files": {"file": (orders_name, orders_bytes, orders_type)},
+        }),
+        "invoices": lambda: ("POST", "/api/v1/invoices/parse", {
+            "files": {"file": ("invoice.pdf", invoice_pdf, "application/pdf")},
+        }),
+        "invoices_ocr": lambda: ("POST", "/api/v1/invoices/parse", {
+            "files": {"file": ("invoice.pdf", invoice_pdf, "application/pdf")},
+            "params": {"use_ocr": "true"},
+        }),
+        "match": lambda: ("POST", "/api/v1/match", {
+            "files": {
+                "orders_file": (orders_name, orders_bytes, orders_type),
+                "invoices_file": ("invoice.pdf", invoice_pdf, "application/pdf"),
+            },
+        }),
+    }
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def current_rss(pid):
+    """プロセスの現在の RSS (bytes)。/proc が使えない場合は自プロセスの最大 RSS"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_uvicorn(env):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_healthy(client, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/api/v1/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("server did not become healthy")
+
+
+async def run_load(client, requests, weights, total, concurrency, server_pid, seed):
+    import httpx
+
+    rng = random.Random(seed)
+    names = [name for name in weights if name in requests]
+    plan = rng.choices(names, weights=[weights[n] for n in names], k=total)
+
+    stats = {name: {"latencies": [], "errors": 0, "statuses": {}} for name in names}
+    peak_rss = current_rss(server_pid)
+    queue = asyncio.Queue()
+    for name in plan:
+        queue.put_nowait(name)
+
+    async def worker():
+        nonlocal peak_rss
+        while True:
+            try:
+                name = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            method, url, kwargs = requests[name]()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            # ASGI モードではアプリの同期処理中にサンプラーが動けないため完了時にも記録する
+            peak_rss = max(peak_rss, current_rss(server_pid))
+            stats[name]["latencies"].append(time.perf_counter() - started)
+            stats[name]["statuses"][str(status)] = stats[name]["statuses"].get(str(status), 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                stats[name]["errors"] += 1
+
+    async def sample_rss(stop):
+        nonlocal peak_rss
+        while not stop.is_set():
+            peak_rss = max(peak_rss, current_rss(server_pid))
+            await asyncio.sleep(0.02)
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    endpoints = {}
+    for name, s in stats.items():
+        count = len(s["latencies"])
+        if not count:
+            continue
+        ms = [v * 1000 for v in s["latencies"]]
+        endpoints[name] = {
+            "requests": count,
+            "throughput_rps": count / elapsed,
+            "error_rate": s["errors"] / count,
+            "statuses": s["statuses"],
+            "latency_ms": {
+                "p50": percentile(ms, 50),
+                "p95": percentile(ms, 95),
+                "p99": percentile(ms, 99),
+                "mean": statistics.fmean(ms),
+                "max": max(ms),
+            },
+        }
+
+    all_errors = sum(s["errors"] for s in stats.values())
+    return {
+        "elapsed_sec": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed,
+        "error_rate": all_errors / total if total else 0,
+        # サーバープロセス全体のピーク (エンドポイント別ではない)
+        "peak_rss_mb": peak_rss / (1024 * 1024),
+        "endpoints": endpoints,
+    }
+
+
+async def main_async(args):
+    import httpx
+    from mock_openai import create_mock_app, start_mock_server
+
+    llm_app = create_mock_app(latency=args.llm_latency, rate_limit_ratio=args.llm_rate_limit_ratio, seed=args.seed)
+    llm_base_url, stop_llm = start_mock_server(llm_app)
+
+    env = dict(os.environ)
+    env.update({"OPENAI_API_KEY": "loadtest", "OPENAI_BASE_URL": llm_base_url})
+
+    with open(args.invoice_pdf, "rb") as f:
+        invoice_pdf = f.read()
+    requests = build_requests(generate_orders(args.orders_rows, args.orders_format), invoice_pdf)
+    timeout = httpx.Timeout(args.timeout)
+
+    proc = None
+    try:
+        if args.server == "uvicorn":
+            proc, base_url = start_uvicorn(env)
+            client = httpx.AsyncClient(base_url=base_url, timeout=timeout,
+                                       limits=httpx.Limits(max_connections=args.concurrency))
+            server_pid = proc.pid
+        else:
+            os.environ.update(env)
+            sys.path.insert(0, SERVICE_DIR)
+            from main import app
+
+            # アプリの例外はサーバーと同様に 500 として集計する
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            client = httpx.AsyncClient(transport=transport, base_url="http://loadtest",
+                                       timeout=timeout)
+            server_pid = os.getpid()
+
+        async with client:
+            await wait_until_healthy(client)
+            result = await run_load(client, requests, parse_mix(args.mix), args.requests, args.concurrency,
+                                    server_pid, args.seed)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        stop_llm()
+
+    result["llm_mock"] = {"calls": llm_app.state.calls, "rate_limited": llm_app.state.rate_limited}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="エンドポイント=重み のカンマ区切り")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--orders-rows", type=int, default=200)
+    parser.add_argument("--orders-format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--invoice-pdf", default=SAMPLE_INVOICE)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果 JSON の出力先 (省略時は標準出力)")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        **result,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+突合結果 (match_lambda の diff_row) の XLSX / CSV エクスポート
+
+    iter_csv(diff_rows, encoding="cp932")   # CSV をバイト列のチャンクで返すジェネレーター
+    iter_xlsx(diff_rows)                    # XLSX をバイト列のチャンクで返すジェネレーター
+
+diff_rows はイテラブルであればよく (match_lambda.iter_diff_rows など)、1行ずつ書き出すため
+全行をメモリに保持しない。XLSX は openpyxl の write-only モードで一時ファイルに書き出してから
+チャンクで返す (ZIP の構造上、書き終わるまで先頭を送れないため)。
+
+値は OCR / LLM の出力やアップロードされた CSV に由来するため、どちらの形式でも
+XML で使えない制御文字 (Tesseract の改ページ \x0c など) を取り除き、数式として解釈される
+文字 (= + - @ タブ CR) で始まる文字列は先頭に「'」を付けて文字列として書き出す。
+"""
+import codecs
+import csv
+import io
+import re
+import tempfile
+
+from match_lambda import EXPECTED_HEADERS
+
+EXPORT_FORMATS = ("xlsx", "csv")
+# utf-8 は Excel で文字化けしないよう BOM を付ける
+CSV_ENCODINGS = ("utf-8", "cp932")
+# CSV をまとめて返す行数 / ファイルを読み出すチャンクの大きさ
+CSV_CHUNK_ROWS = 1000
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Excel の最大行数 (条件付き書式の適用範囲)
+MAX_XLSX_ROWS = 1048576
+# ステータスごとの背景色 (OK: 緑, DIFF: 赤)
+STATUS_COLORS = {"OK": "C6EFCE", "DIFF": "FFC7CE"}
+
+# openpyxl.cell.cell.ILLEGAL_CHARACTERS_RE と同じ (CSV だけを書き出す場合に openpyxl を読み込まないため)
+ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+# 表計算ソフトで数式として解釈される先頭文字
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+
+
+def export_columns():
+    """(diff_row のキー, 見出し) のリスト。発注側と請求書側の同じ項目を隣り合わせに並べる"""
+    columns = [("status", "ステータス")]
+    for header in EXPECTED_HEADERS:
+        columns.append((f"csv_{header}", f"発注_{header}"))
+        columns.append((f"pdf_{header}", f"請求書_{header}"))
+    return columns
+
+
+def iter_csv(diff_rows, encoding="utf-8", chunk_rows=CSV_CHUNK_ROWS):
+    """
+    CSV をエンコード済みのチャンクで返す。
+    cp932 で表せない文字 (一部の異体字など) は「?」に置き換える。
+    """
+    if encoding not in CSV_ENCODINGS:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+    encoder = codecs.getincrementalencoder(encoding)(errors="replace")
+    columns = export_columns()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\r\n")
+
+    if encoding == "utf-8":
+        yield codecs.BOM_UTF8
+    writer.writerow([label for _, label in columns])
+
+    pending = 1
+    for row in diff_rows:
+        writer.writerow([_cell_value(row.get(key, "")) for key, _ in columns])
+        pending += 1
+        if pending >= chunk_rows:
+            yield encoder.encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield encoder.encode(buffer.getvalue(), final=True)
+
+
+def write_xlsx(diff_rows, fileobj):
+    """
+    write-only のワークブックに1行ずつ書き出し、fileobj に保存する。
+    OK / DIFF の色分けは条件付き書式で行う (セルごとに書式を設定すると書き出しが大幅に遅くなるため)。
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("突合結果")
+    columns = export_columns()
+    ws.freeze_panes = "B2"
+
+    # 1列目 (ステータス) の値で行全体を色分けする
+    data_range = f"A2:{get_column_letter(len(columns))}{MAX_XLSX_ROWS}"
+    for status, color in STATUS_COLORS.items():
+        fill = PatternFill("solid", start_color=color, end_color=color)
+        ws.conditional_formatting.add(data_range, FormulaRule(formula=[f'$A2="{status}"'], fill=fill))
+
+    bold = Font(bold=True)
+    header = []
+    for _, label in columns:
+        cell = WriteOnlyCell(ws, value=label)
+        cell.font = bold
+        header.append(cell)
+    ws.append(header)
+
+    for row in diff_rows:
+        ws.append([_cell_value(row.get(key, "")) for key, _ in columns])
+
+    wb.save(fileobj)
+
+
+def iter_xlsx(diff_rows, chunk_size=FILE_CHUNK_SIZE):
+    """XLSX を一時ファイルに書き出し、チャンクで返す"""
+    with tempfile.TemporaryFile(suffix=".xlsx") as f:
+        write_xlsx(diff_rows, f)
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_export(diff_rows, fmt="xlsx", encoding="utf-8"):
+    """形式に応じたエクスポートのジェネレーター"""
+    if fmt == "xlsx":
+        return iter_xlsx(diff_rows)
+    if fmt == "csv":
+        return iter_csv(diff_rows, encoding)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def _cell_value(value):
+    # 空文字は空セル (XLSX では要素自体を書き出さない)、dict / list などは文字列にする
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    value = ILLEGAL_CHARACTERS_RE.sub("", str(value))
+    if value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value or None
@@ -0,0 +1,203 @@
+"""
+共有 LLM クライアント
+
+- keep-alive 接続プール (httpx.AsyncClient)
+- リクエスト数 / トークン数のトークンバケットによるレート制限
+- 同一プロンプトの同時実行を1回の API 呼び出しにまとめる (single-flight)
+- 429 / 5xx / 接続エラー時のジッター付き指数バックオフによるリトライ
+
+設定は環境変数で行う:
+    OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MODEL, LLM_MAX_CONNECTIONS,
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES, LLM_TIMEOUT
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+DEFAULT_MODEL = "gpt-4o"
+
+
+class TokenBucket:
+    """一定レートで補充されるトークンバケット。acquire は先着順に待機する"""
+
+    def __init__(self, rate_per_sec, capacity):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_sec)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        # 容量を超える要求はバケットが満タンになった時点で通す
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_sec)
+
+
+def estimate_tokens(messages, max_tokens):
+    """トークン数の概算 (日本語は1文字≒1トークンとして保守的に見積もる)"""
+    return sum(len(m.get("content", "")) for m in messages) + max_tokens
+
+
+class LLMClient:
+    """
+    Chat Completions API の非同期クライアント。
+    1つのイベントループ内で共有して使う (get_llm_client を参照)。
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        model=None,
+        max_connections=None,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries=None,
+        timeout=None,
+        base_delay=0.5,
+        max_delay=30.0,
+    ):
+        import httpx
+        import openai
+
+        self.model = model or os.getenv("LLM_MODEL", DEFAULT_MODEL)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "5"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "10"))
+        timeout = timeout or float(os.getenv("LLM_TIMEOUT", "120"))
+        requests_per_minute = requests_per_minute or float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+        tokens_per_minute = tokens_per_minute or float(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+
+        self.request_bucket = TokenBucket(requests_per_minute / 60, max(1, requests_per_minute / 60))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+        # リトライは自前で行うため SDK 側のリトライは無効化する
+        self._client = openai.AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+            http_client=self._http_client,
+            max_retries=0,
+        )
+        self._inflight = {}
+        self.stats = {"api_calls": 0, "coalesced": 0, "retries": 0}
+
+    async def complete(self, messages, max_tokens=4000, temperature=0, model=None):
+        """
+        メッセージを送信して応答テキストを返す。
+        同じ内容のリクエストが実行中であれば、その結果を共有する。
+        """
+        model = model or self.model
+        key = hashlib.sha256(json.dumps(
+            [model, messages, max_tokens, temperature], ensure_ascii=False, sort_keys=True
+        ).encode("utf-8")).hexdigest()
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._complete_with_retry(messages, max_tokens, temperature, model))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+
+        # 待機側がキャンセルされても共有タスクは止めない
+        return await asyncio.shield(task)
+
+    async def _complete_with_retry(self, messages, max_tokens, temperature, model):
+        import openai
+
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(estimate_tokens(messages, max_tokens))
+            try:
+                self.stats["api_calls"] += 1
+                response = await self._client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+                # ツール呼び出しや拒否の応答では content が None になる
+                return (response.choices[0].message.content or "").strip()
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff_delay(attempt, e))
+
+    def _backoff_delay(self, attempt, error):
+        """full jitter の指数バックオフ。Retry-After ヘッダーがあればそれ以上待つ"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        return delay
+
+    async def aclose(self):
+        await self._http_client.aclose()
+
+
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def get_llm_client():
+    """実行中のイベントループごとに共有される LLMClient を返す"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None:
+            client = LLMClient()
+            _clients[loop] = client
+        return client
+
+
+_background_loop = None
+
+
+def _get_background_loop():
+    """同期呼び出し用のイベントループ (常駐スレッド) を返す"""
+    global _background_loop
+    with _clients_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="llm-client", daemon=True).start()
+        return _background_loop
+
+
+def complete_sync(messages, **kwargs):
+    """
+    同期コードから共有クライアントを使うためのラッパー。
+    常駐ループ上で実行するため、呼び出しをまたいで接続プールが再利用される。
+    """
+    async def run():
+        return await get_llm_client().complete(messages, **kwargs)
+
+    return asyncio.run_coroutine_threadsafe(run(), _get_background_loop()).result()
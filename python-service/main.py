@@ -1,22 +1,25 @@
+import asyncio
 import os
 import sys
+import time
 import traceback
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
-from typing import Optional
+from typing import Any, Dict, List, Optional
 import json
-import pandas as pd
-import PyPDF2
-from pdf2image import convert_from_bytes
-import pytesseract
 import io
 
-# Import mock OpenAI for testing
-if not os.getenv("OPENAI_API_KEY"):
-    from mock_openai import Client as OpenAIClient
-else:
-    from openai import Client as OpenAIClient
+# PyPDF2 / pdf2image / pytesseract / openpyxl などの重い依存は初回利用時に読み込む
+# (コールドスタート短縮のため。事前に読み込む場合は warm_up() を参照)
+from admission import (AdmissionRejected, combine_costs, estimate_export_cost, estimate_pdf_cost, estimate_sheet_cost,
+                       get_controller)
+# run_in_threadpool はプロファイル中のリクエストではワーカースレッドの処理もプロファイルする
+from profiling import ProfilingMiddleware, run_in_threadpool
+from parse_order_lambda import parse_order_file, warm_up as warm_up_order_parser
 
 app = FastAPI()
 
@@ -27,35 +30,130 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# X-Profile ヘッダー / PROFILE_SAMPLE_RATE によるリクエスト単位のプロファイリング (profiling.py)
+app.add_middleware(ProfilingMiddleware)
 
 MAX_FILE_SIZE = 1 * 1024 * 1024  # 1MB
+# /match で同時に処理する請求書 PDF の数 (テキスト化 + LLM による構造化)
+MATCH_PDF_CONCURRENCY = int(os.getenv("MATCH_PDF_CONCURRENCY", "8"))
 
 def validate_file_size(file_size: int):
     if file_size > MAX_FILE_SIZE:
         raise HTTPException(status_code=413, detail="File too large (max 1MB)")
 
-from parse_order_lambda import parse_csv, parse_excel
 
+async def acquire_budget(cost, priority: Optional[str] = None):
+    """
+    見積もったコスト分の予算を確保する (admission.py)。空きがなければ待ち、
+    待ち行列が一杯・待ち時間の上限を過ぎた場合は 429 + Retry-After を返す。
+    """
+    try:
+        return await get_controller().acquire(cost, priority)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-async def extract_text_from_pdf(file: UploadFile, use_ocr: bool = False) -> str:
-    content = await file.read()
-    validate_file_size(len(content))
-    
+
+@asynccontextmanager
+async def admitted(cost, priority: Optional[str] = None):
+    reservation = await acquire_budget(cost, priority)
+    try:
+        yield reservation
+    finally:
+        get_controller().release(reservation)
+
+
+async def release_budget(reservation):
+    """
+    ストリーミングレスポンスの BackgroundTask 用。受付制御はイベントループ内でのみ操作するため async にする
+    (同期関数の BackgroundTask はスレッドプールで実行される)。
+    """
+    get_controller().release(reservation)
+
+
+def warm_up():
+    """
+    遅延読み込みしている重い依存を事前に読み込む。
+    環境変数 WARM_UP_ON_STARTUP=1 の場合は起動時に実行される。
+    """
+    import PyPDF2  # noqa: F401
+    import pdf_text  # noqa: F401
+    import pdf2image  # noqa: F401
+    import pytesseract  # noqa: F401
+    import ocr_tiling  # noqa: F401
+    warm_up_order_parser()
+
+
+@app.on_event("startup")
+async def warm_up_on_startup():
+    if os.getenv("WARM_UP_ON_STARTUP") == "1":
+        warm_up()
+
+
+def extract_pdf_text(content: bytes, use_ocr: bool = False, pages: Optional[str] = None) -> str:
+    """PDF のバイト列をテキスト化する (同期処理)"""
     if use_ocr:
-        images = convert_from_bytes(content)
-        text = ""
-        for image in images:
-            text += pytesseract.image_to_string(image, lang='jpn+eng') + "\n"
-        return text
+        from ocr_tiling import OCR_PROCESS_WORKERS, ocr_pages, ocr_pdf_pages, rasterize_pages
+
+        if OCR_PROCESS_WORKERS > 0:
+            # ワーカープロセスで OCR (ページ画像は共有バッファ経由で受け渡す)
+            page_texts = ocr_pdf_pages(content, lang='jpn+eng', pages=pages)
+        else:
+            page_texts = ocr_pages(rasterize_pages(content, pages), lang='jpn+eng')
     else:
-        pdf = PyPDF2.PdfReader(io.BytesIO(content))
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-        return text
+        # テキストレイヤーの抽出バックエンドは PDF_TEXT_BACKEND で選択 (pdf_text.py)
+        from pdf_text import extract_pages
+
+        page_texts = extract_pages(content, pages)
+    return "".join(page_text + "\n" for page_text in page_texts)
+
+
+async def structure_invoice(content: bytes, use_ocr: bool = False) -> tuple:
+    """
+    請求書 PDF 1件をテキスト化し、LLM で明細行 (parse_invoice_data の形式) に構造化する。
+    (抽出したテキスト, 明細行のリスト) を返す。
+    """
+    from parse_invoice_lambda import extract_fields_from_text, parse_invoice_data, unify_text_via_openai_async
+
+    text = await run_in_threadpool(extract_pdf_text, content, use_ocr)
+    unified_text = await unify_text_via_openai_async(text)
+    return text, parse_invoice_data(extract_fields_from_text(unified_text))
+
+
+async def iter_invoice_results(invoices, use_ocr: bool = False):
+    """
+    (ファイル名, バイト列) のリストを最大 MATCH_PDF_CONCURRENCY 件ずつ並列に構造化し、終わった順に返す。
+    失敗した PDF は text / rows を空にして error を付ける (他の PDF の処理は続ける)。
+    """
+    semaphore = asyncio.Semaphore(MATCH_PDF_CONCURRENCY)
+
+    async def run(index, filename, content):
+        async with semaphore:
+            started = time.perf_counter()
+            result = {"index": index, "filename": filename}
+            try:
+                result["text"], result["rows"] = await structure_invoice(content, use_ocr)
+            except Exception as e:
+                print(f"Error in structure_invoice ({filename}): {str(e)}\n{traceback.format_exc()}", file=sys.stderr)
+                result["text"], result["rows"] = "", []
+                result["error"] = str(e)
+            result["elapsed_sec"] = time.perf_counter() - started
+            return result
+
+    tasks = [asyncio.create_task(run(i, filename, content)) for i, (filename, content) in enumerate(invoices)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # クライアントの切断などで途中終了した場合は残りを取り消す
+        for task in tasks:
+            task.cancel()
 
 @app.post("/api/v1/orders/parse")
-async def parse_orders(file: UploadFile):
+async def parse_orders(file: UploadFile, sheets: Optional[str] = None, priority: Optional[str] = None):
+    """
+    sheets: Excel の解析対象シート名 (カンマ区切り)。省略時は全シートを解析する。
+    priority: "bulk" で優先度の低いレーンで処理する (既定はコストの見積もりで決める)
+    """
     if not file.filename.endswith(('.csv', '.xlsx')):
         raise HTTPException(
             status_code=400,
@@ -73,10 +171,10 @@ async def parse_orders(file: UploadFile):
                 detail="ファイルサイズは1MB以下にしてください。"
             )
         
-        if file.filename.endswith('.xlsx'):
-            result = parse_excel(content)
-        else:
-            result = parse_csv(content)
+        sheet_names = [name.strip() for name in sheets.split(",") if name.strip()] if sheets else None
+        cost = await run_in_threadpool(estimate_sheet_cost, content, file.filename, sheet_names)
+        async with admitted(cost, priority):
+            result = await run_in_threadpool(parse_order_file, content, file.filename, sheet_names)
             
         if not isinstance(result, dict):
             raise ValueError("不正な出力形式です。")
@@ -88,10 +186,15 @@ async def parse_orders(file: UploadFile):
         
         print(f"Processed {total_rows} rows: {valid_rows} valid, {skipped_rows} skipped", file=sys.stderr)
             
-        return {
+        response = {
             "message": f"{valid_rows}件の有効なデータを処理しました。{skipped_rows}件のデータをスキップしました。",
             "data": orders
         }
+        if "sheets" in result:
+            response["sheets"] = result["sheets"]
+        return response
+    except HTTPException:
+        raise
     except ValueError as e:
         print(f"Validation error: {str(e)}", file=sys.stderr)
         raise HTTPException(status_code=400, detail=str(e))
@@ -103,26 +206,53 @@ async def parse_orders(file: UploadFile):
         )
 
 @app.post("/api/v1/invoices/parse")
-async def parse_invoice(file: UploadFile, use_ocr: Optional[bool] = False):
+async def parse_invoice(file: UploadFile, use_ocr: Optional[bool] = False, pages: Optional[str] = None,
+                        priority: Optional[str] = None):
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Invalid file format. Must be PDF")
     
-    text = await extract_text_from_pdf(file, use_ocr)
+    content = await file.read()
+    validate_file_size(len(content))
+    # ページ数と OCR の有無からコストを見積もり、予算に空きができてからテキスト化する
+    cost = await run_in_threadpool(estimate_pdf_cost, content, use_ocr, pages)
+    try:
+        async with admitted(cost, priority):
+            text = await run_in_threadpool(extract_pdf_text, content, use_ocr, pages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"message": "Invoice parsed successfully", "text": text}
 
 @app.post("/api/v1/match")
-async def match_documents(orders_file: UploadFile, invoices_file: UploadFile):
+async def match_documents(
+    orders_file: UploadFile,
+    invoices_file: Optional[UploadFile] = File(None),
+    invoices_files: List[UploadFile] = File([]),
+    use_ocr: bool = True,
+    stream: bool = False,
+    priority: Optional[str] = None,
+):
+    """
+    発注データ1件と請求書 PDF (invoices_file / invoices_files で複数指定可) を突合する。
+    PDF は並列にテキスト化・構造化し (最大 MATCH_PDF_CONCURRENCY 件)、全明細をまとめて match_csv_and_pdf に渡す。
+    data: {"orders": 発注データの解析結果 (/orders/parse と同じ orders / total_rows / valid_rows など),
+           "invoice_text": 全 PDF の抽出テキスト (ファイル順に連結), "invoices": PDF ごとの明細・経過時間・エラー,
+           "diff_rows": 突合結果}
+    stream=true の場合は NDJSON で PDF ごとの完了 ({"event": "invoice", ...}) を順次返し、
+    最後に {"event": "result", "data": ...} を返す。途中で失敗した場合は最後に {"event": "error", "detail": ...} を返す。
+    発注データの行数と全 PDF のページ数・OCR の有無から見積もったコスト分の予算を、処理の間確保する。
+    """
     if not orders_file.filename.endswith(('.csv', '.xlsx')):
         raise HTTPException(
             status_code=400,
             detail="ファイルの形式が正しくありません。"
         )
-    if not invoices_file.filename.endswith('.pdf'):
+    pdf_files = ([invoices_file] if invoices_file else []) + (invoices_files or [])
+    if not pdf_files or not all(f.filename.endswith('.pdf') for f in pdf_files):
         raise HTTPException(
             status_code=400,
             detail="PDFファイルを選択してください。"
         )
-    
+
     try:
         content = await orders_file.read()
         if len(content) > MAX_FILE_SIZE:
@@ -130,27 +260,159 @@ async def match_documents(orders_file: UploadFile, invoices_file: UploadFile):
                 status_code=413,
                 detail="ファイルサイズは1MB以下にしてください。"
             )
-        
-        if orders_file.filename.endswith('.xlsx'):
-            orders_data = parse_excel(content)
-        else:
-            orders_data = parse_csv(content)
-            
-        invoice_text = await extract_text_from_pdf(invoices_file, use_ocr=True)
-        
-        return {
-            "data": {
-                "orders": orders_data,
-                "invoice_text": invoice_text
-            }
-        }
+
+        # レスポンスのストリーミング中にアップロードファイルが閉じられるため、先に読み込んでおく
+        invoices = []
+        for pdf_file in pdf_files:
+            pdf_content = await pdf_file.read()
+            validate_file_size(len(pdf_content))
+            invoices.append((pdf_file.filename, pdf_content))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+    def estimate_cost():
+        return combine_costs(
+            [estimate_sheet_cost(content, orders_file.filename)] +
+            [estimate_pdf_cost(pdf_content, use_ocr) for _, pdf_content in invoices],
+            concurrency=MATCH_PDF_CONCURRENCY + 1,
+        )
+
+    reservation = await acquire_budget(await run_in_threadpool(estimate_cost), priority)
+    try:
+        orders_result = await run_in_threadpool(parse_order_file, content, orders_file.filename)
+    except ValueError as e:
+        get_controller().release(reservation)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        get_controller().release(reservation)
+        raise
+
+    async def run_match():
+        results = [None] * len(invoices)
+        async for result in iter_invoice_results(invoices, use_ocr):
+            results[result["index"]] = result
+            yield {"event": "invoice", **{k: v for k, v in result.items() if k not in ("rows", "text")},
+                   "rows": len(result["rows"])}
+
+        from match_lambda import match_csv_and_pdf
+
+        diff_rows = await run_in_threadpool(match_csv_and_pdf, orders_result["orders"], [r["rows"] for r in results])
+        yield {"event": "result", "data": {
+            "orders": orders_result,
+            "invoice_text": "".join(r["text"] for r in results),
+            "invoices": [{k: v for k, v in r.items() if k not in ("index", "text")} for r in results],
+            "diff_rows": diff_rows,
+        }}
+
+    if stream:
+        async def ndjson():
+            try:
+                async for event in run_match():
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+            except Exception as e:
+                # ステータス 200 は送信済みのため、失敗はイベントとして返す
+                print(f"Error in match_documents: {str(e)}\n{traceback.format_exc()}", file=sys.stderr)
+                yield json.dumps({"event": "error", "detail": "ファイルの解析中にエラーが発生しました。"},
+                                 ensure_ascii=False) + "\n"
+            finally:
+                get_controller().release(reservation)
+
+        # 送信前にクライアントが切断した場合も予算を返すよう、BackgroundTask でも解放する (2回目は何もしない)
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson",
+                                 background=BackgroundTask(release_budget, reservation))
+
+    data = None
+    try:
+        async for event in run_match():
+            if event["event"] == "result":
+                data = event["data"]
     except Exception as e:
+        print(f"Error in match_documents: {str(e)}\n{traceback.format_exc()}", file=sys.stderr)
         raise HTTPException(
             status_code=500,
             detail="ファイルの解析中にエラーが発生しました。"
         )
+    finally:
+        get_controller().release(reservation)
+    return {"data": data}
+
+@app.post("/api/v1/match/export")
+async def export_match_result(payload: Dict[str, Any], format: str = "xlsx", encoding: str = "utf-8"):
+    """
+    突合結果を XLSX / CSV でダウンロードする (export_results.py)。
+    payload: {"diff_rows": [...]} (突合済みの結果) または
+             {"orders": [...], "invoices": [[...], ...], "amount_tolerance": ..., ...} (ここで突合する)
+    format: xlsx / csv, encoding: CSV の文字コード (utf-8 (BOM付き) / cp932)
+    結果は1行ずつ書き出してチャンク転送するため、行数が多くてもメモリ使用量は増えない。
+    行数から見積もったコスト分の予算を bulk レーンで確保し、書き出しが終わるまで保持する。
+    """
+    from starlette.concurrency import iterate_in_threadpool
+
+    from export_results import CSV_ENCODINGS, EXPORT_FORMATS, MEDIA_TYPES, iter_export
+    from match_lambda import iter_diff_rows
+
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format は {' / '.join(EXPORT_FORMATS)} のいずれかです")
+    if format == "csv" and encoding not in CSV_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding は {' / '.join(CSV_ENCODINGS)} のいずれかです")
+
+    if "diff_rows" in payload:
+        cost = estimate_export_cost(len(payload["diff_rows"]))
+    else:
+        cost = estimate_export_cost(
+            len(payload.get("orders", [])) + sum(len(rows) for rows in payload.get("invoices", [])), match=True)
+    reservation = await acquire_budget(cost, "bulk")
+
+    if "diff_rows" in payload:
+        diff_rows = payload["diff_rows"]
+    else:
+        diff_rows = iter_diff_rows(
+            payload.get("orders", []),
+            payload.get("invoices", []),
+            amount_tolerance=payload.get("amount_tolerance"),
+            amount_tolerance_pct=payload.get("amount_tolerance_pct"),
+            name_similarity=payload.get("name_similarity"),
+            use_master_data=payload.get("use_master_data"),
+        )
+
+    media_type = MEDIA_TYPES[format]
+    if format == "csv":
+        media_type += f"; charset={'shift_jis' if encoding == 'cp932' else 'utf-8'}"
+
+    async def chunks():
+        try:
+            async for chunk in iterate_in_threadpool(iter_export(diff_rows, format, encoding)):
+                yield chunk
+        finally:
+            get_controller().release(reservation)
+
+    # 送信前にクライアントが切断した場合も予算を返すよう、BackgroundTask でも解放する (2回目は何もしない)
+    return StreamingResponse(
+        chunks(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="match_result.{format}"'},
+        background=BackgroundTask(release_budget, reservation),
+    )
+
+@app.post("/api/v1/master-data/{kind}")
+async def add_master_data(kind: str, entries: List[Dict[str, Any]]):
+    """
+    業者 (vendors) / 物件 (buildings) マスタに名称を追加する (master_index.py)。
+    entries: [{"id": 正規ID, "name": 名称, "aliases": [別名, ...]}, ...]
+    """
+    from master_index import add_master_entries
+
+    try:
+        # 削除辞書の更新と JSON の保存はイベントループを止めないようスレッドプールで行う
+        added = await run_in_threadpool(add_master_entries, kind, entries)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"{added}件をマスタに追加しました。"}
+
+@app.get("/api/v1/metrics")
+async def metrics():
+    """受付制御の予算 (メモリ / CPU 時間) とレーンごとの実行・待ち・拒否の件数"""
+    return {"admission": get_controller().snapshot()}
 
 @app.get("/api/v1/health")
 async def health_check():
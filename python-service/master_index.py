@@ -0,0 +1,266 @@
+"""
+業者・物件マスタの名称インデックス (SymSpell の削除辞書)
+
+OCR や手入力で表記が揺れた 工事業者名 / 物件名 を、マスタの正規ID に寄せるためのインデックス。
+
+    vendors = get_master_index("vendors")   # MASTER_DATA_DIR/vendors.json を初回利用時に読み込む
+    vendors.canonicalize("山田工務店(株)")    # → "V001" (該当なし・候補が複数の場合は None)
+
+名称は name_similarity.normalize_name で正規化 (法人格・空白・記号の除去) した上で、
+先頭 prefix_length 文字から最大 max_distance 文字を削除した文字列 → 正規化名 の辞書を作る。
+検索時は入力からも同様に削除文字列を作って候補を引き、レーベンシュタイン距離で確認する。
+マスタへの追加 (add) は削除辞書を差分更新し、save() で JSON に保存する。
+
+マスタの作成・追加 (CSV の列名は --id-column / --name-column で指定):
+    python master_index.py build vendors vendors.csv --id-column 業者ID --name-column 業者名
+    python master_index.py add vendors V123 "山田工務店"
+    python master_index.py lookup vendors "山田エ務店(株)"
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+from itertools import combinations
+
+from match_lambda import levenshtein_distance
+from name_similarity import normalize_name
+
+MASTER_DATA_DIR = os.getenv("MASTER_DATA_DIR", "master_data")
+MASTER_KINDS = ("vendors", "buildings")
+# 距離2以内を同一とみなす (match_lambda.within_distance と同じ基準)
+MAX_DISTANCE = 2
+# 削除文字列を作る対象の先頭文字数。長い名称でも辞書の大きさを抑える
+PREFIX_LENGTH = 7
+
+
+def _deletes(name, max_distance, prefix_length):
+    """name の先頭 prefix_length 文字から 0〜max_distance 文字を削除した文字列の集合"""
+    prefix = name[:prefix_length]
+    result = {prefix}
+    for n in range(1, min(max_distance, len(prefix)) + 1):
+        for positions in combinations(range(len(prefix)), n):
+            result.add("".join(ch for i, ch in enumerate(prefix) if i not in positions))
+    return result
+
+
+class MasterIndex:
+    """
+    正規化名 → 正規ID の完全一致表と、SymSpell の削除辞書。
+    add (API からのマスタ追加) と lookup (突合) が別スレッドから呼ばれるため、辞書の参照・更新は _lock の下で行う。
+    """
+
+    def __init__(self, kind, max_distance=MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.kind = kind
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.entries = {}    # 正規ID → {"name": 表示名, "aliases": [別名, ...]}
+        self._ids = {}       # 正規化名 → 正規ID の集合
+        self._deletes = {}   # 削除文字列 → 正規化名 の集合
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entity_id, name, aliases=()):
+        """マスタに名称(と別名)を追加する。既存IDの場合は別名として追記する"""
+        entity_id = str(entity_id)
+        with self._lock:
+            entry = self.entries.setdefault(entity_id, {"name": name, "aliases": []})
+            for value in (name, *aliases):
+                if value != entry["name"] and value not in entry["aliases"]:
+                    entry["aliases"].append(value)
+                self._index(entity_id, value)
+
+    def _index(self, entity_id, value):
+        key = normalize_name(value)
+        if not key:
+            return
+        ids = self._ids.setdefault(key, set())
+        if not ids:
+            for deleted in _deletes(key, self.max_distance, self.prefix_length):
+                self._deletes.setdefault(deleted, set()).add(key)
+        ids.add(entity_id)
+
+    def lookup(self, name):
+        """
+        名称に最も近いマスタの (正規ID, 距離) を返す。
+        距離 max_distance 以内に候補がない、または最も近い候補が複数IDにまたがる場合は None。
+        """
+        key = normalize_name(name)
+        if not key:
+            return None
+        with self._lock:
+            return self._lookup(key)
+
+    def _lookup(self, key):
+        ids = self._ids.get(key)
+        if ids:
+            return (next(iter(ids)), 0) if len(ids) == 1 else None
+
+        best, best_ids = None, set()
+        seen = set()
+        for deleted in _deletes(key, self.max_distance, self.prefix_length):
+            for candidate in self._deletes.get(deleted, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if abs(len(candidate) - len(key)) > self.max_distance:
+                    continue
+                distance = levenshtein_distance(key, candidate)
+                if distance > self.max_distance or (best is not None and distance > best):
+                    continue
+                if best is None or distance < best:
+                    best, best_ids = distance, set()
+                best_ids |= self._ids[candidate]
+        if len(best_ids) != 1:
+            return None
+        return next(iter(best_ids)), best
+
+    def canonicalize(self, name):
+        """名称の正規IDを返す (該当なしは None)"""
+        found = self.lookup(name)
+        return found[0] if found else None
+
+    def to_dict(self):
+        with self._lock:
+            entries = {entity_id: {"name": entry["name"], "aliases": list(entry["aliases"])}
+                       for entity_id, entry in self.entries.items()}
+        return {
+            "kind": self.kind,
+            "max_distance": self.max_distance,
+            "prefix_length": self.prefix_length,
+            "entries": entries,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data.get("kind", ""), data.get("max_distance", MAX_DISTANCE),
+                    data.get("prefix_length", PREFIX_LENGTH))
+        for entity_id, entry in data.get("entries", {}).items():
+            index.add(entity_id, entry["name"], entry.get("aliases", ()))
+        return index
+
+    def save(self, path):
+        """JSON に保存する (一時ファイルに書き込んでから置き換える)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        data = self.to_dict()
+        fd, tmp_path = tempfile.mkstemp(prefix=".master-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, kind=None):
+        """JSON から読み込む。ファイルがない場合は空のインデックス"""
+        if not os.path.exists(path):
+            return cls(kind or "")
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def master_path(kind, directory=None):
+    if kind not in MASTER_KINDS:
+        raise ValueError(f"Unknown master kind: {kind}")
+    return os.path.join(directory or MASTER_DATA_DIR, f"{kind}.json")
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+# マスタの追加・保存を直列化する (同時に保存した古い内容で上書きしないため)
+_add_lock = threading.Lock()
+
+
+def get_master_index(kind, directory=None):
+    """
+    マスタのインデックスを返す。初回利用時に読み込み、以降はファイルが更新された場合のみ読み直す。
+    """
+    path = master_path(kind, directory)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _cache[path] = (mtime, MasterIndex.load(path, kind))
+        return cached[1]
+
+
+def add_master_entries(kind, entries, directory=None):
+    """
+    マスタに [{"id": ..., "name": ..., "aliases": [...]}, ...] を追加して保存する。
+    追加件数を返す。
+    """
+    for entry in entries:
+        if not entry.get("id") or not entry.get("name"):
+            raise ValueError("id と name は必須です")
+    with _add_lock:
+        index = get_master_index(kind, directory)
+        for entry in entries:
+            index.add(entry["id"], entry["name"], entry.get("aliases") or ())
+        path = master_path(kind, directory)
+        index.save(path)
+        with _cache_lock:
+            _cache[path] = (os.stat(path).st_mtime_ns, index)
+    return len(entries)
+
+
+def canonical_ids(index, names):
+    """名称のリストを正規IDのリストに変換する (同じ名称の検索は1回だけ行う)"""
+    resolved = {}
+    for name in names:
+        if name not in resolved:
+            resolved[name] = index.canonicalize(name)
+    return [resolved[name] for name in names]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="業者・物件マスタの名称インデックス")
+    parser.add_argument("--dir", default=None, help="マスタの保存先 (既定: MASTER_DATA_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="CSV からマスタを作り直す")
+    build.add_argument("kind", choices=MASTER_KINDS)
+    build.add_argument("csv_path")
+    build.add_argument("--id-column", required=True)
+    build.add_argument("--name-column", required=True)
+    build.add_argument("--alias-column", help="別名の列 (「|」区切り)")
+    build.add_argument("--encoding", default="utf-8-sig")
+
+    add = sub.add_parser("add", help="マスタに1件追加する")
+    add.add_argument("kind", choices=MASTER_KINDS)
+    add.add_argument("id")
+    add.add_argument("name")
+    add.add_argument("aliases", nargs="*")
+
+    lookup = sub.add_parser("lookup", help="名称の正規IDを調べる")
+    lookup.add_argument("kind", choices=MASTER_KINDS)
+    lookup.add_argument("name")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = MasterIndex(args.kind)
+        with open(args.csv_path, encoding=args.encoding, newline="") as f:
+            for row in csv.DictReader(f):
+                aliases = (row.get(args.alias_column) or "").split("|") if args.alias_column else []
+                index.add(row[args.id_column], row[args.name_column], [a for a in aliases if a])
+        index.save(master_path(args.kind, args.dir))
+        print(f"{len(index)} entries saved to {master_path(args.kind, args.dir)}", file=sys.stderr)
+    elif args.command == "add":
+        add_master_entries(args.kind, [{"id": args.id, "name": args.name, "aliases": args.aliases}], args.dir)
+    else:
+        found = get_master_index(args.kind, args.dir).lookup(args.name)
+        print(json.dumps({"id": found[0], "distance": found[1]} if found else None, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,132 +1,334 @@
 # match_lambda.py
+import bisect
 import json
+import os
+import re
+import unicodedata
+from collections import namedtuple
 
+from payload_store import read_json, result_body, write_json_rows
+from profiling import profile_handler
+
+# 金額一致の許容誤差 (絶対値[円] と CSV金額に対する割合[%] の大きい方)
+AMOUNT_TOLERANCE = int(os.getenv("MATCH_AMOUNT_TOLERANCE", "0"))
+AMOUNT_TOLERANCE_PCT = float(os.getenv("MATCH_AMOUNT_TOLERANCE_PCT", "0"))
+# 業者名/建物名の n-gram コサイン類似度の閾値 (0 で無効。レーベンシュタイン距離の判定のみ)
+NAME_SIMILARITY = float(os.getenv("MATCH_NAME_SIMILARITY", "0.8"))
+# 名称ごとに類似度を評価する候補数
+NAME_SIMILARITY_TOP_K = int(os.getenv("MATCH_NAME_SIMILARITY_TOP_K", "5"))
+# 業者・物件マスタ (master_index.py) の正規IDで名称を突合する
+USE_MASTER_DATA = os.getenv("MATCH_USE_MASTER_DATA", "1") == "1"
+
+# diff_row の項目 (csv_<項目> / pdf_<項目>)
+EXPECTED_HEADERS = [
+    "業者ID", "業者名", "コード", "建物名", "番号", "受付内容",
+    "支払金額", "修繕作成者", "完工日", "修繕業者ID", "支払サイト",
+    "支払日", "立替金", "請求日"
+]
+
+@profile_handler
 def lambda_handler(event, context):
     """
     event["orders"] = [ {...}, {...} ]  # CSV/Excel解析済みの発注データ
     event["invoices"] = [ {...}, {...} ] # PDF解析済みの請求データ
+    event["orders_uri"] / event["invoices_uri"]  # 任意: 上記を JSON で保存した参照 (payload_store.py)
+    event["result_uri"]  # 任意: diff_rows の書き出し先。指定時は1行ずつ書き出して参照を返す
+    event["amount_tolerance"] / event["amount_tolerance_pct"]  # 任意: 金額の許容誤差
+    event["name_similarity"]  # 任意: 名称の類似度の閾値
+    event["use_master_data"]  # 任意: マスタの正規IDで名称を突合するか
+    参照 (URI) が読み書きできない・JSON が不正な場合は statusCode 400 を返す
+    (parse_order_lambda.lambda_handler と同じ形式)。
     """
-    orders = event.get("orders", [])
-    invoices = event.get("invoices", [])
+    try:
+        orders = read_json(event["orders_uri"]) if event.get("orders_uri") else event.get("orders", [])
+        invoices = read_json(event["invoices_uri"]) if event.get("invoices_uri") else event.get("invoices", [])
+
+        diff_rows = iter_diff_rows(
+            orders,
+            invoices,
+            amount_tolerance=event.get("amount_tolerance"),
+            amount_tolerance_pct=event.get("amount_tolerance_pct"),
+            name_similarity=event.get("name_similarity"),
+            use_master_data=event.get("use_master_data"),
+        )
 
-    diff_rows = match_csv_and_pdf(orders, invoices)
+        if event.get("result_uri"):
+            rows = write_json_rows(event["result_uri"], "diff_rows", diff_rows)
+            body = json.dumps({"result_uri": event["result_uri"], "rows": rows})
+        else:
+            body = result_body({"diff_rows": list(diff_rows)}, None, getattr(context, "aws_request_id", None))
+    except (ValueError, OSError) as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": str(e)})
+        }
 
     return {
         "statusCode": 200,
-        "body": json.dumps({"diff_rows": diff_rows})
+        "body": body
     }
 
-def match_csv_and_pdf(csv_data, pdf_extracted):
+def match_csv_and_pdf(csv_data, pdf_extracted, amount_tolerance=None, amount_tolerance_pct=None,
+                      name_similarity=None, use_master_data=None, workers=None):
+    """突合結果 (diff_row) のリストを返す。判定条件は iter_diff_rows を参照"""
+    return list(iter_diff_rows(csv_data, pdf_extracted, amount_tolerance, amount_tolerance_pct,
+                               name_similarity, use_master_data, workers))
+
+def iter_diff_rows(csv_data, pdf_extracted, amount_tolerance=None, amount_tolerance_pct=None,
+                   name_similarity=None, use_master_data=None, workers=None):
     """
-    CSVの各行をループし、PDFの全明細をチェックして:
-      - 業者名 / 建物名 / 番号 / 支払金額 の4つが「レーベンシュタイン距離2以内」で一致なら OK
+    CSVの各行について、PDFの全明細から以下をすべて満たす最初の明細を探す:
+      - 支払金額 / 金額: 数値として比較し、許容誤差以内 (ソート済み金額インデックスの範囲検索)
+      - 番号 / 部屋番号: 正規化 (例: 101号室 → 101) した上で完全一致 (ハッシュインデックス)
+      - 業者名 / 建物名: 双方がマスタ (master_index) の正規IDに解決できた場合はIDの一致。
+        それ以外は「レーベンシュタイン距離2以内」または
+        「文字 n-gram のコサイン類似度が name_similarity 以上 (上位 NAME_SIMILARITY_TOP_K 件以内)」
       - 見つからない場合は DIFF
 
-    ※ 上記4つの比較では、文字列内のスペースを削除＆ASCIIを全角に変換してから比較
+    ※ 業者名 / 建物名の比較では、文字列内のスペースを削除＆ASCIIを全角に変換してから比較
+    ※ 類似度は重複を除いた名称どうしでまとめて計算する (name_similarity.top_k_similar)
+    ※ diff_row は CSV の行順に1行ずつ生成する (エクスポート時に全行を保持しないため)
+    ※ workers (既定: MATCH_WORKERS) が2以上で CSV が MATCH_PARALLEL_MIN_ROWS 行以上の場合は、
+      明細の検索をワーカープロセスで分担する (parallel_match.py。結果は逐次処理と同じ)
     """
-
-    expected_headers = [
-        "業者ID", "業者名", "コード", "建物名", "番号", "受付内容",
-        "支払金額", "修繕作成者", "完工日", "修繕業者ID", "支払サイト",
-        "支払日", "立替金", "請求日"
-    ]
+    if amount_tolerance is None:
+        amount_tolerance = AMOUNT_TOLERANCE
+    if amount_tolerance_pct is None:
+        amount_tolerance_pct = AMOUNT_TOLERANCE_PCT
+    if name_similarity is None:
+        name_similarity = NAME_SIMILARITY
+    if use_master_data is None:
+        use_master_data = USE_MASTER_DATA
 
     # PDFをフラット化 (複数ファイル分を1リストに集約)
     all_pdf_rows = []
     for pdf_list in pdf_extracted:
         all_pdf_rows.extend(pdf_list)
 
-    diff_rows = []
+    index = InvoiceIndex(all_pdf_rows)
+    orders, matcher = prepare_match(csv_data, index, amount_tolerance, amount_tolerance_pct,
+                                    name_similarity, use_master_data)
+
+    from parallel_match import MATCH_PARALLEL_MIN_ROWS, MATCH_WORKERS, shard_matches
+
+    if workers is None:
+        workers = MATCH_WORKERS
+    if workers > 1 and len(csv_data) >= MATCH_PARALLEL_MIN_ROWS:
+        matches = shard_matches(orders, matcher, workers)
+    else:
+        matches = (matcher.first_match(order) for order in orders)
 
     # CSVを1行ずつループ
-    for c_item in csv_data:
-        matched_any = False
-        matched_pdf = None
-
-        # PDF全明細をチェック
-        for p_item in all_pdf_rows:
-            # PDF "金額" を文字列化
-            pdf_money_val = p_item.get("金額", "")
-            if isinstance(pdf_money_val, (int, float)):
-                pdf_money_val = str(pdf_money_val)
-
-            # 1) CSVの 業者名/建物名/番号/支払金額 を正規化
-            c_name  = remove_spaces_and_to_fullwidth(c_item.get("業者名", ""))
-            c_build = remove_spaces_and_to_fullwidth(c_item.get("建物名", ""))
-            c_room  = remove_spaces_and_to_fullwidth(c_item.get("番号", ""))
-            c_money = remove_spaces_and_to_fullwidth(c_item.get("支払金額", ""))
-
-            # 2) PDF側の 工事業者名/物件名/部屋番号/金額 を正規化
-            p_name  = remove_spaces_and_to_fullwidth(p_item.get("工事業者名", ""))
-            p_build = remove_spaces_and_to_fullwidth(p_item.get("物件名", ""))
-            p_room  = remove_spaces_and_to_fullwidth(p_item.get("部屋番号", ""))
-            p_money = remove_spaces_and_to_fullwidth(pdf_money_val)
-
-            # ---------- 2文字まで誤差を許容する一致判定 ----------
+    for c_item, i in zip(csv_data, matches):
+        yield build_diff_row(c_item, all_pdf_rows[i] if i is not None else None)
+
+# CSV 1行分の突合キー (金額が解釈できない行は money=None)
+OrderKey = namedtuple("OrderKey", ["money", "tolerance", "room", "name", "building", "vendor_id", "building_id"])
+
+def prepare_match(csv_data, index, amount_tolerance, amount_tolerance_pct, name_similarity, use_master_data):
+    """
+    CSV の各行を OrderKey に正規化し、PDF側 (index) と突合する InvoiceMatcher を作る。
+    名称の類似度とマスタの正規IDは、ここで全行分をまとめて求める。
+    """
+    c_names  = map_cached(remove_spaces_and_to_fullwidth, [c_item.get("業者名", "") for c_item in csv_data])
+    c_builds = map_cached(remove_spaces_and_to_fullwidth, [c_item.get("建物名", "") for c_item in csv_data])
+    c_rooms  = map_cached(canonicalize_room, [c_item.get("番号", "") for c_item in csv_data])
+    similar_names  = similar_name_sets(c_names,  index.names,     name_similarity)
+    similar_builds = similar_name_sets(c_builds, index.buildings, name_similarity)
+
+    c_vendor_ids, p_vendor_ids = master_ids("vendors", c_names, index.names, use_master_data)
+    c_building_ids, p_building_ids = master_ids("buildings", c_builds, index.buildings, use_master_data)
+
+    orders = []
+    for row_no, c_item in enumerate(csv_data):
+        c_money = parse_amount(c_item.get("支払金額", ""))
+        tolerance = None
+        if c_money is not None:
+            tolerance = max(amount_tolerance, abs(c_money) * amount_tolerance_pct / 100)
+        orders.append(OrderKey(
+            c_money, tolerance, c_rooms[row_no],
+            c_names[row_no], c_builds[row_no], c_vendor_ids[row_no], c_building_ids[row_no],
+        ))
+    matcher = InvoiceMatcher(index, p_vendor_ids, p_building_ids, similar_names, similar_builds)
+    return orders, matcher
+
+class InvoiceMatcher:
+    """InvoiceIndex 上で CSV 1行 (OrderKey) に一致する最初の明細を探す"""
+
+    def __init__(self, index, vendor_ids, building_ids, similar_names, similar_builds):
+        self.index = index
+        self.vendor_ids = vendor_ids
+        self.building_ids = building_ids
+        self.similar_names = similar_names
+        self.similar_builds = similar_builds
+
+    def first_match(self, order):
+        """一致した明細の行番号 (PDF上の順序で最初のもの)。見つからない場合は None"""
+        if order.money is None:
+            return None
+        index = self.index
+        # 金額・部屋番号で候補を絞り込み、PDF上の順序で業者名/建物名を比較
+        for i in index.candidates(order.money, order.tolerance, order.room):
             if (
-                within_distance(c_name,  p_name)   and
-                within_distance(c_build, p_build)  and
-                within_distance(c_room,  p_room)   and
-                within_distance(c_money, p_money)
+                entities_match(order.name, index.names[i], order.vendor_id, self.vendor_ids[i],
+                               self.similar_names) and
+                entities_match(order.building, index.buildings[i], order.building_id, self.building_ids[i],
+                               self.similar_builds)
             ):
-                matched_any = True
-                matched_pdf = p_item
-                break  # 1行マッチすれば終了
-            else:
-                # デバッグ用ログ（不要なら削除）
-                print("c_item==========================")
-                print(c_item)
-                print("p_item==========================")
-                print(p_item)
-
-        # diff_rowを作成
-        diff_row = {}
+                return i  # 1行マッチすれば終了
+        return None
+
+def build_diff_row(c_item, matched_pdf):
+    """CSV の行と一致した PDF 明細 (なければ None) から diff_row を作る"""
+    expected_headers = EXPECTED_HEADERS
+
+    # diff_rowを作成
+    diff_row = {}
+    for header_name in expected_headers:
+        diff_row[f"csv_{header_name}"] = c_item.get(header_name, "")
+
+    if matched_pdf:
+        # PDF辞書を CSVキーにマッピング
+        normalized_pdf = {}
+
+        # 業者IDは "発注番号" を代用する例
+        pdf_id = matched_pdf.get("業者ID", "")
+        if not pdf_id or pdf_id == "不明":
+            pdf_id = matched_pdf.get("発注番号", "")
+        normalized_pdf["業者ID"] = pdf_id
+
+        normalized_pdf["業者名"]     = matched_pdf.get("工事業者名", "")
+        normalized_pdf["建物名"]     = matched_pdf.get("物件名", "")
+        normalized_pdf["番号"]       = matched_pdf.get("部屋番号", "")
+        # 金額を文字列化
+        money_val = matched_pdf.get("金額", "")
+        if isinstance(money_val, (int, float)):
+            money_val = str(money_val)
+        normalized_pdf["支払金額"] = money_val
+
+        # 残りの項目を適宜セット
+        normalized_pdf["コード"]       = matched_pdf.get("コード", "")
+        normalized_pdf["受付内容"]     = matched_pdf.get("受付内容", "")
+        normalized_pdf["修繕作成者"]  = matched_pdf.get("修繕作成者", "")
+        normalized_pdf["完工日"]      = matched_pdf.get("完工日", "")
+        normalized_pdf["修繕業者ID"]  = matched_pdf.get("修繕業者ID", "")
+        normalized_pdf["支払サイト"]  = matched_pdf.get("支払サイト", "")
+        normalized_pdf["支払日"]     = matched_pdf.get("支払日", "")
+        normalized_pdf["立替金"]     = matched_pdf.get("立替金", "")
+        normalized_pdf["請求日"]     = matched_pdf.get("請求日", "")
+
         for header_name in expected_headers:
-            diff_row[f"csv_{header_name}"] = c_item.get(header_name, "")
-
-        if matched_any and matched_pdf:
-            # PDF辞書を CSVキーにマッピング
-            normalized_pdf = {}
-
-            # 業者IDは "発注番号" を代用する例
-            pdf_id = matched_pdf.get("業者ID", "")
-            if not pdf_id or pdf_id == "不明":
-                pdf_id = matched_pdf.get("発注番号", "")
-            normalized_pdf["業者ID"] = pdf_id
-
-            normalized_pdf["業者名"]     = matched_pdf.get("工事業者名", "")
-            normalized_pdf["建物名"]     = matched_pdf.get("物件名", "")
-            normalized_pdf["番号"]       = matched_pdf.get("部屋番号", "")
-            # 金額を文字列化
-            money_val = matched_pdf.get("金額", "")
-            if isinstance(money_val, (int, float)):
-                money_val = str(money_val)
-            normalized_pdf["支払金額"] = money_val
-
-            # 残りの項目を適宜セット
-            normalized_pdf["コード"]       = matched_pdf.get("コード", "")
-            normalized_pdf["受付内容"]     = matched_pdf.get("受付内容", "")
-            normalized_pdf["修繕作成者"]  = matched_pdf.get("修繕作成者", "")
-            normalized_pdf["完工日"]      = matched_pdf.get("完工日", "")
-            normalized_pdf["修繕業者ID"]  = matched_pdf.get("修繕業者ID", "")
-            normalized_pdf["支払サイト"]  = matched_pdf.get("支払サイト", "")
-            normalized_pdf["支払日"]     = matched_pdf.get("支払日", "")
-            normalized_pdf["立替金"]     = matched_pdf.get("立替金", "")
-            normalized_pdf["請求日"]     = matched_pdf.get("請求日", "")
-
-            for header_name in expected_headers:
-                diff_row[f"pdf_{header_name}"] = normalized_pdf.get(header_name, "")
-
-            diff_row["status"] = "OK"
-        else:
-            # 見つからなかった → PDFは空、ステータス=DIFF
-            for header_name in expected_headers:
-                diff_row[f"pdf_{header_name}"] = ""
-            diff_row["status"] = "DIFF"
+            diff_row[f"pdf_{header_name}"] = normalized_pdf.get(header_name, "")
 
-        diff_rows.append(diff_row)
+        diff_row["status"] = "OK"
+    else:
+        # 見つからなかった → PDFは空、ステータス=DIFF
+        for header_name in expected_headers:
+            diff_row[f"pdf_{header_name}"] = ""
+        diff_row["status"] = "DIFF"
 
-    return diff_rows
+    return diff_row
+
+class InvoiceIndex:
+    """
+    PDF明細の検索用インデックス
+      - 金額: (金額, 行番号) のソート済み配列 → bisect による範囲検索
+      - 部屋番号: 正規化済み部屋番号 → 行番号リスト のハッシュ
+    業者名 / 建物名は正規化済み文字列を行番号順に保持する。
+    """
+
+    def __init__(self, pdf_rows):
+        self._build(
+            map_cached(remove_spaces_and_to_fullwidth, [p_item.get("工事業者名", "") for p_item in pdf_rows]),
+            map_cached(remove_spaces_and_to_fullwidth, [p_item.get("物件名", "") for p_item in pdf_rows]),
+            map_cached(canonicalize_room, [p_item.get("部屋番号", "") for p_item in pdf_rows]),
+            [parse_amount(p_item.get("金額", "")) for p_item in pdf_rows],
+        )
+
+    @classmethod
+    def from_fields(cls, names, buildings, room_keys, amounts):
+        """正規化済みの項目 (行番号順のリスト) から作る"""
+        index = cls.__new__(cls)
+        index._build(names, buildings, room_keys, amounts)
+        return index
+
+    def _build(self, names, buildings, room_keys, amounts):
+        # names / buildings / room_keys / amount_values: 行番号順の正規化済みの値
+        self.names = names
+        self.buildings = buildings
+        self.room_keys = room_keys
+        self.amount_values = amounts
+        self.rooms = {}
+        for i, room in enumerate(room_keys):
+            self.rooms.setdefault(room, []).append(i)
+        amounts = sorted((amount, i) for i, amount in enumerate(amounts) if amount is not None)
+        self.amount_keys = [amount for amount, _ in amounts]
+        self.amount_rows = [i for _, i in amounts]
+
+    def candidates(self, amount, tolerance, room):
+        """金額が amount ± tolerance かつ部屋番号が一致する行番号を昇順で返す"""
+        room_rows = self.rooms.get(room)
+        if not room_rows:
+            return []
+        lo = bisect.bisect_left(self.amount_keys, amount - tolerance)
+        hi = bisect.bisect_right(self.amount_keys, amount + tolerance)
+        if hi - lo <= len(room_rows):
+            room_set = set(room_rows)
+            return sorted(i for i in self.amount_rows[lo:hi] if i in room_set)
+        amount_set = set(self.amount_rows[lo:hi])
+        return [i for i in room_rows if i in amount_set]
+
+def map_cached(func, values):
+    """
+    values の各要素に func を適用したリストを返す。同じ値の変換は1回だけ行い、結果のオブジェクトを共有する
+    (業者名・建物名は同じ値が多いため。parallel_match でワーカーに渡す際の pickle も小さくなる)
+    """
+    cache = {}
+    result = []
+    for value in values:
+        try:
+            converted = cache[value]
+        except KeyError:
+            converted = cache[value] = func(value)
+        except TypeError:
+            # dict など hash できない値はそのまま変換する
+            converted = func(value)
+        result.append(converted)
+    return result
+
+_AMOUNT_NOISE = re.compile(r"[¥\\,円\s]|[(\[]?税込(?:み)?[)\]]?")
+_AMOUNT_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+def parse_amount(value):
+    """
+    金額を整数(円)に変換する。解釈できない場合は None。
+    例: 100000 / "100,000" / "¥100,000" / "１００，０００円（税込）" / "税込100000円" → 100000
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(round(value))
+    s = _AMOUNT_NOISE.sub("", unicodedata.normalize("NFKC", str(value)))
+    if s.startswith("△") or s.startswith("▲"):
+        s = "-" + s[1:]
+    if not _AMOUNT_PATTERN.fullmatch(s):
+        return None
+    return int(round(float(s)))
+
+_ROOM_SUFFIX = re.compile(r"(号室|号|室)$")
+
+def canonicalize_room(value):
+    """
+    部屋番号を比較用に正規化する (全角→半角、空白除去、「号室」などの接尾辞除去、先頭の0除去)。
+    例: "101号室" / "１０１" / 101 → "101"
+    """
+    if value is None:
+        return ""
+    s = unicodedata.normalize("NFKC", str(value)).replace(" ", "").upper()
+    s = _ROOM_SUFFIX.sub("", s)
+    if s.isdigit():
+        s = s.lstrip("0") or "0"
+    return s
 
 def remove_spaces_and_to_fullwidth(s: str) -> str:
     """
@@ -150,6 +352,48 @@ def remove_spaces_and_to_fullwidth(s: str) -> str:
             result.append(ch)
     return "".join(result)
 
+def similar_name_sets(csv_names, pdf_names, threshold, top_k=None):
+    """
+    CSV側の名称 → 類似度が threshold 以上の PDF側の名称の集合 を返す。
+    重複を除いた名称どうしで類似度をまとめて計算する。threshold <= 0 の場合は空。
+    """
+    if threshold <= 0 or not csv_names or not pdf_names:
+        return {}
+    from name_similarity import top_k_similar
+
+    queries = list(dict.fromkeys(csv_names))
+    targets = list(dict.fromkeys(pdf_names))
+    indexes, _ = top_k_similar(queries, targets, k=top_k or NAME_SIMILARITY_TOP_K, min_score=threshold)
+    similar = {}
+    for query, row in zip(queries, indexes.tolist()):
+        matches = {targets[j] for j in row if j >= 0}
+        if matches:
+            similar[query] = matches
+    return similar
+
+def master_ids(kind, csv_names, pdf_names, enabled=True):
+    """
+    CSV側 / PDF側の名称をマスタ (master_index) の正規IDのリストに変換する。
+    無効またはマスタが空の場合、および解決できない名称は None。
+    """
+    if enabled:
+        from master_index import canonical_ids, get_master_index
+
+        master = get_master_index(kind)
+        if len(master):
+            return canonical_ids(master, csv_names), canonical_ids(master, pdf_names)
+    return [None] * len(csv_names), [None] * len(pdf_names)
+
+def entities_match(csv_name, pdf_name, csv_id, pdf_id, similar):
+    """双方の正規IDが分かる場合はIDで、それ以外は名称の近さで判定する"""
+    if csv_id is not None and pdf_id is not None:
+        return csv_id == pdf_id
+    return names_match(csv_name, pdf_name, similar)
+
+def names_match(csv_name, pdf_name, similar):
+    """類似度の上位候補に含まれるか、レーベンシュタイン距離2以内なら True"""
+    return pdf_name in similar.get(csv_name, ()) or within_distance(csv_name, pdf_name)
+
 def within_distance(str_a, str_b, max_dist=2):
     """
     レーベンシュタイン距離が max_dist 以下なら True
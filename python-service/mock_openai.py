@@ -1,10 +1,91 @@
-class MockOpenAI:
-    def chat(self, messages):
-        return {"choices": [{"message": {"content": "Mock OCR result"}}]}
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
 
-    def create(self, *args, **kwargs):
-        return {"choices": [{"message": {"content": "Mock OCR result"}}]}
 
-class Client:
-    def __init__(self, api_key=None):
-        self.chat = MockOpenAI()
+def create_mock_app(latency=0.0, rate_limit_ratio=0.0, content="Mock OCR result", seed=None):
+    """
+    OpenAI 互換の Chat Completions API を返すローカルモックサーバー (FastAPI アプリ)。
+    latency: 応答までの遅延(秒)
+    rate_limit_ratio: 429 を返す割合 (0.0〜1.0)
+    app.state.calls / app.state.rate_limited で受信数と 429 応答数を確認できる。
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+    app.state.calls = 0
+    app.state.rate_limited = 0
+    rng = random.Random(seed)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+
+        if rate_limit_ratio and rng.random() < rate_limit_ratio:
+            app.state.rate_limited += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit exceeded", "type": "rate_limit_exceeded"}},
+                headers={"retry-after": "0"},
+            )
+
+        if latency:
+            await asyncio.sleep(latency)
+
+        return {
+            "id": f"chatcmpl-mock-{app.state.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def start_mock_server(app, host="127.0.0.1", port=0):
+    """
+    モックアプリをバックグラウンドスレッドで起動し、(base_url, stop関数) を返す。
+    base_url はそのまま OPENAI_BASE_URL / LLMClient(base_url=...) に指定できる。
+    """
+    import uvicorn
+
+    if not port:
+        with socket.socket() as s:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return f"http://{host}:{port}/v1", stop
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI 互換モックサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答遅延(秒)")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="429 を返す割合")
+    args = parser.parse_args()
+
+    uvicorn.run(create_mock_app(args.latency, args.rate_limit_ratio), host=args.host, port=args.port)
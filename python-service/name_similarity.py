@@ -0,0 +1,225 @@
+"""
+業者名 / 建物名の文字 n-gram コサイン類似度 (NumPy によるバッチ計算)
+
+    top_k_similar(queries, targets, k=5, min_score=0.8)  # 各 query に近い target の (index, score)
+
+名称を正規化 (NFKC、空白・記号除去、「株式会社」「(株)」などの法人格除去) した上で
+文字 2-gram / 3-gram の TF-IDF ベクトル (疎行列, CSR 形式) に一度だけ変換し、
+target 側の転置インデックスから query のチャンクごとに候補を集めて上位 k 件を取り出す。
+チャンクの大きさは memory_budget で制限するため、件数が増えてもメモリ使用量は一定。
+"""
+import re
+import unicodedata
+
+import numpy as np
+
+NGRAM_SIZES = (2, 3)
+# 1チャンクで確保する候補の展開配列の上限 (bytes)
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+# 候補生成に使う n-gram の出現 target 数の上限。「工務店」のようなありふれた n-gram は
+# 候補を増やすだけなので候補生成には使わない (スコアの再計算では使う)
+DEFAULT_MAX_DF = 50
+# 出現数に関わらず候補生成に使う、各 query の珍しい n-gram の数
+MIN_CANDIDATE_GRAMS = 2
+# 正確なスコアを計算し直す候補数 (k の倍数)
+RESCORE_FACTOR = 4
+
+# 先頭・末尾を表す印。短い名称でも n-gram が作れるようにする
+_PAD_START = "\x02"
+_PAD_END = "\x03"
+
+_LEGAL_FORMS = re.compile(
+    r"株式会社|有限会社|合同会社|合資会社|合名会社|一般社団法人|一般財団法人|"
+    r"\((?:株|有|同|資|名)\)|[㈱㈲]"
+)
+# 区切り記号・括弧 (長音「ー」は名称の一部なので残す)
+_NAME_NOISE = re.compile(r"[\s・\-―‐.,、。()\[\]「」]")
+
+
+def normalize_name(s):
+    """
+    類似度計算用に名称を正規化する。
+    例: "株式会社 山田工務店" / "山田工務店(株)" / "㈱山田工務店" → "山田工務店"
+    """
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFKC", str(s))
+    s = _LEGAL_FORMS.sub("", s)
+    return _NAME_NOISE.sub("", s).upper()
+
+
+def _ngrams(s):
+    padded = _PAD_START + s + _PAD_END
+    for n in NGRAM_SIZES:
+        for i in range(len(padded) - n + 1):
+            yield padded[i:i + n]
+
+
+def encode(strings, vocab):
+    """
+    正規化済み文字列のリストを n-gram の出現回数の疎行列 (indptr, indices, counts) に変換する。
+    未知の n-gram は vocab に追加する。
+    """
+    indptr = [0]
+    indices = []
+    for s in strings:
+        if s:
+            indices.extend(vocab.setdefault(g, len(vocab)) for g in _ngrams(s))
+        indptr.append(len(indices))
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+
+    # 行内の重複 n-gram をまとめて出現回数にする
+    rows = np.repeat(np.arange(len(strings), dtype=np.int64), np.diff(indptr))
+    keys, counts = np.unique(rows * max(len(vocab), 1) + indices, return_counts=True)
+    rows = keys // max(len(vocab), 1)
+    indices = keys % max(len(vocab), 1)
+    indptr = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(strings)), out=indptr[1:])
+    return indptr, indices, counts.astype(np.float64)
+
+
+def _tfidf(matrix, idf):
+    """出現回数に IDF を掛けて行ごとに L2 正規化する"""
+    indptr, indices, counts = matrix
+    data = counts * idf[indices]
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=len(indptr) - 1))
+    data /= np.where(norms > 0, norms, 1.0)[rows]
+    return indptr, indices, data
+
+
+def vectorize(queries, targets):
+    """
+    query / target 双方を正規化して TF-IDF ベクトル (CSR) にする。
+    IDF は両側を合わせた文書頻度から求める。
+    """
+    vocab = {}
+    q = encode([normalize_name(s) for s in queries], vocab)
+    t = encode([normalize_name(s) for s in targets], vocab)
+    df = np.bincount(q[1], minlength=len(vocab)) + np.bincount(t[1], minlength=len(vocab))
+    n_docs = len(queries) + len(targets)
+    idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+    return _tfidf(q, idf), _tfidf(t, idf), len(vocab)
+
+
+def top_k_similar(queries, targets, k=5, min_score=0.0, memory_budget=DEFAULT_MEMORY_BUDGET, max_df=None):
+    """
+    各 query について、コサイン類似度が高い target を最大 k 件返す。
+
+    戻り値: (indexes, scores) いずれも shape (len(queries), k)。
+    スコアの降順 (同点は target の添字順)。該当なし・min_score 未満の枠は index=-1, score=0。
+
+    候補は「出現する target 数が max_df 以下の n-gram」を共有する target から集め
+    (各 query で最も珍しい MIN_CANDIDATE_GRAMS 個の n-gram は常に使う)、
+    部分スコアの上位 RESCORE_FACTOR * k 件について全 n-gram で正確なコサイン類似度を計算し直す。
+    """
+    n_q, n_t = len(queries), len(targets)
+    k = max(1, min(k, n_t)) if n_t else 1
+    out_idx = np.full((n_q, k), -1, dtype=np.int64)
+    out_score = np.zeros((n_q, k), dtype=np.float64)
+    if not n_q or not n_t:
+        return out_idx, out_score
+    if max_df is None:
+        max_df = DEFAULT_MAX_DF
+
+    (q_ptr, q_ind, q_val), (t_ptr, t_ind, t_val), n_grams = vectorize(queries, targets)
+    q_rows = np.repeat(np.arange(n_q, dtype=np.int64), np.diff(q_ptr))
+
+    # target 側の転置インデックス: n-gram → (target 行, 重み)
+    t_rows = np.repeat(np.arange(n_t, dtype=np.int64), np.diff(t_ptr))
+    order = np.argsort(t_ind, kind="stable")
+    post_rows = t_rows[order]
+    post_val = t_val[order]
+    post_ptr = np.zeros(n_grams + 1, dtype=np.int64)
+    np.cumsum(np.bincount(t_ind, minlength=n_grams), out=post_ptr[1:])
+    post_len = np.diff(post_ptr)
+    # 正確なスコア計算用: target の (行, n-gram) キー (行順・n-gram 順にソート済み)
+    t_keys = t_rows * n_grams + t_ind
+
+    # 候補生成に使う query 側の要素 (珍しい n-gram)
+    q_len = post_len[q_ind]
+    use = q_len <= max_df
+    by_rarity = np.lexsort((q_len, q_rows))
+    rank = np.arange(len(q_rows)) - np.repeat(q_ptr[:-1], np.diff(q_ptr))
+    use[by_rarity[rank < MIN_CANDIDATE_GRAMS]] = True
+    expand = np.where(use, q_len, 0)
+    expand_cum = np.concatenate(([0], np.cumsum(np.bincount(q_rows, weights=expand, minlength=n_q)))).astype(np.int64)
+
+    # 展開した候補1件あたり、一時配列 (np.unique のソートを含む) で約 256 bytes 使う
+    max_expand = max(1, memory_budget // 256)
+    rescore = RESCORE_FACTOR * k
+
+    start = 0
+    while start < n_q:
+        end = np.searchsorted(expand_cum, expand_cum[start] + max_expand, side="right") - 1
+        end = min(max(start + 1, end), n_q)
+
+        rows, cands = _candidates(q_ptr, q_ind, q_val, use, start, end, post_ptr, post_rows, post_val, n_t, rescore)
+        scores = _exact_scores(rows, cands, q_ptr, q_ind, q_val, t_keys, t_val, n_grams)
+        _select_top_k(rows, cands, scores, k, min_score, out_idx, out_score)
+        start = end
+    return out_idx, out_score
+
+
+def _group_rank(rows):
+    """rows (昇順) の各要素がグループ内で何番目かを返す"""
+    if not len(rows):
+        return rows
+    starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+    return np.arange(len(rows)) - np.repeat(starts, np.diff(np.append(starts, len(rows))))
+
+
+def _candidates(q_ptr, q_ind, q_val, use, start, end, post_ptr, post_rows, post_val, n_t, limit):
+    """query[start:end] の候補 (query 行, target 行) を部分スコアの上位 limit 件ずつ返す"""
+    lo, hi = q_ptr[start], q_ptr[end]
+    local = np.repeat(np.arange(start, end, dtype=np.int64), np.diff(q_ptr[start:end + 1]))
+    mask = use[lo:hi]
+    rows, grams, weights = local[mask], q_ind[lo:hi][mask], q_val[lo:hi][mask]
+
+    # 各 query 要素を、同じ n-gram を持つ target 要素の数だけ展開する
+    starts = post_ptr[grams]
+    lengths = post_ptr[grams + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(total, dtype=np.int64) - np.repeat(offsets - starts, lengths)
+
+    pair_keys, inverse = np.unique(np.repeat(rows, lengths) * n_t + post_rows[positions], return_inverse=True)
+    partial = np.bincount(inverse, weights=np.repeat(weights, lengths) * post_val[positions])
+    pair_rows, pair_targets = pair_keys // n_t, pair_keys % n_t
+
+    order = np.lexsort((pair_targets, -partial, pair_rows))
+    pair_rows, pair_targets = pair_rows[order], pair_targets[order]
+    keep = _group_rank(pair_rows) < limit
+    return pair_rows[keep], pair_targets[keep]
+
+
+def _exact_scores(rows, cands, q_ptr, q_ind, q_val, t_keys, t_val, n_grams):
+    """候補 (query 行, target 行) ごとに全 n-gram でのコサイン類似度を計算する"""
+    if not len(rows):
+        return np.empty(0)
+    starts = q_ptr[rows]
+    lengths = q_ptr[rows + 1] - starts
+    total = int(lengths.sum())
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(total, dtype=np.int64) - np.repeat(offsets - starts, lengths)
+
+    keys = np.repeat(cands, lengths) * n_grams + q_ind[positions]
+    found = np.minimum(np.searchsorted(t_keys, keys), len(t_keys) - 1)
+    hit = t_keys[found] == keys
+    products = np.where(hit, q_val[positions] * t_val[found], 0.0)
+    return np.bincount(np.repeat(np.arange(len(rows)), lengths), weights=products, minlength=len(rows))
+
+
+def _select_top_k(rows, cands, scores, k, min_score, out_idx, out_score):
+    """候補をスコア降順 (同点は target の添字順) に並べ、行ごとに上位 k 件を書き込む"""
+    keep = (scores > 0) & (scores >= min_score - 1e-9)
+    rows, cands, scores = rows[keep], cands[keep], scores[keep]
+    order = np.lexsort((cands, -scores, rows))
+    rows, cands, scores = rows[order], cands[order], scores[order]
+    rank = _group_rank(rows)
+    top = rank < k
+    out_idx[rows[top], rank[top]] = cands[top]
+    out_score[rows[top], rank[top]] = scores[top]
@@ -0,0 +1,258 @@
+"""
+大きなページ画像のタイル分割OCR
+
+ページを画素数基準で横長の帯(タイル)に分割し、隣接タイルを overlap 分だけ重ねて
+並列に OCR する。重なり部分の行は「行の中心がどのタイルの担当範囲に入るか」で
+1つのタイルにだけ割り当てるため、境界で切れた行や重複行は結果に残らない。
+"""
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from process_pools import get_resident_pool
+
+# 1タイルあたりの最大画素数 (A4 300dpi ≒ 8.7M画素)
+MAX_TILE_PIXELS = int(os.getenv("OCR_MAX_TILE_PIXELS", str(4_000_000)))
+# 隣接タイルの重なり(px)。1行の高さより大きくする
+TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "120"))
+# OCR ワーカープロセス数。0 の場合はスレッドで OCR する (ocr_pages)
+OCR_PROCESS_WORKERS = int(os.getenv("OCR_PROCESS_WORKERS", "0"))
+# スレッドで OCR する場合の同時実行数 (プロセス全体で共有。リクエスト数に関わらず tesseract の同時起動数を抑える)
+OCR_THREAD_WORKERS = int(os.getenv("OCR_THREAD_WORKERS", "0")) or os.cpu_count() or 1
+
+# top/bottom: 切り出し範囲, own_top/own_bottom: このタイルが担当する範囲 (ページ座標)
+Tile = namedtuple("Tile", ["top", "bottom", "own_top", "own_bottom"])
+
+
+def plan_tiles(width, height, max_pixels=MAX_TILE_PIXELS, overlap=TILE_OVERLAP):
+    """ページサイズからタイルの配置を決める。画素数が上限以下なら1タイル"""
+    if width * height <= max_pixels:
+        return [Tile(0, height, 0, height)]
+
+    strip_height = max(max_pixels // width, overlap * 2 + 1)
+    step = strip_height - overlap
+
+    ranges = []
+    top = 0
+    while True:
+        bottom = min(top + strip_height, height)
+        ranges.append((top, bottom))
+        if bottom >= height:
+            break
+        top += step
+
+    # 担当範囲の境界は重なり部分の中央
+    tiles = []
+    for i, (top, bottom) in enumerate(ranges):
+        own_top = 0 if i == 0 else (ranges[i - 1][1] + top) // 2
+        own_bottom = height if i == len(ranges) - 1 else (bottom + ranges[i + 1][0]) // 2
+        tiles.append(Tile(top, bottom, own_top, own_bottom))
+    return tiles
+
+
+def merge_tile_lines(tiles, tile_lines):
+    """
+    タイルごとの行 [(top, bottom, text), ...] (ページ座標) を結合する。
+    行の中心が担当範囲に入るタイルの行だけを残し、タイル内の順序は維持する。
+    """
+    merged = []
+    for tile, lines in zip(tiles, tile_lines):
+        for top, bottom, text in lines:
+            center = (top + bottom) / 2
+            if tile.own_top <= center < tile.own_bottom:
+                merged.append(text)
+    return "\n".join(merged)
+
+
+def _ocr_tile_lines(image, tile, lang):
+    """タイルを OCR し、行ごとの (top, bottom, text) をページ座標で返す"""
+    import pytesseract
+
+    crop = image.crop((0, tile.top, image.width, tile.bottom))
+    data = pytesseract.image_to_data(crop, lang=lang, output_type=pytesseract.Output.DICT)
+
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if not word or not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        top = data["top"][i]
+        bottom = top + data["height"][i]
+        line = lines.get(key)
+        if line is None:
+            lines[key] = [top, bottom, [word]]
+        else:
+            line[0] = min(line[0], top)
+            line[1] = max(line[1], bottom)
+            line[2].append(word)
+
+    return [(tile.top + top, tile.top + bottom, " ".join(words)) for top, bottom, words in lines.values()]
+
+
+def _ocr_tile(image, tile, lang, ignore_errors):
+    try:
+        return _ocr_tile_lines(image, tile, lang)
+    except Exception as e:
+        if not ignore_errors:
+            raise
+        print(f"OCR error: {e}")
+        return []
+
+
+def _ocr_whole(image, lang, ignore_errors):
+    import pytesseract
+
+    try:
+        return pytesseract.image_to_string(image, lang=lang)
+    except Exception as e:
+        if not ignore_errors:
+            raise
+        print(f"OCR error: {e}")
+        return ""
+
+
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+
+def get_thread_pool(max_workers=None):
+    """OCR 用の共有スレッドプールを返す (初回呼び出し時に作成)"""
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=max_workers or OCR_THREAD_WORKERS,
+                                              thread_name_prefix="ocr")
+        return _thread_pool
+
+
+def ocr_pages(images, lang="jpn+eng", max_workers=None, ignore_errors=False,
+              max_pixels=MAX_TILE_PIXELS, overlap=TILE_OVERLAP):
+    """
+    ページ画像(PIL Image)のリストを OCR し、ページごとのテキストを返す。
+    全ページの全タイルを共有スレッドプール (get_thread_pool) で並列に処理する
+    (pytesseract は外部プロセスを起動するため GIL の影響を受けない)。
+    同時に処理するリクエストが増えても、tesseract の同時起動数はプールのスレッド数までに収まる。
+    max_workers はプールを初回に作成する際のスレッド数 (既定: OCR_THREAD_WORKERS)。
+    """
+    plans = [plan_tiles(img.width, img.height, max_pixels, overlap) for img in images]
+    pool = get_thread_pool(max_workers)
+
+    futures = []
+    for img, tiles in zip(images, plans):
+        if len(tiles) == 1:
+            futures.append([pool.submit(_ocr_whole, img, lang, ignore_errors)])
+        else:
+            futures.append([pool.submit(_ocr_tile, img, tile, lang, ignore_errors) for tile in tiles])
+
+    try:
+        texts = []
+        for tiles, page_futures in zip(plans, futures):
+            if len(tiles) == 1:
+                texts.append(page_futures[0].result())
+            else:
+                texts.append(merge_tile_lines(tiles, [f.result() for f in page_futures]))
+        return texts
+    finally:
+        # エラーで途中終了した場合は、まだ始まっていないタイルを取り消す
+        for page_futures in futures:
+            for future in page_futures:
+                future.cancel()
+
+
+def rasterize_pages(pdf_bytes, pages=None):
+    """
+    PDF をグレースケール(L)のページ画像に変換する。pages ("1-3,5" など) を指定した場合は
+    該当範囲だけをラスタライズし、指定順のページ画像を返す。
+    ワーカープロセスによる OCR (ocr_pdf_pages) と同じ画像を Tesseract に渡すため、グレースケールにする。
+    """
+    from pdf2image import convert_from_bytes
+
+    if pages is None:
+        return convert_from_bytes(pdf_bytes, grayscale=True)
+
+    from pdf_text import page_count, parse_page_range
+
+    indexes = parse_page_range(pages, page_count(pdf_bytes))
+    first, last = min(indexes), max(indexes)
+    images = convert_from_bytes(pdf_bytes, first_page=first + 1, last_page=last + 1, grayscale=True)
+    return [images[i - first] for i in indexes]
+
+
+# --- ワーカープロセスによる OCR (共有バッファ経由) ---
+
+def get_process_pool(max_workers=None):
+    """OCR 用の常駐ワーカープロセスプール (process_pools.ResidentPool) を返す"""
+    return get_resident_pool("ocr", max_workers or OCR_PROCESS_WORKERS or os.cpu_count())
+
+
+def _ocr_shared_tile(path, width, height, tile, lang, whole, ignore_errors):
+    """ワーカー側: 共有バッファ上のページをコピーせずに参照してタイルを OCR する"""
+    from page_buffers import open_page_view
+
+    with open_page_view(path, width, height) as page:
+        if whole:
+            return _ocr_whole(page, lang, ignore_errors)
+        return _ocr_tile(page, tile, lang, ignore_errors)
+
+
+def ocr_pdf_pages(pdf_bytes, lang="jpn+eng", max_workers=None, ignore_errors=False, ring_size=None,
+                  max_pixels=MAX_TILE_PIXELS, overlap=TILE_OVERLAP, pages=None):
+    """
+    PDF を1ページずつグレースケールでラスタライズし、ワーカープロセスで OCR してページごとのテキストを返す。
+    ページの画素は共有バッファのリング (page_buffers) に書き込み、ワーカーへはパスとサイズだけを渡す。
+    リングが埋まっている間はラスタライズを待たせるため、同時に保持するページ数は ring_size 以下になる。
+    pages ("1-3,5" など) を指定した場合はそのページだけを処理する。
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    from page_buffers import PageBufferRing
+    from pdf_text import parse_page_range
+
+    workers = max_workers or OCR_PROCESS_WORKERS or os.cpu_count()
+    pool = get_process_pool(workers)
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file, PageBufferRing(ring_size or workers * 2) as ring:
+        pdf_file.write(pdf_bytes)
+        pdf_file.flush()
+        page_count = pdfinfo_from_path(pdf_file.name)["Pages"]
+
+        submitted = []
+        for index in parse_page_range(pages, page_count):
+            page_no = index + 1
+            [image] = convert_from_path(pdf_file.name, first_page=page_no, last_page=page_no, grayscale=True)
+            buf = ring.acquire()
+            buf.write(image)
+            del image
+
+            tiles = plan_tiles(buf.width, buf.height, max_pixels, overlap)
+            whole = len(tiles) == 1
+            futures = [
+                pool.submit(_ocr_shared_tile, buf.path, buf.width, buf.height, tile, lang, whole, ignore_errors)
+                for tile in tiles
+            ]
+            _release_when_done(ring, buf, futures)
+            submitted.append((tiles, futures))
+
+        texts = []
+        for tiles, futures in submitted:
+            if len(tiles) == 1:
+                texts.append(futures[0].result())
+            else:
+                texts.append(merge_tile_lines(tiles, [f.result() for f in futures]))
+    return texts
+
+
+def _release_when_done(ring, buf, futures):
+    """ページの全タイルの OCR が終わったらバッファをリングに戻す"""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                ring.release(buf)
+
+    for future in futures:
+        future.add_done_callback(done)
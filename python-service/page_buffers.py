@@ -0,0 +1,109 @@
+"""
+ページ画像を OCR ワーカープロセスへ受け渡すための共有バッファ
+
+ラスタライズしたページの画素を tmpfs (/dev/shm) 上の mmap ファイルに書き込み、
+ワーカーは同じファイルを読み取り専用で mmap して PIL の画像ビューとして参照する。
+プロセス間で渡すのはファイルパスと画像サイズだけなので、画素データの pickle は発生しない。
+
+バッファは固定数のスロットを使い回すリングで管理し、空きがない場合は
+acquire() が解放を待つ (ラスタライズ側へのバックプレッシャー)。
+"""
+import mmap
+import os
+import queue
+import tempfile
+
+# 共有バッファの置き場所。tmpfs が使える環境では /dev/shm を使う
+BUFFER_DIR = os.getenv("OCR_BUFFER_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+
+class PageBuffer:
+    """リングの1スロット (mmap されたファイル)"""
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(prefix="ocr-page-", dir=directory)
+        self._fd = fd
+        self.capacity = 0
+        self._map = None
+        self.width = 0
+        self.height = 0
+
+    def _ensure_capacity(self, size):
+        # スロットが使用中でないときだけ呼ばれるため、作り直してもワーカーとは競合しない
+        if size <= self.capacity:
+            return
+        if self._map is not None:
+            self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self.capacity = size
+
+    def write(self, image):
+        """グレースケール(L)画像の画素をバッファへコピーする"""
+        if image.mode != "L":
+            image = image.convert("L")
+        self.width, self.height = image.size
+        size = self.width * self.height
+        self._ensure_capacity(size)
+        self._map[:size] = image.tobytes()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        os.close(self._fd)
+        os.unlink(self.path)
+
+
+class PageBufferRing:
+    """再利用可能な PageBuffer の固定長リング"""
+
+    def __init__(self, size, directory=None):
+        self._buffers = [PageBuffer(directory or BUFFER_DIR) for _ in range(size)]
+        self._free = queue.Queue()
+        for buf in self._buffers:
+            self._free.put(buf)
+
+    def acquire(self, timeout=None):
+        """空きスロットを取得する。全スロット使用中の場合は解放されるまで待つ"""
+        return self._free.get(timeout=timeout)
+
+    def release(self, buf):
+        self._free.put(buf)
+
+    def close(self):
+        for buf in self._buffers:
+            buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class open_page_view:
+    """
+    ワーカー側: 共有バッファを読み取り専用で mmap し、コピーなしの PIL 画像ビューを返す。
+
+        with open_page_view(path, width, height) as page:
+            crop = page.crop(...)
+    """
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.size = (width, height)
+
+    def __enter__(self):
+        from PIL import Image
+
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), self.size[0] * self.size[1], access=mmap.ACCESS_READ)
+        self._image = Image.frombuffer("L", self.size, self._map, "raw", "L", 0, 1)
+        return self._image
+
+    def __exit__(self, *exc):
+        # ビューが残っていると mmap を閉じられないため先に破棄する
+        self._image.close()
+        self._image = None
+        self._map.close()
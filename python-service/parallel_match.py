@@ -0,0 +1,186 @@
+"""
+突合 (match_lambda.iter_diff_rows) の明細検索をワーカープロセスで分担する
+
+    matches = shard_matches(orders, matcher, workers=4)   # 各 CSV 行に一致した明細の行番号 (なければ None)
+
+CSV 行・PDF 明細を正規化済みの部屋番号ごとのブロックに分け、ブロックを件数が均等になるよう
+シャードにまとめてプロセスプールで突合する。部屋番号は完全一致が条件のため、ブロック内で探した結果は
+全明細から探した結果と同じになる。
+1シャード分を超える部屋番号 (空欄など) は、さらに金額の区間 (amount_bucket 円ごと) で分ける。
+金額 ± 許容誤差 が1つの区間に収まる CSV 行の候補は同じ区間の明細に限られるが、
+区間の境界をまたぐ CSV 行は親プロセスで全明細のインデックスから探す (ワーカーの処理中に行う)。
+
+業者名 / 建物名の類似度やマスタの正規IDは親プロセスで全体に対して求めたもの
+(match_lambda.prepare_match) をシャードに渡すため、結果は逐次処理と一致する。
+"""
+import heapq
+import multiprocessing
+import os
+from operator import itemgetter
+
+from match_lambda import InvoiceIndex, InvoiceMatcher, OrderKey
+from process_pools import get_resident_pool
+
+# 突合のワーカープロセス数 (0 / 1: 逐次処理)
+MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", "0"))
+# これより CSV の行数が少ない場合はプロセスを起動せず逐次処理する
+MATCH_PARALLEL_MIN_ROWS = int(os.getenv("MATCH_PARALLEL_MIN_ROWS", "5000"))
+# ブロックに分ける金額の区間の幅 (円)。許容誤差に比べて十分大きくする
+AMOUNT_BUCKET = int(os.getenv("MATCH_AMOUNT_BUCKET", "10000"))
+# ワーカーあたりのシャード数 (大きいほど負荷が均等になり、受け渡しの回数は増える)
+SHARDS_PER_WORKER = 4
+
+
+def partition(orders, index, n_shards, amount_bucket=AMOUNT_BUCKET):
+    """
+    CSV 行をブロックに分ける。
+    戻り値: ([(CSV 行番号のリスト, 明細の行番号のリスト), ...], 区間の境界をまたぐ CSV 行番号のリスト)
+    金額が解釈できない行と、同じ部屋番号の明細がない行は (一致しないことが確定するため) どちらにも含めない。
+    """
+    room_orders = {}
+    for row_no, order in enumerate(orders):
+        if order.money is not None and order.room in index.rooms:
+            room_orders.setdefault(order.room, []).append(row_no)
+    load = sum(len(rows) + len(index.rooms[room]) for room, rows in room_orders.items())
+    limit = -(-load // max(1, n_shards))
+
+    blocks = []
+    fallback = []
+    for room, order_rows in room_orders.items():
+        invoice_rows = index.rooms[room]
+        if len(order_rows) + len(invoice_rows) <= limit:
+            blocks.append((order_rows, invoice_rows))
+            continue
+        # 大きな部屋番号は金額の区間で分ける
+        invoice_blocks = {}
+        for i in invoice_rows:
+            amount = index.amount_values[i]
+            if amount is not None:
+                invoice_blocks.setdefault(amount // amount_bucket, []).append(i)
+        sub_blocks = {}
+        for row_no in order_rows:
+            order = orders[row_no]
+            lo = (order.money - order.tolerance) // amount_bucket
+            if lo != (order.money + order.tolerance) // amount_bucket:
+                fallback.append(row_no)
+            elif int(lo) in invoice_blocks:
+                sub_blocks.setdefault(int(lo), ([], invoice_blocks[int(lo)]))[0].append(row_no)
+        blocks.extend(sub_blocks.values())
+    fallback.sort()
+    return blocks, fallback
+
+
+def balance(blocks, n_shards):
+    """
+    ブロックを n_shards 個のシャードに振り分ける (処理量の大きい順に最も空いているシャードへ)。
+    CSV 行が1シャード分を超えるブロックは、同じ明細を持たせたまま CSV 行を分割する。
+    """
+    total = sum(len(order_rows) for order_rows, _ in blocks)
+    if not total:
+        return []
+    n_shards = max(1, min(n_shards, total))
+    limit = -(-total // n_shards)
+
+    pieces = []
+    for order_rows, invoice_rows in blocks:
+        for start in range(0, len(order_rows), limit):
+            pieces.append((order_rows[start:start + limit], invoice_rows))
+    # 処理量: CSV 行の検索 + 明細のインデックス作成。同じ大きさは先頭の行番号順 (振り分けを決定的にする)
+    pieces.sort(key=lambda piece: (-(len(piece[0]) + len(piece[1])), piece[0][0]))
+
+    shards = [[] for _ in range(n_shards)]
+    heap = [(0, n) for n in range(n_shards)]
+    for piece in pieces:
+        load, n = heapq.heappop(heap)
+        shards[n].append(piece)
+        heapq.heappush(heap, (load + len(piece[0]) + len(piece[1]), n))
+    return [shard for shard in shards if shard]
+
+
+def _take(values, rows):
+    """values から rows の位置の要素をタプルで取り出す"""
+    if len(rows) == 1:
+        return (values[rows[0]],)
+    return itemgetter(*rows)(values) if rows else ()
+
+
+def _shard_payload(shard, order_columns, matcher):
+    """シャードの CSV 行と、その突合に必要な明細の項目だけを取り出す (ワーカーへの受け渡し量を抑える)"""
+    index = matcher.index
+    order_rows = [row_no for order_rows, _ in shard for row_no in order_rows]
+    # 行番号の昇順に並べるため、ワーカー内でも PDF 上の順序で最初の明細が選ばれる
+    invoice_rows = sorted({i for _, rows in shard for i in rows})
+    # OrderKey のリストより列ごとのタプルの方が pickle が速い
+    orders = [_take(column, order_rows) for column in order_columns]
+    names = set(orders[OrderKey._fields.index("name")])
+    builds = set(orders[OrderKey._fields.index("building")])
+    return {
+        "order_rows": order_rows,
+        "orders": orders,
+        "invoice_rows": invoice_rows,
+        "fields": [list(_take(values, invoice_rows)) for values in (
+            index.names, index.buildings, index.room_keys, index.amount_values)],
+        "vendor_ids": _take(matcher.vendor_ids, invoice_rows),
+        "building_ids": _take(matcher.building_ids, invoice_rows),
+        "similar_names": {name: matcher.similar_names[name] for name in names if name in matcher.similar_names},
+        "similar_builds": {name: matcher.similar_builds[name] for name in builds if name in matcher.similar_builds},
+    }
+
+
+def get_process_pool(workers):
+    """
+    突合用の常駐ワーカープロセスプール (process_pools.ResidentPool) を返す。
+    プロセス数は MATCH_WORKERS (未設定の場合は最初の呼び出しの workers)。workers はシャード数を決める。
+    """
+    return get_resident_pool("match", MATCH_WORKERS if MATCH_WORKERS > 1 else workers)
+
+
+def _match_shard(payload):
+    """シャード内の CSV 行を突合し、(CSV 行番号のリスト, 全体での明細の行番号 or None のリスト) を返す"""
+    index = InvoiceIndex.from_fields(*payload["fields"])
+    matcher = InvoiceMatcher(index, payload["vendor_ids"], payload["building_ids"],
+                             payload["similar_names"], payload["similar_builds"])
+    invoice_rows = payload["invoice_rows"]
+    matches = []
+    for order in map(OrderKey._make, zip(*payload["orders"])):
+        i = matcher.first_match(order)
+        matches.append(None if i is None else invoice_rows[i])
+    return payload["order_rows"], matches
+
+
+def shard_matches(orders, matcher, workers=None, amount_bucket=AMOUNT_BUCKET):
+    """
+    orders (match_lambda.OrderKey のリスト) の各行について、matcher の明細から一致する最初の行番号
+    (なければ None) を CSV の行順に返す。InvoiceMatcher.first_match を順に呼んだ結果と同じ。
+    """
+    workers = MATCH_WORKERS if workers is None else workers
+    results = [None] * len(orders)
+    n_shards = max(1, workers) * SHARDS_PER_WORKER
+    blocks, fallback = partition(orders, matcher.index, n_shards, amount_bucket)
+    order_columns = list(zip(*orders))
+    payloads = [_shard_payload(shard, order_columns, matcher) for shard in balance(blocks, n_shards)]
+
+    def merge(order_rows, matches):
+        for row_no, i in zip(order_rows, matches):
+            results[row_no] = i
+
+    # wrapper.py のワーカーなどデーモンプロセス内では子プロセスを作れないため逐次処理する
+    if workers <= 1 or len(payloads) <= 1 or multiprocessing.current_process().daemon:
+        for payload in payloads:
+            merge(*_match_shard(payload))
+        for row_no in fallback:
+            results[row_no] = matcher.first_match(orders[row_no])
+        return results
+
+    pool = get_process_pool(workers)
+    futures = [pool.submit(_match_shard, payload) for payload in payloads]
+    try:
+        # 区間の境界をまたぐ行は、ワーカーの処理中に親プロセスで全明細から探す
+        for row_no in fallback:
+            results[row_no] = matcher.first_match(orders[row_no])
+        for future in futures:
+            merge(*future.result())
+    finally:
+        for future in futures:
+            future.cancel()
+    return results
@@ -2,26 +2,57 @@
 import json
 import base64
 import io
-import openai
-import PyPDF2
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
+import os
+import re
 
+from payload_store import open_payload, result_body
+from profiling import profile_handler
+
+# openai / PyPDF2 / pytesseract / pdf2image は初回利用時に読み込む (コールドスタート短縮)
+
+def warm_up():
+    """
+    遅延読み込みしている依存を事前に読み込む (Lambda の初期化フェーズなどで呼び出す)
+    """
+    import llm_client  # noqa: F401
+    import openai  # noqa: F401
+    import httpx  # noqa: F401
+    import PyPDF2  # noqa: F401
+    import pdf_text  # noqa: F401
+    import pytesseract  # noqa: F401
+    import pdf2image  # noqa: F401
+    import ocr_tiling  # noqa: F401
+
+@profile_handler
 def lambda_handler(event, context):
     """
-    1) PDFバイナリをBase64で受け取り
+    1) PDFを受け取り
+       event["file_uri"]: ローカルパス / s3:// などの参照 (payload_store.py)。mmap で読み込む
+       event["file_bytes"]: Base64エンコードされたPDF (file_uri がない場合)
     2) use_ocr=Trueの場合はOCR + ChatGPT でJSON化
-    3) JSONレスポンスを返す
+    3) JSONレスポンスを返す。event["result_uri"] の指定時、または結果が大きい場合は
+       書き出して {"result_uri": ..., "size": ...} を返す
+    ファイルの指定・ページ指定の誤りや file_uri が読めない場合は statusCode 400 を返す
+    (parse_order_lambda.lambda_handler と同じ形式)。
     """
-    openai.api_key = "YOUR_OPENAI_API_KEY"
-
-    file_bytes_b64 = event.get("file_bytes", "")
-    file_bytes = base64.b64decode(file_bytes_b64)
     use_ocr = event.get("use_ocr", False)
+    pages = event.get("pages")
 
     # PDFをテキスト化
-    raw_text = extract_text_from_pdf(file_bytes, use_ocr)
+    try:
+        if event.get("file_uri"):
+            with open_payload(event["file_uri"]) as file_bytes:
+                raw_text = extract_text_from_pdf(file_bytes, use_ocr, pages)
+        elif event.get("file_bytes"):
+            file_bytes = base64.b64decode(event["file_bytes"])
+            raw_text = extract_text_from_pdf(file_bytes, use_ocr, pages)
+        else:
+            raise ValueError("ファイルが指定されていません。")
+    except (ValueError, OSError) as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": str(e)})
+        }
 
     # ChatGPTでJSON化
     unified_text = unify_text_via_openai(raw_text)
@@ -34,108 +65,86 @@ def lambda_handler(event, context):
 
     return {
         "statusCode": 200,
-        "body": json.dumps({
-            "invoice_data": invoice_data
-        })
+        "body": result_body(
+            {"invoice_data": invoice_data},
+            event.get("result_uri"),
+            getattr(context, "aws_request_id", None),
+        )
     }
 
-def extract_text_from_pdf(pdf_bytes, use_ocr=False):
+def extract_text_from_pdf(pdf_bytes, use_ocr=False, pages=None):
     """
     PDFから文字を抽出する。
     画像PDFの場合、use_ocr=True で Tesseract OCRを呼び出す。
+    pages ("1-3,5" など) を指定した場合はそのページだけを抽出する。
     """
-    text_all = ""
-
-    if not use_ocr:
-        # テキストPDFをPyPDF2で抽出
-        try:
-            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-            for page in reader.pages:
-                text_all += page.extract_text() or ""
-        except:
-            # 画像PDFなどで失敗した場合は空のまま
-            pass
-    else:
-
-        try:
-            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-            for page in reader.pages:
-                text_all += page.extract_text() or ""
-        except:
-            # 画像PDFなどで失敗した場合は空のまま
-            pass
+    from pdf_text import PageRangeError, extract_pages
 
+    # テキストレイヤーを抽出 (バックエンドは PDF_TEXT_BACKEND で選択)
+    try:
+        text_all = "".join(extract_pages(pdf_bytes, pages))
+    except PageRangeError:
+        # ページ指定の誤りは呼び出し元に返す
+        raise
+    except Exception:
+        # 画像PDFなどで失敗した場合は空のまま
+        text_all = ""
+
+    if use_ocr:
         # OCRを実行 (pdf2image + pytesseract)
-        images = convert_from_bytes(pdf_bytes)
-
-        for img in images:
-            output = io.BytesIO()
-            # PDF2Image で得られた PIL Image を PNG化
-            img.save(output, format="PNG")
-            image_binary = output.getvalue()
-
-            # 5MB超なら分割
-            splitted_binaries = split_image_if_needed(image_binary)
-
-            # 分割後バイナリを順次OCRして連結
-            for sbin in splitted_binaries:
-                try:
-                    text_page = pytesseract.image_to_string(Image.open(io.BytesIO(sbin)), lang='eng+jpn')
-                except Exception as e:
-                    print(f"OCR error: {e}")
-                    text_page = ""
-                
-                text_all += text_page + "\n"
-
-    return text_all
+        # 大きなページは ocr_tiling で重なり付きの帯に分割して並列にOCRする
+        from ocr_tiling import ocr_pages, rasterize_pages
 
-MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+        images = rasterize_pages(pdf_bytes, pages)
 
-def split_image_if_needed(image_binary):
-    """
-    画像バイナリを読み込んで、5MB超の場合は縦半分に分割する。
-    分割後も5MBを超える場合はエラーとする。
-    ※サンプル実装なので必要に応じてカスタマイズ
-    """
-    if len(image_binary) <= MAX_IMAGE_SIZE:
-        # 5MB以下なら分割不要
-        return [image_binary]
-
-    try:
-        img = Image.open(io.BytesIO(image_binary))
-        width, height = img.size
-        half_height = height // 2
-
-        split_binaries = []
-        for i in range(2):
-            top = i * half_height
-            bottom = (i + 1) * half_height if i < 1 else height
-
-            cropped_img = img.crop((0, top, width, bottom))
-            output = io.BytesIO()
-            # PNG形式で保存
-            cropped_img.save(output, format="PNG")
-            cropped_binary = output.getvalue()
-
-            if len(cropped_binary) > MAX_IMAGE_SIZE:
-                raise ValueError("Split image size still exceeds 5MB limit.")
-            
-            split_binaries.append(cropped_binary)
-        
-        return split_binaries
+        text_all += "".join(
+            text_page + "\n" for text_page in ocr_pages(images, lang='eng+jpn', ignore_errors=True)
+        )
 
-    except Exception as e:
-        raise ValueError(f"Error during image splitting: {e}")
+    return text_all
 
 # --- OpenAI 表記ゆれ補正関数 ---
+def build_unify_messages(raw_text):
+    """表記ゆれ補正用のプロンプトを組み立てる"""
+    return [
+        {
+            "role": "system", 
+            "content": "あなたは優秀なアシスタントです。"
+        },
+        {
+            "role": "user",
+            "content": f"""与えられた請求書に記載されたテキストを構造的に解釈して、JSON形式に整理してください。
+            ・必須で取得が可能な項目：「発注番号」「金額」「物件名（建物名）」「部屋番号」「工事業者名」
+            ・その他項目は可能であれば取得
+            ・純粋なjson形式のみで回答してください
+            ・内容が重複している情報は不要です
+            ・全角スペース、半角スペースは各項目の値に含めないでください
+            ---回答フォーマット（例）:
+            [
+                {{
+                    "発注番号": "12345",
+                    "金額": "100000",
+                    "物件名": "サンプル物件",
+                    "部屋番号": "101",
+                    "工事業者名": "サンプル工事会社"
+                }},
+                ...
+            ]
+            ---テキスト内容:
+            {raw_text}
+        """
+        }
+    ]
+
 def unify_text_via_openai(raw_text):
-        
     """
     大幅な表記ゆれがあるテキストを OpenAI の 'o1' モデルで整形・標準化。
+    共有 LLM クライアント (llm_client) 経由で呼び出すため、
+    同一テキストの同時リクエストは1回の API 呼び出しにまとめられる。
     """
-    openai.api_key = OPENAI_API_KEY
+    from llm_client import complete_sync
 
-    if not openai.api_key:
+    if not os.getenv("OPENAI_API_KEY"):
         print("Warning: OPENAI_API_KEY is not set. Return original text.")
         return raw_text
 
@@ -143,42 +152,7 @@ def unify_text_via_openai(raw_text):
     print(raw_text)
 
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "あなたは優秀なアシスタントです。"
-                },
-                {
-                    "role": "user",
-                    "content": f"""与えられた請求書に記載されたテキストを構造的に解釈して、JSON形式に整理してください。
-                    ・必須で取得が可能な項目：「発注番号」「金額」「物件名（建物名）」「部屋番号」「工事業者名」
-                    ・その他項目は可能であれば取得
-                    ・純粋なjson形式のみで回答してください
-                    ・内容が重複している情報は不要です
-                    ・全角スペース、半角スペースは各項目の値に含めないでください
-                    ---回答フォーマット（例）:
-                    [
-                        {{
-                            "発注番号": "12345",
-                            "金額": "100000",
-                            "物件名": "サンプル物件",
-                            "部屋番号": "101",
-                            "工事業者名": "サンプル工事会社"
-                        }},
-                        ...
-                    ]
-                    ---テキスト内容:
-                    {raw_text}
-                """
-                }
-            ],
-            max_tokens=4000,
-            temperature=0
-        )
-
-        cleaned_text = response.choices[0].message.content.strip()
+        cleaned_text = complete_sync(build_unify_messages(raw_text), max_tokens=4000, temperature=0)
 
         print("cleaned_text====================================")
         print(cleaned_text)
@@ -187,6 +161,20 @@ def unify_text_via_openai(raw_text):
         print(f"OpenAI API error: {e}")
         return raw_text
 
+async def unify_text_via_openai_async(raw_text):
+    """unify_text_via_openai の非同期版 (FastAPI などイベントループ上から呼び出す)"""
+    from llm_client import get_llm_client
+
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Warning: OPENAI_API_KEY is not set. Return original text.")
+        return raw_text
+
+    try:
+        return await get_llm_client().complete(build_unify_messages(raw_text), max_tokens=4000, temperature=0)
+    except Exception as e:
+        print(f"OpenAI API error: {e}")
+        return raw_text
+
 
 # --- PDFテキストから各項目を抽出する関数 ---
 def extract_fields_from_text(text):
@@ -241,3 +229,7 @@ def parse_invoice_data(text):
             "請求日": entry.get("請求日", "不明")
         })
     return structured_data
+
+# 環境変数 WARM_UP_ON_STARTUP=1 の場合は初期化時に依存を読み込む (Lambda の init フェーズで実行される)
+if os.getenv("WARM_UP_ON_STARTUP") == "1":
+    warm_up()
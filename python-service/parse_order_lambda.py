@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 import json
 import io
+import base64
 import os
 import sys
 import csv
+import itertools
 import traceback
-import openpyxl
 from io import BytesIO
 
+from profiling import profile_handler
+
+def warm_up():
+    """Import heavy dependencies ahead of the first request"""
+    import openpyxl  # noqa: F401
+
 def parse_csv(file_bytes):
     """Parse CSV file content and return list of orders"""
     try:
@@ -93,48 +100,81 @@ def parse_date(value):
         return None
     return str_value
 
-def parse_excel(file_bytes):
-    """Parse Excel file content and return list of orders"""
-    try:
-        wb = openpyxl.load_workbook(BytesIO(file_bytes), data_only=True)
-        sheet = wb.worksheets[0]  # 先頭シートを読む想定
+# ヘッダー行を探す範囲 (各シートの先頭からの行数)
+HEADER_SCAN_ROWS = int(os.getenv("EXCEL_HEADER_SCAN_ROWS", "10"))
+# シートを並列に解析するワーカープロセス数の上限 (1 の場合は逐次処理)
+EXCEL_SHEET_WORKERS = int(os.getenv("EXCEL_SHEET_WORKERS", "4"))
+# これより小さいブックは逐次処理する (ワーカーへのブックの受け渡しと再読み込みの方が解析より重いため)。
+# API のアップロード上限 (main.MAX_FILE_SIZE = 1MB) より小さくしておく
+EXCEL_PARALLEL_MIN_BYTES = int(os.getenv("EXCEL_PARALLEL_MIN_BYTES", str(256 * 1024)))
 
-        # タイトル行(1行目)をスキップし、2行目をヘッダー行として使用
-        header_row = 2  # 2行目が必ずヘッダー行
-        data_start_row = 3  # 3行目からデータ開始
+# 必須フィールドと任意フィールドの定義
+EXCEL_REQUIRED_FIELDS = ["業者ID", "業者名", "建物名", "番号", "受付内容"]
+EXCEL_OPTIONAL_FIELDS = ["支払金額", "完工日", "支払日", "請求日"]
 
-        # 必須フィールドと任意フィールドの定義
-        required_fields = ["業者ID", "業者名", "建物名", "番号", "受付内容"]
-        optional_fields = ["支払金額", "完工日", "支払日", "請求日"]
-        all_fields = required_fields + optional_fields
-        
-        # ヘッダー行から列インデックスを取得
+def find_header_row(rows, fields):
+    """
+    先頭の行から fields をすべて含む行を探し、(行番号, {項目名: 列インデックス}) を返す。
+    見つからない場合は最も多くの項目が見つかった行の不足項目を ValueError で通知する。
+    """
+    best_missing = fields
+    for row_idx, row in enumerate(rows, start=1):
         field_columns = {}
-        # ヘッダー行の全列をチェック
-        for col in range(1, sheet.max_column + 1):
-            header_value = sheet.cell(row=header_row, column=col).value
+        for col_idx, header_value in enumerate(row):
             if header_value:
                 header_str = str(header_value).strip()
-                if header_str in all_fields:
-                    field_columns[header_str] = col
+                if header_str in fields and header_str not in field_columns:
+                    field_columns[header_str] = col_idx
+        missing_fields = [field for field in fields if field not in field_columns]
+        if not missing_fields:
+            return row_idx, field_columns
+        if len(missing_fields) < len(best_missing):
+            best_missing = missing_fields
+    raise ValueError(f"必須項目が見つかりません: {', '.join(best_missing)}")
 
-        # 必須フィールドの存在チェック
-        missing_fields = [field for field in all_fields if field not in field_columns]
-        if missing_fields:
-            raise ValueError(f"必須項目が見つかりません: {', '.join(missing_fields)}")
+def parse_excel_sheet(file_bytes, sheet_name, header_scan_rows=HEADER_SCAN_ROWS):
+    """Parse one worksheet (read-only streaming mode) and return its orders and counts"""
+    import openpyxl
 
-        # データ行を読み込み (3行目から)
+    wb = openpyxl.load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        sheet = wb[sheet_name]
+        required_fields = EXCEL_REQUIRED_FIELDS
+        optional_fields = EXCEL_OPTIONAL_FIELDS
+        all_fields = required_fields + optional_fields
+
+        rows = sheet.iter_rows(values_only=True)
+
+        # 先頭 header_scan_rows 行からヘッダー行を自動検出 (タイトル行の有無に依存しない)
+        scanned = []
+        for row in rows:
+            scanned.append(row)
+            if len(scanned) >= header_scan_rows:
+                break
+        header_row, field_columns = find_header_row(scanned, all_fields)
+        data_start_row = header_row + 1
+
+        def cell(row, field):
+            col = field_columns[field]
+            return row[col] if col < len(row) else None
+
+        # データ行を読み込み (ヘッダー行の次の行から)
         orders = []
         skipped_rows = 0
-        for row_idx in range(data_start_row, sheet.max_row + 1):
+        total_rows = 0
+        # ヘッダー検出で読み込み済みの行と残りのストリームを連結する
+        data_rows = itertools.chain(scanned[header_row:], rows)
+        for row_idx, row in enumerate(data_rows, start=data_start_row):
+            total_rows += 1
+
             # 業者IDが空または0の行はスキップ
-            vendor_id_cell = sheet.cell(row=row_idx, column=field_columns["業者ID"])
-            if not vendor_id_cell.value or str(vendor_id_cell.value).strip() in ["", "0"]:
+            vendor_id_value = cell(row, "業者ID")
+            if not vendor_id_value or str(vendor_id_value).strip() in ["", "0"]:
                 skipped_rows += 1
                 continue
                 
             # ヘッダー行が繰り返される場合はスキップ
-            if str(vendor_id_cell.value).strip() == "業者ID":
+            if str(vendor_id_value).strip() == "業者ID":
                 continue
 
             order = {}
@@ -145,7 +185,7 @@ def parse_excel(file_bytes):
                 invalid_fields = []
                 
                 for field in required_fields:
-                    value = sheet.cell(row=row_idx, column=field_columns[field]).value
+                    value = cell(row, field)
                     if value is not None:
                         row_has_data = True
                         str_value = str(value).strip()
@@ -155,7 +195,7 @@ def parse_excel(file_bytes):
                             try:
                                 vendor_id = int(float(str_value)) if str_value else 0
                                 if vendor_id == 0:
-                                    print(f"Warning: Row {row_idx} skipped - Vendor ID is 0", file=sys.stderr)
+                                    print(f"Warning: {sheet_name} row {row_idx} skipped - Vendor ID is 0", file=sys.stderr)
                                     raise ValueError("業者IDが0または空です")
                                 order[field] = vendor_id
                             except (ValueError, TypeError):
@@ -174,16 +214,16 @@ def parse_excel(file_bytes):
                                 order[field] = str_value
                 
                 if missing_fields:
-                    print(f"Warning: Row {row_idx} skipped - Missing required fields: {', '.join(missing_fields)}", file=sys.stderr)
+                    print(f"Warning: {sheet_name} row {row_idx} skipped - Missing required fields: {', '.join(missing_fields)}", file=sys.stderr)
                     continue
                 
                 if invalid_fields:
-                    print(f"Warning: Row {row_idx} skipped - Invalid data in fields: {', '.join(invalid_fields)}", file=sys.stderr)
+                    print(f"Warning: {sheet_name} row {row_idx} skipped - Invalid data in fields: {', '.join(invalid_fields)}", file=sys.stderr)
                     continue
                             
                 # 任意フィールドの処理
                 for field in optional_fields:
-                    value = sheet.cell(row=row_idx, column=field_columns[field]).value
+                    value = cell(row, field)
                     if value is not None:
                         str_value = str(value).strip()
                         
@@ -204,17 +244,123 @@ def parse_excel(file_bytes):
             except ValueError as e:
                 raise ValueError(str(e))
             except Exception as e:
-                raise ValueError(f"{row_idx}行目のデータ処理中にエラーが発生しました: {str(e)}")
-
-        if not orders:
-            raise ValueError("有効なデータが見つかりません。3行目以降にデータが存在することを確認してください。")
+                raise ValueError(f"{sheet_name}シート {row_idx}行目のデータ処理中にエラーが発生しました: {str(e)}")
 
         return {
+            "sheet": sheet_name,
+            "header_row": header_row,
             "orders": orders,
-            "total_rows": sheet.max_row - data_start_row + 1,
+            "total_rows": total_rows,
             "skipped_rows": skipped_rows,
             "valid_rows": len(orders)
         }
+    finally:
+        wb.close()
+
+def get_process_pool():
+    """シート解析用の常駐ワーカープロセスプール (EXCEL_SHEET_WORKERS 個、process_pools.ResidentPool)"""
+    from process_pools import get_resident_pool
+
+    return get_resident_pool("excel_sheets", EXCEL_SHEET_WORKERS)
+
+def _parse_sheets_serially(file_bytes, sheet_names, header_scan_rows):
+    results = []
+    for name in sheet_names:
+        try:
+            results.append(parse_excel_sheet(file_bytes, name, header_scan_rows))
+        except ValueError as e:
+            results.append(e)
+    return results
+
+def _parse_sheets_concurrently(file_bytes, sheet_names, header_scan_rows, max_workers):
+    """
+    シートごとにワーカープロセスで解析し、シート順に結果 (または ValueError) を返す。
+    同時に解析するシートは max_workers 件まで (プールは EXCEL_SHEET_WORKERS 個で共有する)。
+    EXCEL_PARALLEL_MIN_BYTES 未満のブックは逐次処理する。
+    """
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    workers = min(len(sheet_names), max_workers, EXCEL_SHEET_WORKERS)
+    # 小さなブック、および wrapper.py のワーカーなどデーモンプロセス内 (子プロセスを作れない) では逐次処理する
+    if workers <= 1 or len(file_bytes) < EXCEL_PARALLEL_MIN_BYTES or multiprocessing.current_process().daemon:
+        return _parse_sheets_serially(file_bytes, sheet_names, header_scan_rows)
+
+    futures = []
+    pending = set()
+    try:
+        try:
+            pool = get_process_pool()
+            for name in sheet_names:
+                if len(pending) >= workers:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                futures.append(pool.submit(parse_excel_sheet, file_bytes, name, header_scan_rows))
+                pending.add(futures[-1])
+        except OSError as e:
+            # Lambda など /dev/shm がなくセマフォ・子プロセスを作れない環境では逐次処理する
+            print(f"Sheet worker pool unavailable, parsing serially: {e}", file=sys.stderr)
+            return _parse_sheets_serially(file_bytes, sheet_names, header_scan_rows)
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except ValueError as e:
+                results.append(e)
+        return results
+    finally:
+        for future in futures:
+            future.cancel()
+
+def parse_excel(file_bytes, sheet_names=None, header_scan_rows=HEADER_SCAN_ROWS, max_workers=None):
+    """
+    Parse Excel file content and return list of orders.
+    sheet_names を省略した場合は全シートを対象とし、各シートのヘッダー行は自動検出する。
+    必須項目が揃ったヘッダー行が見つからないシートはスキップし、"sheets" にその理由を記録する。
+    """
+    try:
+        import openpyxl
+
+        wb = openpyxl.load_workbook(BytesIO(file_bytes), read_only=True)
+        workbook_sheets = wb.sheetnames
+        wb.close()
+
+        if sheet_names:
+            unknown_sheets = [name for name in sheet_names if name not in workbook_sheets]
+            if unknown_sheets:
+                raise ValueError(f"シートが見つかりません: {', '.join(unknown_sheets)}")
+            # ブック内の順序で処理する
+            target_sheets = [name for name in workbook_sheets if name in sheet_names]
+        else:
+            target_sheets = workbook_sheets
+
+        results = _parse_sheets_concurrently(
+            file_bytes, target_sheets, header_scan_rows, max_workers or EXCEL_SHEET_WORKERS
+        )
+
+        orders = []
+        sheets = []
+        errors = []
+        for name, result in zip(target_sheets, results):
+            if isinstance(result, ValueError):
+                errors.append(f"{name}: {result}")
+                sheets.append({"sheet": name, "error": str(result)})
+                continue
+            orders.extend(result.pop("orders"))
+            sheets.append(result)
+
+        if not orders:
+            if errors and len(errors) == len(target_sheets):
+                raise ValueError(errors[0] if len(errors) == 1 else " / ".join(errors))
+            raise ValueError("有効なデータが見つかりません。ヘッダー行の次の行以降にデータが存在することを確認してください。")
+
+        parsed = [sheet for sheet in sheets if "error" not in sheet]
+        return {
+            "orders": orders,
+            "total_rows": sum(sheet["total_rows"] for sheet in parsed),
+            "skipped_rows": sum(sheet["skipped_rows"] for sheet in parsed),
+            "valid_rows": len(orders),
+            "sheets": sheets
+        }
 
     except ValueError as e:
         raise
@@ -222,5 +368,59 @@ def parse_excel(file_bytes):
         print(f"Error parsing Excel: {str(e)}", file=sys.stderr)
         raise ValueError("Excelファイルの解析中にエラーが発生しました")
 
+def parse_order_file(file_bytes, filename, sheet_names=None):
+    """Parse CSV/Excel content by file extension and return the parse summary"""
+    if filename.endswith('.xlsx'):
+        return parse_excel(file_bytes, sheet_names=sheet_names)
+    if filename.endswith('.csv'):
+        orders = parse_csv(file_bytes)
+        return {
+            "orders": orders,
+            "total_rows": len(orders),
+            "skipped_rows": 0,
+            "valid_rows": len(orders)
+        }
+    raise ValueError("ファイルの形式が正しくありません。CSVまたはExcelファイルを選択してください。")
+
+@profile_handler
+def lambda_handler(event, context):
+    """
+    event["file_bytes"]: Base64エンコードされたファイル内容
+    event["file_path"]: ローカルファイルのパス (file_bytes の代わりに指定可能)
+    event["file_uri"]: s3:// などの参照 (payload_store.py。file_bytes の代わりに指定可能)
+    event["filename"]: ファイル名 (拡張子で CSV / Excel を判定。省略時は file_path から取得)
+    event["sheet_names"]: 任意。Excel の解析対象シート名のリスト (省略時は全シート)
+    event["result_uri"]: 任意。結果の書き出し先 (指定時、または結果が大きい場合は参照を返す)
+    """
+    from payload_store import open_payload, result_body
+
+    try:
+        file_path = event.get("file_path") or event.get("file_uri")
+        filename = event.get("filename") or (os.path.basename(file_path) if file_path else "")
+
+        if file_path:
+            # シートの並列解析でワーカープロセスへ渡すため bytes にする
+            with open_payload(file_path) as buf:
+                file_bytes = bytes(buf)
+        elif event.get("file_bytes"):
+            file_bytes = base64.b64decode(event["file_bytes"])
+        else:
+            raise ValueError("ファイルが指定されていません。")
+
+        result = parse_order_file(file_bytes, filename, event.get("sheet_names"))
+        return {
+            "statusCode": 200,
+            "body": result_body(result, event.get("result_uri"), getattr(context, "aws_request_id", None))
+        }
+    except (ValueError, OSError) as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": str(e)})
+        }
+
+# 環境変数 WARM_UP_ON_STARTUP=1 の場合は初期化時に依存を読み込む (Lambda の init フェーズで実行される)
+if os.getenv("WARM_UP_ON_STARTUP") == "1":
+    warm_up()
+
 if __name__ == "__main__":
     print("This module is now used as a library and should not be run directly.")
@@ -0,0 +1,202 @@
+"""
+Lambda イベントのファイル・結果を参照 (URI) で受け渡すためのストア
+
+Base64 でイベントに埋め込む代わりに、入力ファイルや大きな結果を URI で指定する:
+  /path/to/file, file:///path/to/file : ローカルファイル
+  s3://bucket/key                      : オブジェクトストア。PAYLOAD_STORE_BACKEND で実装を選ぶ
+      boto3 : Amazon S3 (pip install boto3。既定)
+      fs    : PAYLOAD_STORE_ROOT/<bucket>/<key> のファイルで代替する (開発・テスト用。明示的に指定した場合のみ)
+
+    with open_payload("s3://bucket/invoice.pdf") as pdf:   # 読み取り専用の mmap (bytes と同様に扱える)
+        ...
+    with open_result("s3://bucket/result.json") as f:     # 書き込み用のバイナリファイル
+        ...
+
+ローカルファイル / fs はファイルを mmap するため、入力全体のコピーは発生しない。
+boto3 は一時ファイルにダウンロードしてから mmap する。
+"""
+import json
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+
+PAYLOAD_STORE_BACKEND = os.getenv("PAYLOAD_STORE_BACKEND", "boto3")
+PAYLOAD_STORE_ROOT = os.getenv("PAYLOAD_STORE_ROOT", "payloads")
+# 結果の JSON がこれを超える場合は PAYLOAD_RESULT_PREFIX 以下に書き出して参照を返す
+# (Lambda の同期呼び出しのレスポンス上限 6MB より小さくする)
+PAYLOAD_INLINE_LIMIT = int(os.getenv("PAYLOAD_INLINE_LIMIT", str(5 * 1024 * 1024)))
+PAYLOAD_RESULT_PREFIX = os.getenv("PAYLOAD_RESULT_PREFIX", "")
+
+
+@contextmanager
+def _mmap_file(f):
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        # 空ファイルは mmap できない
+        yield b""
+        return
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as buf:
+        yield buf
+
+
+@contextmanager
+def _atomic_write(path):
+    """一時ファイルに書き込み、正常終了時に path へ置き換える"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".payload-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class LocalFileStore:
+    """ローカルファイル (パス または file:// URI)"""
+
+    def path(self, uri):
+        parts = urlsplit(uri)
+        return unquote(parts.path) if parts.scheme == "file" else uri
+
+    @contextmanager
+    def open(self, uri):
+        with open(self.path(uri), "rb") as f, _mmap_file(f) as buf:
+            yield buf
+
+    def writer(self, uri):
+        return _atomic_write(self.path(uri))
+
+
+class FilesystemObjectStore(LocalFileStore):
+    """s3://bucket/key を root/bucket/key のファイルとして扱う代替実装"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, uri):
+        parts = urlsplit(uri)
+        key = unquote(parts.path).lstrip("/")
+        path = os.path.normpath(os.path.join(self.root, parts.netloc, key))
+        # ../ などでルートの外を指す URI は受け付けない
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid object URI: {uri}")
+        return path
+
+
+class Boto3ObjectStore:
+    """Amazon S3 (boto3)"""
+
+    def __init__(self):
+        import boto3
+
+        self.client = boto3.client("s3")
+
+    @staticmethod
+    def _split(uri):
+        parts = urlsplit(uri)
+        return parts.netloc, unquote(parts.path).lstrip("/")
+
+    @contextmanager
+    def open(self, uri):
+        from botocore.exceptions import ClientError
+
+        bucket, key = self._split(uri)
+        with tempfile.TemporaryFile() as f:
+            try:
+                self.client.download_fileobj(bucket, key, f)
+            except ClientError as e:
+                # 存在しないキーなどはローカルファイルと同様に OSError として呼び出し元に返す
+                raise FileNotFoundError(f"{uri}: {e}") from e
+            f.flush()
+            with _mmap_file(f) as buf:
+                yield buf
+
+    @contextmanager
+    def writer(self, uri):
+        bucket, key = self._split(uri)
+        with tempfile.TemporaryFile() as f:
+            yield f
+            f.seek(0)
+            self.client.upload_fileobj(f, bucket, key)
+
+
+_stores = {}
+
+
+def register_store(scheme, store):
+    """URI のスキームに対応するストアを登録する (テストや他のオブジェクトストアの追加用)"""
+    _stores[scheme] = store
+
+
+def get_store(uri):
+    if not uri:
+        raise ValueError("URI が指定されていません。")
+    scheme = urlsplit(uri).scheme
+    # "C:\\..." のようなドライブ名はスキームとみなさない
+    if scheme in ("", "file") or len(scheme) == 1:
+        scheme = "file"
+    if scheme not in _stores:
+        if scheme == "file":
+            _stores[scheme] = LocalFileStore()
+        elif scheme == "s3":
+            if PAYLOAD_STORE_BACKEND == "boto3":
+                _stores[scheme] = Boto3ObjectStore()
+            elif PAYLOAD_STORE_BACKEND == "fs":
+                _stores[scheme] = FilesystemObjectStore(PAYLOAD_STORE_ROOT)
+            else:
+                raise ValueError(f"Unsupported PAYLOAD_STORE_BACKEND: {PAYLOAD_STORE_BACKEND}")
+        else:
+            raise ValueError(f"Unsupported URI scheme: {scheme}")
+    return _stores[scheme]
+
+
+def open_payload(uri):
+    """URI の内容を読み取り専用のバッファ (mmap) として開く"""
+    return get_store(uri).open(uri)
+
+
+def open_result(uri):
+    """URI に書き込むバイナリファイルを開く (閉じた時点で確定する)"""
+    return get_store(uri).writer(uri)
+
+
+def read_json(uri):
+    with open_payload(uri) as buf:
+        return json.loads(bytes(buf) if not isinstance(buf, bytes) else buf)
+
+
+def write_json_rows(uri, key, rows):
+    """
+    {"<key>": [row, row, ...]} を1行ずつ書き出す (結果全体を文字列にしない)。書き出した件数を返す。
+    """
+    count = 0
+    with open_result(uri) as f:
+        f.write(f"{{{json.dumps(key)}: [".encode())
+        for row in rows:
+            if count:
+                f.write(b", ")
+            f.write(json.dumps(row).encode())
+            count += 1
+        f.write(b"]}")
+    return count
+
+
+def result_body(result, result_uri=None, request_id=None):
+    """
+    Lambda のレスポンス body を返す。
+    result_uri の指定がある場合、または JSON が PAYLOAD_INLINE_LIMIT を超え PAYLOAD_RESULT_PREFIX が
+    設定されている場合は結果を書き出し、{"result_uri": ..., "size": ...} を返す。
+    """
+    body = json.dumps(result).encode()
+    if result_uri is None and len(body) > PAYLOAD_INLINE_LIMIT and PAYLOAD_RESULT_PREFIX and request_id:
+        result_uri = PAYLOAD_RESULT_PREFIX.rstrip("/") + f"/{request_id}.json"
+    if result_uri is None:
+        return body.decode()
+    with open_result(result_uri) as f:
+        f.write(body)
+    return json.dumps({"result_uri": result_uri, "size": len(body)})
@@ -0,0 +1,224 @@
+"""
+PDF テキストレイヤー抽出のバックエンド
+
+    extract_pages(pdf_bytes, pages="1-3,5")  # ページごとのテキストのリスト
+    page_count(pdf_bytes)                     # ページ数のみ (本文は解析しない)
+
+バックエンドは環境変数 PDF_TEXT_BACKEND で選択する:
+  pypdf2  : PyPDF2 (既定、requirements.txt に含まれる)
+  pdfium  : pypdfium2 (高速。pip install pypdfium2)
+  pdfminer: pdfminer.six のレイアウト解析 (日本語の読み順が安定しやすい。pip install pdfminer.six)
+  auto    : インストール済みのものから pdfium → pdfminer → pypdf2 の順に選ぶ
+
+pdf_bytes には bytes のほか、読み取り専用の mmap (payload_store.open_payload) も渡せる。
+mmap はコピーせずにファイルとして読み込む。
+"""
+import io
+import os
+
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", "pypdf2")
+
+
+def _as_stream(pdf_bytes):
+    """bytes は BytesIO に包み、mmap などファイルとして読めるものはそのまま (コピーせずに) 使う"""
+    if hasattr(pdf_bytes, "seek"):
+        pdf_bytes.seek(0)
+        return pdf_bytes
+    return io.BytesIO(pdf_bytes)
+
+
+class _BufferReader(io.RawIOBase):
+    """mmap を pypdfium2 が読めるファイルオブジェクトとして見せる"""
+
+    def __init__(self, buf):
+        self._buf = buf
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._buf)}[whence]
+        self._pos = base + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._buf) - self._pos))
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+class PageRangeError(ValueError):
+    """ページ指定が不正、または範囲外"""
+
+
+def parse_page_range(spec, count):
+    """
+    "1-3,5" のようなページ指定 (1始まり) を 0始まりのページ番号リストに変換する。
+    None / 空文字の場合は全ページ。不正・範囲外の指定は PageRangeError。
+    """
+    if spec is None or (isinstance(spec, str) and not spec.strip()):
+        return list(range(count))
+    if isinstance(spec, (list, tuple)):
+        parts = [str(p) for p in spec]
+    else:
+        parts = str(spec).split(",")
+
+    indexes = []
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        try:
+            first = int(start)
+            last = int(end) if end else first
+        except ValueError:
+            raise PageRangeError(f"ページ指定が正しくありません: {spec}")
+        if first < 1 or last > count or first > last:
+            raise PageRangeError(f"ページ指定が範囲外です: {part} (全{count}ページ)")
+        indexes.extend(range(first - 1, last))
+    return list(dict.fromkeys(indexes))
+
+
+class PyPDF2Backend:
+    name = "pypdf2"
+
+    @staticmethod
+    def available():
+        try:
+            import PyPDF2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open(self, pdf_bytes):
+        import PyPDF2
+
+        return PyPDF2.PdfReader(_as_stream(pdf_bytes))
+
+    def page_count(self, doc):
+        return len(doc.pages)
+
+    def extract(self, doc, index):
+        return doc.pages[index].extract_text() or ""
+
+    def close(self, doc):
+        pass
+
+
+class PdfiumBackend:
+    name = "pdfium"
+
+    @staticmethod
+    def available():
+        try:
+            import pypdfium2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open(self, pdf_bytes):
+        import pypdfium2
+
+        if not isinstance(pdf_bytes, bytes):
+            pdf_bytes = _BufferReader(pdf_bytes)
+        return pypdfium2.PdfDocument(pdf_bytes)
+
+    def page_count(self, doc):
+        return len(doc)
+
+    def extract(self, doc, index):
+        page = doc[index]
+        textpage = page.get_textpage()
+        try:
+            return textpage.get_text_range().replace("\r\n", "\n")
+        finally:
+            textpage.close()
+            page.close()
+
+    def close(self, doc):
+        doc.close()
+
+
+class PdfminerBackend:
+    name = "pdfminer"
+
+    @staticmethod
+    def available():
+        try:
+            import pdfminer  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open(self, pdf_bytes):
+        from pdfminer.pdfpage import PDFPage
+
+        # ページオブジェクトの列挙だけを行い、本文の解析は extract 時に行う
+        return list(PDFPage.get_pages(_as_stream(pdf_bytes)))
+
+    def page_count(self, doc):
+        return len(doc)
+
+    def extract(self, doc, index):
+        from pdfminer.converter import PDFPageAggregator
+        from pdfminer.layout import LAParams, LTTextContainer
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+
+        resource_manager = PDFResourceManager()
+        device = PDFPageAggregator(resource_manager, laparams=LAParams())
+        PDFPageInterpreter(resource_manager, device).process_page(doc[index])
+        layout = device.get_result()
+        return "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+    def close(self, doc):
+        pass
+
+
+BACKENDS = {backend.name: backend for backend in (PyPDF2Backend, PdfiumBackend, PdfminerBackend)}
+AUTO_ORDER = ("pdfium", "pdfminer", "pypdf2")
+
+
+def get_backend(name=None):
+    """名前からバックエンドを返す。未インストールの場合は PyPDF2 にフォールバックする"""
+    name = (name or PDF_TEXT_BACKEND).lower()
+    if name == "auto":
+        for candidate in AUTO_ORDER:
+            if BACKENDS[candidate].available():
+                return BACKENDS[candidate]()
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown PDF text backend: {name}")
+    if not backend.available():
+        print(f"Warning: PDF text backend '{name}' is not installed. Falling back to pypdf2.")
+        backend = PyPDF2Backend
+    return backend()
+
+
+def page_count(pdf_bytes, backend=None):
+    """ページ数を返す (テキストは抽出しない)"""
+    backend = backend if hasattr(backend, "extract") else get_backend(backend)
+    doc = backend.open(pdf_bytes)
+    try:
+        return backend.page_count(doc)
+    finally:
+        backend.close(doc)
+
+
+def extract_pages(pdf_bytes, pages=None, backend=None):
+    """指定ページ (省略時は全ページ) のテキストをページ順のリストで返す"""
+    backend = backend if hasattr(backend, "extract") else get_backend(backend)
+    doc = backend.open(pdf_bytes)
+    try:
+        indexes = parse_page_range(pages, backend.page_count(doc))
+        return [backend.extract(doc, i) for i in indexes]
+    finally:
+        backend.close(doc)
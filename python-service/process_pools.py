@@ -0,0 +1,72 @@
+"""
+常駐ワーカープロセスプール (OCR・シート解析・突合で共有する仕組み)
+
+    pool = get_resident_pool("ocr", max_workers=4)   # 名前ごとに1つ。初回の submit で起動する
+    future = pool.submit(func, *args)
+
+ワーカーが OOM などで強制終了すると ProcessPoolExecutor は BrokenProcessPool になり、
+以降の submit がすべて失敗する。ResidentPool は submit 時にこれを検知するとプールを作り直すため、
+実行中だったリクエストは失敗しても、以降のリクエストはプロセスの再起動なしで処理できる。
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ResidentPool:
+    """BrokenProcessPool になった場合に作り直す常駐 ProcessPoolExecutor"""
+
+    def __init__(self, name, max_workers=None):
+        self.name = name
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        """現在のプールを返す (初回呼び出し時に起動)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    # uvicorn のスレッドを抱えたまま fork しないよう spawn で起動する
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def discard(self, executor):
+        """壊れたプールを破棄する (別のスレッドが作り直した後であれば何もしない)"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        print(f"Process pool '{self.name}' is broken; restarting", file=sys.stderr)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, **kwargs):
+        executor = self.executor()
+        try:
+            return executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self.discard(executor)
+            return self.executor().submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_resident_pool(name, max_workers=None):
+    """名前ごとの ResidentPool を返す。ワーカー数は最初に呼び出したときの max_workers で決まる"""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ResidentPool(name, max_workers)
+        return _pools[name]
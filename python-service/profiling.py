@@ -0,0 +1,307 @@
+"""
+リクエスト単位のオンデマンドプロファイリング
+
+有効化の条件 (どちらか):
+  - PROFILE_ON_REQUEST=1 のとき、リクエストヘッダー X-Profile (Lambda では event["profile"]
+    または event["headers"]["X-Profile"]) に "1" / "cprofile" / "sample" を指定
+  - PROFILE_SAMPLE_RATE (0.0〜1.0) の割合でランダムに対象とする
+
+プロファイル結果は PROFILE_DIR に リクエストID をキーとして保存する:
+  cprofile: 決定的プロファイラ (cProfile) → <request_id>.pstats (python -m pstats / snakeviz で参照)
+  sample  : サンプリングプロファイラ   → <request_id>.speedscope.json (https://www.speedscope.app)
+無効時のコストはヘッダーの確認と乱数1回のみ。
+
+エンドポイントがスレッドプールに渡す処理は、fastapi.concurrency.run_in_threadpool の代わりに
+このモジュールの run_in_threadpool を使うとリクエストのプロファイルに含まれる
+(cprofile: ワーカースレッドでの実行分を合算 / sample: ワーカースレッドもサンプリング)。
+
+制限: API ではイベントループのスレッド (cprofile) / スタック (sample) を記録するため、
+プロファイル中に同時に処理された他のリクエストのコルーチンも結果に含まれる。
+プロファイルは同時に1件だけ実行するが、負荷がかかった状態では対象リクエスト以外の処理が混ざる点に注意する
+(ワーカースレッドの処理は run_in_threadpool を呼んだリクエストの分だけが記録される)。
+Lambda は1リクエストずつ処理するためこの制限はない。
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+# Lambda ではパッケージのディレクトリに書き込めないため /tmp に保存する
+PROFILE_DIR = os.getenv("PROFILE_DIR") or (
+    "/tmp/profiles" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "profiles")
+PROFILE_ON_REQUEST = os.getenv("PROFILE_ON_REQUEST", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# PROFILE_SAMPLE_RATE で選ばれたリクエストに使う方式
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+PROFILE_HEADER = "x-profile"
+REQUEST_ID_HEADER = "x-request-id"
+PROFILE_ID_HEADER = "x-profile-id"
+
+MODES = ("cprofile", "sample")
+
+# cProfile は同一プロセスで同時に1つしか有効にできないため、実行中は新たに開始しない
+_active_lock = threading.Lock()
+# 実行中のリクエストの ProfileSession (ProfilingMiddleware が設定し、run_in_threadpool が参照する)
+_current_session = contextvars.ContextVar("profile_session", default=None)
+
+
+def choose_mode(requested):
+    """リクエストの指定とサンプリング率からプロファイル方式を決める。対象外なら None"""
+    if requested and PROFILE_ON_REQUEST:
+        requested = str(requested).strip().lower()
+        if requested in MODES:
+            return requested
+        if requested in ("1", "true"):
+            return PROFILE_MODE
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return PROFILE_MODE
+    return None
+
+
+def _safe_id(request_id):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(request_id))[:100] or uuid.uuid4().hex
+
+
+class ProfileSession:
+    """1リクエスト分のプロファイル。stop() で結果をファイルに書き出す"""
+
+    def __init__(self, request_id, mode):
+        self.request_id = _safe_id(request_id)
+        self.mode = mode
+        self.path = None
+        self._profiler = None
+        self._sampler = None
+        # ワーカースレッドで実行した処理のプロファイル (stop() で合算する)
+        self._thread_profilers = []
+        self._thread_profilers_lock = threading.Lock()
+
+    def start(self):
+        if self.mode == "sample":
+            self._sampler = _Sampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+            self._sampler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def run(self, func, *args, **kwargs):
+        """ワーカースレッドで func を実行し、その処理をこのプロファイルに含める"""
+        if self._sampler is not None:
+            thread_id = threading.get_ident()
+            self._sampler.add_thread(thread_id)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._sampler.remove_thread(thread_id)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12 以降の cProfile は全スレッドを記録するため、セッションのプロファイラに含まれる
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._thread_profilers_lock:
+                self._thread_profilers.append(profiler)
+
+    def stop(self):
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if self._sampler is not None:
+                self._sampler.stop()
+                self.path = os.path.join(PROFILE_DIR, f"{self.request_id}.speedscope.json")
+                with open(self.path, "w") as f:
+                    json.dump(self._sampler.to_speedscope(self.request_id), f)
+            else:
+                self._profiler.disable()
+                self.path = os.path.join(PROFILE_DIR, f"{self.request_id}.pstats")
+                stats = pstats.Stats(self._profiler)
+                with self._thread_profilers_lock:
+                    for profiler in self._thread_profilers:
+                        stats.add(profiler)
+                stats.dump_stats(self.path)
+            print(f"Profile saved: {self.path}", file=sys.stderr)
+        except OSError as e:
+            print(f"Failed to save profile: {e}", file=sys.stderr)
+        finally:
+            _active_lock.release()
+        return self.path
+
+
+def start_profile(request_id, mode):
+    """プロファイルを開始する。他のプロファイルが実行中の場合は None"""
+    if not _active_lock.acquire(blocking=False):
+        return None
+    try:
+        return ProfileSession(request_id, mode).start()
+    except Exception:
+        _active_lock.release()
+        raise
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """
+    fastapi.concurrency.run_in_threadpool と同じ。
+    プロファイル対象のリクエストでは、ワーカースレッドでの func の実行もプロファイルに含める。
+    """
+    from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+
+    session = _current_session.get()
+    if session is None:
+        return await _run_in_threadpool(func, *args, **kwargs)
+    return await _run_in_threadpool(session.run, func, *args, **kwargs)
+
+
+class _Sampler(threading.Thread):
+    """
+    対象スレッドのスタックを一定間隔で記録するサンプリングプロファイラ。
+    開始したスレッドに加え、add_thread() で登録したワーカースレッドも登録中はサンプリングする。
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = []
+        self.frame_index = {}
+        # スレッドIDごとの (samples, weights)。先頭は開始したスレッド
+        self.threads = {thread_id: ([], [])}
+        self._active = {thread_id}
+        self._threads_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def add_thread(self, thread_id):
+        with self._threads_lock:
+            self.threads.setdefault(thread_id, ([], []))
+            self._active.add(thread_id)
+
+    def remove_thread(self, thread_id):
+        with self._threads_lock:
+            self._active.discard(thread_id)
+
+    def run(self):
+        self.started_at = last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            with self._threads_lock:
+                active = [(self.threads[thread_id], frames.get(thread_id)) for thread_id in self._active]
+            for (samples, weights), frame in active:
+                if frame is not None:
+                    samples.append(self._stack(frame))
+                    weights.append(now - last)
+            last = now
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            idx = self.frame_index.get(key)
+            if idx is None:
+                idx = self.frame_index[key] = len(self.frames)
+                self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            stack.append(idx)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def to_speedscope(self, name):
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "ai-ocr-assist profiling",
+            "shared": {"frames": self.frames},
+            # スレッドごとのプロファイル。先頭がリクエストを処理したスレッド、以降がワーカースレッド
+            "profiles": [{
+                "type": "sampled",
+                "name": name if thread_id == self.thread_id else f"{name} (worker {n})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.elapsed,
+                "samples": samples,
+                "weights": weights,
+            } for n, (thread_id, (samples, weights)) in enumerate(self.threads.items())],
+        }
+
+
+class ProfilingMiddleware:
+    """
+    FastAPI (ASGI) 用ミドルウェア。対象リクエストをプロファイルし、
+    レスポンスヘッダー X-Profile-Id に保存先のキー(リクエストID)を返す。
+    イベントループ上の処理は同時に実行中の他のリクエストの分も記録される (モジュールの docstring を参照)。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        mode = choose_mode(headers.get(PROFILE_HEADER.encode(), b"").decode())
+        session = None
+        if mode:
+            request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode() or uuid.uuid4().hex
+            session = start_profile(request_id, mode)
+        if session is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.encode(), session.request_id.encode())
+                ]
+            await send(message)
+
+        token = _current_session.set(session)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _current_session.reset(token)
+            session.stop()
+
+
+def profile_handler(handler):
+    """
+    Lambda の lambda_handler 用デコレーター。
+    event["profile"] / event["headers"]["X-Profile"] またはサンプリング率で対象を決め、
+    context.aws_request_id (なければ event["id"] / UUID) をキーに保存する。
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        headers = {str(k).lower(): v for k, v in (event.get("headers") or {}).items()}
+        mode = choose_mode(event.get("profile") or headers.get(PROFILE_HEADER))
+        session = None
+        if mode:
+            request_id = getattr(context, "aws_request_id", None) or event.get("id") or uuid.uuid4().hex
+            session = start_profile(request_id, mode)
+        if session is None:
+            return handler(event, context)
+        try:
+            return handler(event, context)
+        finally:
+            session.stop()
+
+    return wrapper
@@ -0,0 +1,137 @@
+import asyncio
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import admission
+import main
+from admission import (AdmissionController, AdmissionRejected, Cost, combine_costs, estimate_pdf_cost,
+                       estimate_sheet_cost)
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "data", "sample_invoice.pdf")
+
+
+def _cost(memory_mb=100, cpu_sec=1.0):
+    return Cost(memory_mb=memory_mb, cpu_sec=cpu_sec, pages=0, rows=0, ocr=False)
+
+
+def test_pdf_cost_from_page_count_and_ocr():
+    with open(SAMPLE_PDF, "rb") as f:
+        pdf_bytes = f.read()
+
+    text = estimate_pdf_cost(pdf_bytes, use_ocr=False)
+    ocr = estimate_pdf_cost(pdf_bytes, use_ocr=True)
+    assert text.pages == ocr.pages == 1
+    assert ocr.ocr and ocr.cpu_sec > text.cpu_sec and ocr.memory_mb > text.memory_mb
+    # 壊れた PDF は1ページとして見積もる (エラーは処理側で返す)
+    assert estimate_pdf_cost(b"broken", use_ocr=True).pages == 1
+
+
+def test_sheet_cost_from_dimensions():
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    for _ in range(500):
+        wb.active.append(["業者", "建物", 101])
+    wb.create_sheet("別シート").append(["x"])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    assert estimate_sheet_cost(buffer.getvalue(), "orders.xlsx").rows == 501
+    assert estimate_sheet_cost(buffer.getvalue(), "orders.xlsx", ["別シート"]).rows == 1
+    assert estimate_sheet_cost(b"a,b\n1,2\n3,4", "orders.csv").rows == 3
+
+
+def test_combined_memory_counts_only_concurrent_work():
+    combined = combine_costs([_cost(100, 1), _cost(300, 2), _cost(200, 3)], concurrency=2)
+    assert combined.memory_mb == 500
+    assert combined.cpu_sec == 6
+
+
+def test_interactive_waiters_go_before_bulk():
+    async def run():
+        controller = AdmissionController(memory_mb=1000, cpu_sec=100, bulk_cpu_sec=10, bulk_share=0.5)
+        running = await controller.acquire(_cost(900, 1))
+        order = []
+
+        async def wait(name, cost):
+            async with controller.admit(cost):
+                order.append(name)
+
+        bulk = asyncio.create_task(wait("bulk", _cost(400, 20)))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(wait("interactive", _cost(400, 1)))
+        await asyncio.sleep(0)
+        assert controller.snapshot()["lanes"]["bulk"]["queued"] == 1
+        assert controller.snapshot()["lanes"]["interactive"]["queued"] == 1
+
+        controller.release(running)
+        await asyncio.gather(bulk, interactive)
+        return order, controller.snapshot()
+
+    order, snapshot = asyncio.run(run())
+    assert order == ["interactive", "bulk"]
+    assert snapshot["budgets"]["memory_mb"]["in_use"] == 0
+    assert snapshot["lanes"]["bulk"]["admitted"] == 1
+
+
+def test_bulk_leaves_headroom_for_interactive():
+    async def run():
+        controller = AdmissionController(memory_mb=1000, cpu_sec=100, bulk_cpu_sec=10, bulk_share=0.5,
+                                         queue_timeout={"bulk": 0.05})
+        await controller.acquire(_cost(400, 20))
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire(_cost(400, 20))
+        # bulk で埋まっていない分は interactive がすぐに使える
+        await asyncio.wait_for(controller.acquire(_cost(500, 1)), 0.01)
+        return rejected.value, controller.snapshot()
+
+    rejected, snapshot = asyncio.run(run())
+    assert rejected.retry_after >= 1
+    assert snapshot["lanes"]["bulk"]["rejected"] == 1
+    assert snapshot["budgets"]["memory_mb"]["utilization"] == pytest.approx(0.9)
+
+
+def test_oversized_request_runs_alone():
+    async def run():
+        controller = AdmissionController(memory_mb=1000, cpu_sec=100, bulk_cpu_sec=1000)
+        reservation = await controller.acquire(_cost(5000, 1))
+        return reservation.amounts["memory_mb"]
+
+    assert asyncio.run(run()) == 1000
+
+
+def test_full_queue_returns_429_with_retry_after(monkeypatch):
+    controller = AdmissionController(memory_mb=1, cpu_sec=100, max_queue=0)
+    monkeypatch.setattr(admission, "_controller", controller)
+    client = TestClient(main.app)
+
+    async def occupy():
+        await controller.acquire(_cost(1, 50))
+
+    asyncio.run(occupy())
+    response = client.post("/api/v1/orders/parse", files={"file": ("orders.csv", b"a,b\n1,2\n", "text/csv")})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    metrics = client.get("/api/v1/metrics").json()["admission"]
+    assert metrics["lanes"]["interactive"]["rejected"] == 1
+    assert metrics["budgets"]["cpu_sec"]["in_use"] == 50
+
+
+def test_export_is_admitted_in_bulk_lane_until_streamed(monkeypatch):
+    controller = AdmissionController(memory_mb=1000, cpu_sec=100)
+    monkeypatch.setattr(admission, "_controller", controller)
+    client = TestClient(main.app)
+    diff_rows = [{"status": "OK"}] * 1000
+
+    response = client.post("/api/v1/match/export?format=csv", json={"diff_rows": diff_rows})
+    assert response.status_code == 200
+    assert len(response.content.splitlines()) == 1001
+
+    snapshot = client.get("/api/v1/metrics").json()["admission"]
+    assert snapshot["lanes"]["bulk"]["admitted"] == 1
+    assert snapshot["lanes"]["interactive"]["admitted"] == 0
+    assert snapshot["budgets"]["memory_mb"]["in_use"] == 0
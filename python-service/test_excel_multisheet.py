@@ -0,0 +1,86 @@
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+import parse_order_lambda
+from parse_order_lambda import parse_excel
+
+HEADERS = ['業者ID', '業者名', 'コード', '建物名', '番号', '受付内容', '支払金額', '完工日', '支払日', '請求日']
+
+
+def _rows(vendor_id, count):
+    return [[vendor_id + i, f'業者{vendor_id + i}', 'X', 'ビル', i + 1, '修繕', 1000, '2025-01-01', '2025-02-01', '2025-01-15']
+            for i in range(count)]
+
+
+def _workbook():
+    wb = openpyxl.Workbook()
+    # タイトル行あり (2行目がヘッダー)
+    january = wb.active
+    january.title = '1月'
+    january.append(['会社別発注リスト（完工日：2025/01）'])
+    january.append(HEADERS)
+    for row in _rows(1000, 3):
+        january.append(row)
+
+    # タイトル行なし・空行のあとにヘッダー
+    february = wb.create_sheet('2月')
+    february.append([])
+    february.append(list(reversed(HEADERS)))
+    for row in _rows(2000, 2):
+        february.append(list(reversed(row)))
+    february.append([0, '', '', '', '', '', '', '', '', ''])
+
+    # 発注データではないシート
+    summary = wb.create_sheet('集計')
+    summary.append(['合計', 5])
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def test_all_sheets_are_merged_in_workbook_order():
+    result = parse_excel(_workbook(), max_workers=1)
+
+    assert [o['業者ID'] for o in result['orders']] == [1000, 1001, 1002, 2000, 2001]
+    assert result['valid_rows'] == 5
+    assert result['skipped_rows'] == 1
+
+    sheets = {s['sheet']: s for s in result['sheets']}
+    assert sheets['1月']['header_row'] == 2 and sheets['1月']['valid_rows'] == 3
+    assert sheets['2月']['header_row'] == 2 and sheets['2月']['valid_rows'] == 2
+    assert 'error' in sheets['集計'], "Sheets without a header row should be reported, not fail the workbook"
+
+
+def test_selected_sheets_in_parallel(monkeypatch):
+    monkeypatch.setattr(parse_order_lambda, 'EXCEL_PARALLEL_MIN_BYTES', 0)
+    result = parse_excel(_workbook(), sheet_names=['2月', '1月'], max_workers=2)
+
+    assert [s['sheet'] for s in result['sheets']] == ['1月', '2月']
+    assert result['valid_rows'] == 5
+
+
+def test_unknown_sheet_is_rejected():
+    with pytest.raises(ValueError):
+        parse_excel(_workbook(), sheet_names=['3月'])
+
+
+def test_small_workbook_is_parsed_without_worker_processes(monkeypatch):
+    def fail():
+        raise AssertionError("small workbooks should not start worker processes")
+
+    monkeypatch.setattr(parse_order_lambda, 'get_process_pool', fail)
+    result = parse_excel(_workbook(), max_workers=4)
+    assert result['valid_rows'] == 5
+
+
+def test_falls_back_to_serial_without_worker_pool(monkeypatch):
+    def unavailable():
+        raise OSError(38, "Function not implemented")
+
+    monkeypatch.setattr(parse_order_lambda, 'EXCEL_PARALLEL_MIN_BYTES', 0)
+    monkeypatch.setattr(parse_order_lambda, 'get_process_pool', unavailable)
+    result = parse_excel(_workbook(), max_workers=4)
+    assert result['valid_rows'] == 5
@@ -0,0 +1,76 @@
+import io
+
+import openpyxl
+from fastapi.testclient import TestClient
+
+from export_results import export_columns, iter_csv, iter_xlsx
+from main import app
+from match_lambda import match_csv_and_pdf
+
+ORDER = {"業者ID": 12345, "業者名": "テスト工事会社", "建物名": "サンプルマンション", "番号": 101, "支払金額": 100000}
+INVOICE = {"発注番号": "A-1", "金額": "100000", "物件名": "サンプルマンション", "部屋番号": "101",
+           "工事業者名": "テスト工事会社"}
+
+
+def _diff_rows():
+    return match_csv_and_pdf([ORDER, dict(ORDER, 支払金額=5000)], [[INVOICE]])
+
+
+def test_csv_export_cp932_in_chunks():
+    chunks = list(iter_csv(_diff_rows(), encoding="cp932", chunk_rows=2))
+    assert len(chunks) > 1
+    lines = b"".join(chunks).decode("cp932").splitlines()
+    assert lines[0].split(",")[:3] == ["ステータス", "発注_業者ID", "請求書_業者ID"]
+    assert [line.split(",")[0] for line in lines[1:]] == ["OK", "DIFF"]
+
+
+def test_xlsx_export_highlights_status():
+    wb = openpyxl.load_workbook(io.BytesIO(b"".join(iter_xlsx(iter(_diff_rows())))))
+    ws = wb.active
+    assert [c.value for c in ws[1]][:2] == ["ステータス", "発注_業者ID"]
+    assert [ws.cell(row=r, column=1).value for r in (2, 3)] == ["OK", "DIFF"]
+    assert ws.max_column == len(export_columns())
+    rules = [rule.formula[0] for cf in ws.conditional_formatting for rule in cf.rules]
+    assert rules == ['$A2="OK"', '$A2="DIFF"']
+
+
+def test_formulas_are_written_as_text():
+    rows = [{"status": "DIFF", "pdf_業者名": '=HYPERLINK("http://x","click")', "pdf_建物名": "@SUM(A1)",
+             "csv_支払金額": -5000, "pdf_支払金額": "-5000"}]
+    ws = openpyxl.load_workbook(io.BytesIO(b"".join(iter_xlsx(iter(rows))))).active
+    values = {ws.cell(row=1, column=c).value: ws.cell(row=2, column=c) for c in range(1, ws.max_column + 1)}
+    assert values["請求書_業者名"].data_type == "s"
+    assert values["請求書_業者名"].value == '\'=HYPERLINK("http://x","click")'
+    assert values["請求書_建物名"].value == "'@SUM(A1)"
+    # 数値はそのまま、文字列の負数は文字列として書き出す
+    assert values["発注_支払金額"].value == -5000
+    assert values["請求書_支払金額"].value == "'-5000"
+
+    line = b"".join(iter_csv(rows)).decode("utf-8-sig").splitlines()[1]
+    assert "'=HYPERLINK" in line and "'@SUM(A1)" in line and ",-5000," in line
+
+
+def test_control_characters_are_removed():
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    import export_results
+
+    assert export_results.ILLEGAL_CHARACTERS_RE.pattern == ILLEGAL_CHARACTERS_RE.pattern
+    rows = [{"status": "OK", "pdf_業者名": "テスト\x0c工事会社\x00", "pdf_建物名": "\x0c"}]
+    ws = openpyxl.load_workbook(io.BytesIO(b"".join(iter_xlsx(iter(rows))))).active
+    values = {ws.cell(row=1, column=c).value: ws.cell(row=2, column=c).value for c in range(1, ws.max_column + 1)}
+    assert values["請求書_業者名"] == "テスト工事会社"
+    assert values["請求書_建物名"] is None
+    assert "テスト工事会社" in b"".join(iter_csv(rows)).decode("utf-8-sig")
+
+
+def test_export_endpoint_streams_match_result():
+    client = TestClient(app)
+    response = client.post("/api/v1/match/export?format=csv&encoding=utf-8",
+                           json={"orders": [ORDER], "invoices": [[INVOICE]]})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="match_result.csv"'
+    assert response.content.startswith(b"\xef\xbb\xbf")
+    assert response.content.decode("utf-8-sig").splitlines()[1].startswith("OK,12345,A-1")
+
+    assert client.post("/api/v1/match/export?format=pdf", json={"diff_rows": []}).status_code == 400
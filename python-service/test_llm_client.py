@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from llm_client import LLMClient, TokenBucket
+from mock_openai import create_mock_app, start_mock_server
+
+
+def _messages(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_identical_inflight_prompts_are_coalesced():
+    app = create_mock_app(latency=0.3)
+    base_url, stop = start_mock_server(app)
+    try:
+        async def run():
+            client = LLMClient(api_key="test", base_url=base_url)
+            try:
+                results = await asyncio.gather(*[client.complete(_messages("同じ請求書")) for _ in range(5)])
+            finally:
+                await client.aclose()
+            return client, results
+
+        client, results = asyncio.run(run())
+    finally:
+        stop()
+
+    assert results == ["Mock OCR result"] * 5
+    assert app.state.calls == 1, "Identical in-flight prompts should hit the API once"
+    assert client.stats["coalesced"] == 4
+
+
+def test_rate_limited_requests_are_retried():
+    app = create_mock_app(rate_limit_ratio=0.5, seed=1)
+    base_url, stop = start_mock_server(app)
+    try:
+        async def run():
+            client = LLMClient(api_key="test", base_url=base_url, max_retries=20, base_delay=0.01, max_delay=0.05,
+                               requests_per_minute=60000, tokens_per_minute=10_000_000)
+            try:
+                results = await asyncio.gather(*[client.complete(_messages(f"請求書{i}")) for i in range(10)])
+            finally:
+                await client.aclose()
+            return client, results
+
+        client, results = asyncio.run(run())
+    finally:
+        stop()
+
+    assert results == ["Mock OCR result"] * 10
+    assert app.state.rate_limited > 0
+    assert client.stats["retries"] == app.state.rate_limited
+
+
+def test_token_bucket_limits_rate():
+    async def run():
+        bucket = TokenBucket(rate_per_sec=20, capacity=2)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 2件はバースト、残り4件は 20件/秒 で補充 → 約0.2秒
+    assert asyncio.run(run()) >= 0.18
+
+
+def test_empty_content_is_returned_as_empty_string():
+    app = create_mock_app(content=None)
+    base_url, stop = start_mock_server(app)
+    try:
+        async def run():
+            client = LLMClient(api_key="test", base_url=base_url)
+            try:
+                return await client.complete(_messages("拒否される請求書"))
+            finally:
+                await client.aclose()
+
+        assert asyncio.run(run()) == ""
+    finally:
+        stop()
@@ -0,0 +1,67 @@
+import master_index
+from master_index import MasterIndex, add_master_entries, get_master_index
+from match_lambda import match_csv_and_pdf
+
+
+def test_lookup_snaps_variants_to_canonical_id():
+    index = MasterIndex("vendors")
+    index.add("V1", "株式会社山田工務店")
+    index.add("V2", "山本建設")
+
+    assert index.lookup("山田工務店(株)") == ("V1", 0)
+    assert index.lookup("山由エ務店") == ("V1", 2)
+    assert index.canonicalize("山本建設株式会社") == "V2"
+    assert index.canonicalize("全く別の会社") is None
+
+
+def test_ambiguous_lookup_returns_none():
+    index = MasterIndex("vendors")
+    index.add("V1", "山田工務店")
+    index.add("V2", "山本工務店")
+    assert index.canonicalize("山川工務店") is None
+
+
+def test_incremental_add_persists_and_reloads(tmp_path):
+    add_master_entries("buildings", [{"id": "B1", "name": "サンプルマンション"}], tmp_path)
+    assert get_master_index("buildings", tmp_path).canonicalize("サンプルマンシヨン") == "B1"
+
+    add_master_entries("buildings", [{"id": "B2", "name": "テストハイツ", "aliases": ["テストハイツ東"]}], tmp_path)
+    reloaded = MasterIndex.load(master_index.master_path("buildings", tmp_path))
+    assert reloaded.canonicalize("テストハイツ東") == "B2"
+    assert len(reloaded) == 2
+
+
+def test_match_uses_master_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(master_index, "MASTER_DATA_DIR", str(tmp_path))
+    add_master_entries("vendors", [
+        {"id": "V1", "name": "テスト工事会社", "aliases": ["TK工事"]},
+        {"id": "V2", "name": "テスト工業会社"},
+    ])
+    order = {"業者名": "テスト工事会社", "建物名": "サンプルマンション", "番号": 101, "支払金額": 100000}
+    invoice = {"工事業者名": "ＴＫ工事", "物件名": "サンプルマンション", "部屋番号": "101", "金額": 100000}
+    assert match_csv_and_pdf([order], [[invoice]])[0]["status"] == "OK"
+
+    # 名称は距離2以内でも、マスタ上は別の業者
+    invoice["工事業者名"] = "テスト工業会社"
+    assert match_csv_and_pdf([order], [[invoice]])[0]["status"] == "DIFF"
+    assert match_csv_and_pdf([order], [[invoice]], use_master_data=False)[0]["status"] == "OK"
+
+
+def test_lookup_while_adding_from_other_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = MasterIndex("vendors")
+    index.add("V0", "山田工務店")
+
+    def add(n):
+        index.add(f"V{n}", f"山田工務店{n:04d}")
+
+    def lookup(_):
+        return index.canonicalize("山田エ務店")
+
+    with ThreadPoolExecutor(8) as pool:
+        adds = pool.map(add, range(1, 2001))
+        found = list(pool.map(lookup, range(2000)))
+        list(adds)
+    assert set(found) == {"V0"}
+    assert len(index) == 2001
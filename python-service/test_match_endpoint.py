@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+
+ORDERS_CSV = (
+    "業者ID,業者名,建物名,番号,受付内容,支払金額,完工日,支払日,請求日\n"
+    "1,テスト工事会社,サンプルマンション,101,修繕工事,100000,2025-02-21,2025-03-21,2025-02-21\n"
+    "2,テスト工事会社,サンプルマンション,102,修繕工事,200000,2025-02-21,2025-03-21,2025-02-21\n"
+).encode("utf-8")
+
+
+def _invoice_row(room, amount):
+    return {"発注番号": f"A-{room}", "金額": str(amount), "物件名": "サンプルマンション", "部屋番号": str(room),
+            "工事業者名": "テスト工事会社"}
+
+
+def _fake_structure(delay):
+    rows = {b"pdf-101": [_invoice_row(101, 100000)], b"pdf-102": [_invoice_row(102, 200000)], b"pdf-x": []}
+
+    async def structure_invoice(content, use_ocr=False):
+        await asyncio.sleep(delay)
+        if content == b"broken":
+            raise RuntimeError("cannot read")
+        return content.decode() + "\n", rows[content]
+
+    return structure_invoice
+
+
+def _files(*pdfs):
+    files = [("orders_file", ("orders.csv", ORDERS_CSV, "text/csv"))]
+    files += [("invoices_files", (f"{i}.pdf", pdf, "application/pdf")) for i, pdf in enumerate(pdfs)]
+    return files
+
+
+def test_many_invoices_are_structured_concurrently(monkeypatch):
+    monkeypatch.setattr(main, "structure_invoice", _fake_structure(0.3))
+    client = TestClient(main.app)
+
+    started = time.perf_counter()
+    response = client.post("/api/v1/match?use_ocr=false", files=_files(b"pdf-x", b"pdf-102", b"pdf-101", b"pdf-x"))
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [row["status"] for row in data["diff_rows"]] == ["OK", "OK"]
+    assert [inv["filename"] for inv in data["invoices"]] == ["0.pdf", "1.pdf", "2.pdf", "3.pdf"]
+    # 発注データの解析結果の集計と、PDF のテキストも返す
+    assert data["orders"]["total_rows"] == data["orders"]["valid_rows"] == 2
+    assert len(data["orders"]["orders"]) == 2
+    assert data["invoice_text"] == "pdf-x\npdf-102\npdf-101\npdf-x\n"
+    assert elapsed < 0.3 * 4 * 0.75, "PDFs must be processed concurrently"
+
+
+def test_streamed_progress_and_failed_invoice(monkeypatch):
+    monkeypatch.setattr(main, "structure_invoice", _fake_structure(0))
+    client = TestClient(main.app)
+
+    response = client.post("/api/v1/match?use_ocr=false&stream=true", files=_files(b"pdf-101", b"broken"))
+    events = [json.loads(line) for line in response.text.splitlines()]
+
+    progress = {e["filename"]: e for e in events if e["event"] == "invoice"}
+    assert progress["0.pdf"]["rows"] == 1
+    assert progress["1.pdf"]["error"] == "cannot read"
+    assert events[-1]["event"] == "result"
+    assert [row["status"] for row in events[-1]["data"]["diff_rows"]] == ["OK", "DIFF"]
+
+
+def test_single_invoice_field_still_accepted(monkeypatch):
+    monkeypatch.setattr(main, "structure_invoice", _fake_structure(0))
+    client = TestClient(main.app)
+    files = [("orders_file", ("orders.csv", ORDERS_CSV, "text/csv")),
+             ("invoices_file", ("a.pdf", b"pdf-101", "application/pdf"))]
+    response = client.post("/api/v1/match?use_ocr=false", files=files)
+    assert response.status_code == 200
+    assert len(response.json()["data"]["invoices"]) == 1
+
+    files = [("orders_file", ("orders.csv", ORDERS_CSV, "text/csv"))]
+    assert client.post("/api/v1/match", files=files).status_code == 400
+
+
+def test_streamed_match_failure_ends_with_error_event(monkeypatch):
+    import match_lambda
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("match failed")
+
+    monkeypatch.setattr(main, "structure_invoice", _fake_structure(0))
+    monkeypatch.setattr(match_lambda, "match_csv_and_pdf", fail)
+    client = TestClient(main.app)
+
+    response = client.post("/api/v1/match?use_ocr=false&stream=true", files=_files(b"pdf-101"))
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["event"] for e in events] == ["invoice", "error"]
+    assert client.get("/api/v1/metrics").json()["admission"]["budgets"]["cpu_sec"]["in_use"] == 0
@@ -0,0 +1,53 @@
+from match_lambda import match_csv_and_pdf, parse_amount, canonicalize_room
+
+
+def _order(amount=100000, room=101):
+    return {"業者ID": 12345, "業者名": "テスト工事会社", "建物名": "サンプルマンション",
+            "番号": room, "受付内容": "修繕工事", "支払金額": amount}
+
+
+def _invoice(amount="100000", room="101", order_no="A-1"):
+    return {"発注番号": order_no, "金額": amount, "物件名": "サンプルマンション",
+            "部屋番号": room, "工事業者名": "テスト工事会社"}
+
+
+def test_parse_amount_notations():
+    assert parse_amount("¥100,000") == 100000
+    assert parse_amount("１００，０００円（税込）") == 100000
+    assert parse_amount("税込100000円") == 100000
+    assert parse_amount(100000.0) == 100000
+    assert parse_amount("不明") is None
+
+
+def test_canonicalize_room():
+    assert canonicalize_room("101号室") == canonicalize_room("１０１") == canonicalize_room(101) == "101"
+
+
+def test_formatted_amount_and_room_match():
+    [row] = match_csv_and_pdf([_order()], [[_invoice(amount="¥100,000", room="101号室")]])
+    assert row["status"] == "OK"
+
+
+def test_close_but_different_amount_does_not_match():
+    [row] = match_csv_and_pdf([_order()], [[_invoice(amount="100900")]])
+    assert row["status"] == "DIFF", "Amounts within edit distance 2 but 900 yen apart must not match"
+
+
+def test_amount_tolerance():
+    invoices = [[_invoice(amount="100900")]]
+    assert match_csv_and_pdf([_order()], invoices, amount_tolerance=1000)[0]["status"] == "OK"
+    assert match_csv_and_pdf([_order()], invoices, amount_tolerance_pct=1)[0]["status"] == "OK"
+    assert match_csv_and_pdf([_order()], invoices, amount_tolerance_pct=0.5)[0]["status"] == "DIFF"
+
+
+def test_first_matching_invoice_in_pdf_order_wins():
+    invoices = [[_invoice(room="102", order_no="A-1")], [_invoice(order_no="B-1"), _invoice(order_no="B-2")]]
+    [row] = match_csv_and_pdf([_order()], invoices)
+    assert row["pdf_業者ID"] == "B-1"
+
+
+def test_company_name_variants_match_by_similarity():
+    invoices = [[dict(_invoice(), 工事業者名="テスト工事(株)")]]
+    order = dict(_order(), 業者名="株式会社テスト工事")
+    assert match_csv_and_pdf([order], invoices)[0]["status"] == "OK"
+    assert match_csv_and_pdf([order], invoices, name_similarity=0)[0]["status"] == "DIFF"
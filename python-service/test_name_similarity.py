@@ -0,0 +1,26 @@
+import numpy as np
+
+from name_similarity import normalize_name, top_k_similar
+
+
+def test_normalize_name_strips_legal_forms_and_spaces():
+    assert normalize_name("株式会社 山田工務店") == normalize_name("山田工務店（株）") == normalize_name("㈱山田工務店")
+
+
+def test_top_k_similar_ranks_and_thresholds():
+    queries = ["株式会社山田工務店", "サンプルマンション", ""]
+    targets = ["山本工務店", "山田工務店(株)", "サンプルマンシヨン"]
+    indexes, scores = top_k_similar(queries, targets, k=2, min_score=0.5)
+    assert indexes[0].tolist() == [1, -1]
+    assert abs(scores[0][0] - 1.0) < 1e-9
+    assert indexes[1].tolist() == [2, -1]
+    assert indexes[2].tolist() == [-1, -1]
+
+
+def test_chunked_scoring_matches_single_block():
+    queries = [f"テスト工事会社{i}" for i in range(40)]
+    targets = [f"テスト工事{i}(株)" for i in range(30)]
+    full = top_k_similar(queries, targets, k=3)
+    chunked = top_k_similar(queries, targets, k=3, memory_budget=1)
+    assert (full[0] == chunked[0]).all()
+    assert np.allclose(full[1], chunked[1])
@@ -0,0 +1,73 @@
+from PIL import Image
+
+import ocr_tiling
+from ocr_tiling import plan_tiles, ocr_pages
+
+# 縦 3000px のページに 40px 間隔で高さ 30px の行が並んでいる想定
+PAGE_LINES = [(y, y + 30, f"行{i}") for i, y in enumerate(range(10, 2980, 40))]
+
+
+def _fake_ocr_tile_lines(image, tile, lang):
+    # タイル内に完全に収まる行は正しく読めて、境界で切れた行は誤読される
+    lines = []
+    for top, bottom, text in PAGE_LINES:
+        if tile.top <= top and bottom <= tile.bottom:
+            lines.append((top, bottom, text))
+        elif top < tile.bottom and bottom > tile.top:
+            lines.append((max(top, tile.top), min(bottom, tile.bottom), "???"))
+    return lines
+
+
+def test_plan_tiles_covers_page_with_overlap():
+    tiles = plan_tiles(1000, 3000, max_pixels=500_000, overlap=100)
+
+    assert len(tiles) > 1
+    assert tiles[0].top == 0 and tiles[-1].bottom == 3000
+    assert all((t.bottom - t.top) * 1000 <= 500_000 for t in tiles), "Tiles should respect the pixel budget"
+    for prev, cur in zip(tiles, tiles[1:]):
+        assert prev.bottom - cur.top == 100, "Adjacent tiles should overlap"
+        assert prev.own_bottom == cur.own_top, "Owned ranges should be contiguous"
+
+
+def test_small_page_is_single_tile():
+    assert plan_tiles(1000, 1000, max_pixels=2_000_000) == [ocr_tiling.Tile(0, 1000, 0, 1000)]
+
+
+def test_tiled_ocr_keeps_each_line_once(monkeypatch):
+    monkeypatch.setattr(ocr_tiling, "_ocr_tile_lines", _fake_ocr_tile_lines)
+    page = Image.new("L", (1000, 3000), color=255)
+
+    [text] = ocr_pages([page], max_pixels=500_000, overlap=100, max_workers=4)
+
+    assert text.splitlines() == [line for _, _, line in PAGE_LINES]
+
+
+def test_concurrent_calls_share_bounded_pool(monkeypatch):
+    import threading
+    import time
+
+    lock = threading.Lock()
+    running = [0, 0]  # 実行中, 最大
+
+    def fake_ocr_whole(image, lang, ignore_errors):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return "text"
+
+    monkeypatch.setattr(ocr_tiling, "_ocr_whole", fake_ocr_whole)
+    monkeypatch.setattr(ocr_tiling, "_thread_pool", None)
+    pages = [Image.new("L", (100, 100), color=255) for _ in range(8)]
+
+    # 8リクエストが同時に8ページずつ OCR しても、同時実行数は共有プールのスレッド数まで
+    threads = [threading.Thread(target=ocr_pages, args=(pages,), kwargs={"max_workers": 2}) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert running[1] <= 2
+    assert ocr_tiling.get_thread_pool() is ocr_tiling.get_thread_pool(8)
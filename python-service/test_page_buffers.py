@@ -0,0 +1,39 @@
+import queue
+
+import pytest
+from PIL import Image
+
+from page_buffers import PageBufferRing, open_page_view
+
+
+def test_worker_view_sees_written_pixels(tmp_path):
+    page = Image.new("L", (64, 32), color=200)
+    page.paste(10, (0, 0, 64, 8))
+
+    with PageBufferRing(1, directory=str(tmp_path)) as ring:
+        buf = ring.acquire()
+        buf.write(page)
+        with open_page_view(buf.path, buf.width, buf.height) as view:
+            assert view.tobytes() == page.tobytes()
+        ring.release(buf)
+
+
+def test_ring_reuses_buffers_and_blocks_when_full(tmp_path):
+    with PageBufferRing(2, directory=str(tmp_path)) as ring:
+        first = ring.acquire()
+        second = ring.acquire()
+        with pytest.raises(queue.Empty):
+            ring.acquire(timeout=0.05)
+
+        ring.release(first)
+        assert ring.acquire() is first, "Released buffers should be reused"
+
+        first.write(Image.new("L", (100, 100)))
+        capacity = first.capacity
+        first.write(Image.new("RGB", (50, 50)))
+        assert first.capacity == capacity, "Smaller pages should not reallocate the buffer"
+        assert (first.width, first.height) == (50, 50)
+        ring.release(first)
+        ring.release(second)
+
+    assert list(tmp_path.iterdir()) == [], "Buffers should be removed on close"
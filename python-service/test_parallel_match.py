@@ -0,0 +1,65 @@
+import random
+
+from match_lambda import InvoiceIndex, match_csv_and_pdf, prepare_match
+from parallel_match import balance, partition, shard_matches
+
+
+def _rows(count, seed=0):
+    rng = random.Random(seed)
+    vendors = ["テスト工事会社", "山田工務店", "佐藤設備", "高橋電気"]
+    orders, invoices = [], []
+    for n in range(count):
+        amount = rng.choice([9950, 10000, 10050, 25000, 100000]) + rng.randint(-2, 2) * 100
+        room = rng.randint(101, 105)
+        vendor = rng.choice(vendors)
+        orders.append({"業者ID": n, "業者名": vendor, "建物名": "サンプルマンション",
+                       "番号": room, "支払金額": amount})
+        invoices.append({"発注番号": f"A-{n}", "金額": amount + rng.choice([0, 0, 100, -300]),
+                         "物件名": "サンプルマンション", "部屋番号": f"{room}号室",
+                         "工事業者名": rng.choice([vendor, vendor, "株式会社" + vendor])})
+    rng.shuffle(invoices)
+    return orders, [invoices[:count // 2], invoices[count // 2:]]
+
+
+def test_rooms_are_blocks_and_large_rooms_split_by_amount():
+    orders = [{"業者名": "A", "建物名": "B", "番号": room, "支払金額": amount}
+              for room, amount in ((101, 9950), (101, 5000), (101, "不明"), (999, 5000))]
+    index = InvoiceIndex([{"工事業者名": "A", "物件名": "B", "部屋番号": "101", "金額": 5000}])
+    keys, _ = prepare_match(orders, index, 100, 0, 0, False)
+    # 部屋番号ごとのブロック: 境界をまたぐ行もそのまま突合できる
+    assert partition(keys, index, n_shards=1, amount_bucket=10000) == ([([0, 1], [0])], [])
+    # 1シャード分を超える部屋番号は金額の区間で分け、境界をまたぐ行は親プロセスで処理する
+    assert partition(keys, index, n_shards=10, amount_bucket=10000) == ([([1], [0])], [0])
+
+
+def test_balance_splits_large_blocks_evenly():
+    shards = balance([(list(range(90)), [0]), ([90, 91], [1]), ([92], [2])], 3)
+    sizes = [sum(len(rows) for rows, _ in shard) for shard in shards]
+    assert sum(sizes) == 93 and len(sizes) == 3
+    assert max(sizes) - min(sizes) <= 2
+
+
+def test_sharded_matches_equal_serial(monkeypatch):
+    import parallel_match
+
+    orders, invoices = _rows(400)
+    index = InvoiceIndex([row for rows in invoices for row in rows])
+    keys, matcher = prepare_match(orders, index, 100, 0, 0.8, False)
+    serial = [matcher.first_match(key) for key in keys]
+    assert any(i is None for i in serial) and any(i is not None for i in serial)
+    assert shard_matches(keys, matcher, workers=1, amount_bucket=1000) == serial
+
+    # 部屋番号を金額の区間で分け、境界をまたぐ行を親プロセスで処理する場合も同じ結果になる
+    monkeypatch.setattr(parallel_match, "SHARDS_PER_WORKER", 40)
+    assert partition(keys, index, 40, amount_bucket=1000)[1]
+    assert shard_matches(keys, matcher, workers=1, amount_bucket=1000) == serial
+
+
+def test_parallel_diff_rows_equal_serial(monkeypatch):
+    import parallel_match
+
+    monkeypatch.setattr(parallel_match, "MATCH_PARALLEL_MIN_ROWS", 0)
+    orders, invoices = _rows(200, seed=1)
+    serial = match_csv_and_pdf(orders, invoices, amount_tolerance=100, use_master_data=False, workers=0)
+    parallel = match_csv_and_pdf(orders, invoices, amount_tolerance=100, use_master_data=False, workers=2)
+    assert parallel == serial
@@ -0,0 +1,113 @@
+import base64
+import json
+import os
+
+import pytest
+
+import payload_store
+from payload_store import FilesystemObjectStore, open_payload, read_json, result_body, write_json_rows
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "data", "sample_invoice.pdf")
+
+
+@pytest.fixture
+def object_store(tmp_path, monkeypatch):
+    monkeypatch.setitem(payload_store._stores, "s3", FilesystemObjectStore(str(tmp_path)))
+    return tmp_path
+
+
+def test_local_and_object_uris_are_mmapped(tmp_path, object_store):
+    path = tmp_path / "bucket" / "in.bin"
+    path.parent.mkdir()
+    path.write_bytes(b"%PDF-1.4 test")
+
+    for uri in (str(path), f"file://{path}", "s3://bucket/in.bin"):
+        with open_payload(uri) as buf:
+            assert buf[:8] == b"%PDF-1.4"
+
+    with pytest.raises(ValueError):
+        open_payload("s3://bucket/../../etc/passwd").__enter__()
+
+
+def test_result_rows_are_written_by_reference(object_store):
+    assert write_json_rows("s3://bucket/out.json", "diff_rows", iter([{"a": 1}, {"a": 2}])) == 2
+    assert read_json("s3://bucket/out.json") == {"diff_rows": [{"a": 1}, {"a": 2}]}
+
+
+def test_large_results_spill_to_prefix(object_store, monkeypatch):
+    monkeypatch.setattr(payload_store, "PAYLOAD_INLINE_LIMIT", 10)
+    monkeypatch.setattr(payload_store, "PAYLOAD_RESULT_PREFIX", "s3://bucket/results/")
+    assert json.loads(result_body({"a": 1}, request_id="r1")) == {"a": 1}
+    body = json.loads(result_body({"rows": list(range(100))}, request_id="r1"))
+    assert body["result_uri"] == "s3://bucket/results/r1.json"
+    assert read_json(body["result_uri"]) == {"rows": list(range(100))}
+
+
+def test_match_lambda_reads_and_writes_by_reference(object_store):
+    from match_lambda import lambda_handler
+
+    (object_store / "bucket").mkdir()
+    (object_store / "bucket" / "orders.json").write_text(json.dumps([
+        {"業者名": "テスト工事会社", "建物名": "サンプルマンション", "番号": 101, "支払金額": 100000},
+    ]))
+    (object_store / "bucket" / "invoices.json").write_text(json.dumps([[
+        {"工事業者名": "テスト工事会社", "物件名": "サンプルマンション", "部屋番号": "101", "金額": "100000"},
+    ]]))
+
+    response = lambda_handler({
+        "orders_uri": "s3://bucket/orders.json",
+        "invoices_uri": "s3://bucket/invoices.json",
+        "result_uri": "s3://bucket/diff.json",
+    }, None)
+    assert json.loads(response["body"]) == {"result_uri": "s3://bucket/diff.json", "rows": 1}
+    assert read_json("s3://bucket/diff.json")["diff_rows"][0]["status"] == "OK"
+
+
+def test_order_lambda_accepts_file_uri(object_store):
+    from parse_order_lambda import lambda_handler
+
+    (object_store / "bucket").mkdir()
+    (object_store / "bucket" / "orders.csv").write_text(
+        "業者ID,業者名,建物名,番号,受付内容,支払金額,完工日,支払日,請求日\n"
+        "1,テスト工事会社,サンプルマンション,101,修繕工事,100000,2025-02-21,2025-03-21,2025-02-21\n"
+    )
+    response = lambda_handler({"file_uri": "s3://bucket/orders.csv"}, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["valid_rows"] == 1
+
+
+def test_invoice_lambda_returns_400_for_bad_input(object_store):
+    from parse_invoice_lambda import lambda_handler
+
+    missing = lambda_handler({"file_uri": "s3://bucket/missing.pdf"}, None)
+    assert missing["statusCode"] == 400 and json.loads(missing["body"])["error"]
+
+    with open(SAMPLE_PDF, "rb") as f:
+        file_bytes = base64.b64encode(f.read()).decode()
+    bad_pages = lambda_handler({"file_bytes": file_bytes, "pages": "5-9"}, None)
+    assert bad_pages["statusCode"] == 400
+    assert "error" in json.loads(bad_pages["body"])
+
+
+def test_match_lambda_returns_400_for_bad_references(object_store):
+    from match_lambda import lambda_handler
+
+    (object_store / "bucket").mkdir()
+    (object_store / "bucket" / "broken.json").write_text("{not json")
+    for event in ({"orders_uri": "s3://bucket/missing.json"},
+                  {"orders_uri": "s3://bucket/broken.json"},
+                  {"orders_uri": "ftp://host/orders.json"}):
+        response = lambda_handler(event, None)
+        assert response["statusCode"] == 400
+        assert json.loads(response["body"])["error"]
+
+
+def test_filesystem_object_store_is_opt_in(monkeypatch):
+    monkeypatch.delitem(payload_store._stores, "s3", raising=False)
+    monkeypatch.setattr(payload_store, "PAYLOAD_STORE_BACKEND", "fs")
+    assert isinstance(payload_store.get_store("s3://bucket/key"), FilesystemObjectStore)
+
+    monkeypatch.delitem(payload_store._stores, "s3")
+    monkeypatch.setattr(payload_store, "PAYLOAD_STORE_BACKEND", "unknown")
+    with pytest.raises(ValueError):
+        payload_store.get_store("s3://bucket/key")
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from pdf_text import BACKENDS, PageRangeError, extract_pages, page_count, parse_page_range
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "data", "sample_invoice.pdf")
+
+
+def test_parse_page_range():
+    assert parse_page_range(None, 3) == [0, 1, 2]
+    assert parse_page_range("1-2, 5, 2", 5) == [0, 1, 4]
+    with pytest.raises(PageRangeError):
+        parse_page_range("4", 3)
+    with pytest.raises(PageRangeError):
+        parse_page_range("a-b", 3)
+
+
+@pytest.mark.parametrize("name", [n for n, b in BACKENDS.items() if b.available()])
+def test_backends_extract_selected_pages(name):
+    with open(SAMPLE_PDF, "rb") as f:
+        pdf_bytes = f.read()
+
+    assert page_count(pdf_bytes, name) == 1
+    [text] = extract_pages(pdf_bytes, pages="1", backend=name)
+    assert "12345" in text and "100000" in text
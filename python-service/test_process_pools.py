@@ -0,0 +1,23 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from process_pools import ResidentPool
+
+
+def test_pool_is_rebuilt_after_a_worker_dies():
+    pool = ResidentPool("test", max_workers=1)
+    try:
+        first = pool.executor()
+        pid = pool.submit(os.getpid).result(timeout=60)
+
+        # OOM などでワーカーが強制終了すると、そのリクエストは失敗する
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result(timeout=60)
+
+        # 以降のリクエストは作り直したプールで処理する
+        assert pool.submit(os.getpid).result(timeout=60) != pid
+        assert pool.executor() is not first
+    finally:
+        pool.shutdown()
@@ -0,0 +1,121 @@
+import json
+import os
+import pstats
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiling
+from profiling import ProfilingMiddleware, profile_handler, run_in_threadpool
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "data", "sample_invoice.pdf")
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+    return True
+
+
+def _app():
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/work")
+    def work():
+        time.sleep(0.05)
+        return {"ok": True}
+
+    @app.get("/offload")
+    async def offload():
+        return {"ok": await run_in_threadpool(_busy, 0.05)}
+
+    return app
+
+
+def _enable(monkeypatch, tmp_path, sample_rate=0.0):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_ON_REQUEST", True)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", sample_rate)
+
+
+def test_requests_without_header_are_not_profiled(monkeypatch, tmp_path):
+    _enable(monkeypatch, tmp_path)
+    response = TestClient(_app()).get("/work")
+
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_header_writes_pstats_keyed_by_request_id(monkeypatch, tmp_path):
+    _enable(monkeypatch, tmp_path)
+    response = TestClient(_app()).get("/work", headers={"X-Profile": "1", "X-Request-ID": "req-123"})
+
+    assert response.headers["x-profile-id"] == "req-123"
+    stats = pstats.Stats(str(tmp_path / "req-123.pstats"))
+    assert stats.total_calls > 0
+
+
+def test_header_is_ignored_unless_enabled(monkeypatch, tmp_path):
+    _enable(monkeypatch, tmp_path)
+    monkeypatch.setattr(profiling, "PROFILE_ON_REQUEST", False)
+    response = TestClient(_app()).get("/work", headers={"X-Profile": "1"})
+
+    assert "x-profile-id" not in response.headers
+
+
+def test_lambda_handler_sampling_profile(monkeypatch, tmp_path):
+    _enable(monkeypatch, tmp_path)
+
+    @profile_handler
+    def handler(event, context):
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        return {"statusCode": 200}
+
+    assert handler({"id": "job/1", "profile": "sample"}, None) == {"statusCode": 200}
+
+    [path] = tmp_path.iterdir()
+    assert path.name == "job_1.speedscope.json"
+    profile = json.loads(path.read_text())["profiles"][0]
+    assert profile["type"] == "sampled" and profile["samples"]
+
+
+def test_sample_rate_profiles_without_header(monkeypatch, tmp_path):
+    _enable(monkeypatch, tmp_path, sample_rate=1.0)
+    monkeypatch.setattr(profiling, "PROFILE_ON_REQUEST", False)
+    response = TestClient(_app()).get("/work")
+
+    assert os.path.exists(tmp_path / f"{response.headers['x-profile-id']}.pstats")
+
+
+def test_offloaded_endpoint_work_is_in_pstats(monkeypatch, tmp_path):
+    import main
+
+    _enable(monkeypatch, tmp_path)
+    with open(SAMPLE_PDF, "rb") as f:
+        response = TestClient(main.app).post(
+            "/api/v1/invoices/parse", files={"file": ("invoice.pdf", f.read(), "application/pdf")},
+            headers={"X-Profile": "cprofile", "X-Request-ID": "parse-1"},
+        )
+
+    assert response.status_code == 200
+    functions = {name for _, _, name in pstats.Stats(str(tmp_path / "parse-1.pstats")).stats}
+    # スレッドプールで実行したテキスト化の処理もプロファイルに含まれる
+    assert {"extract_pdf_text", "estimate_pdf_cost"} <= functions
+
+
+def test_sampling_profile_includes_worker_threads(monkeypatch, tmp_path):
+    _enable(monkeypatch, tmp_path)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_INTERVAL", 0.001)
+    response = TestClient(_app()).get("/offload", headers={"X-Profile": "sample", "X-Request-ID": "offload-1"})
+
+    assert response.json() == {"ok": True}
+    speedscope = json.loads((tmp_path / "offload-1.speedscope.json").read_text())
+    frames = speedscope["shared"]["frames"]
+    [worker] = [profile for profile in speedscope["profiles"] if "(worker" in profile["name"]]
+    assert any(frames[idx]["name"] == "_busy" for stack in worker["samples"] for idx in stack)
@@ -0,0 +1,63 @@
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+
+from wrapper import run_worker
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_CSV = os.path.join(HERE, "tests", "data", "sample_orders.csv")
+
+
+def _requests():
+    with open(SAMPLE_CSV, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("utf-8")
+    return "\n".join([
+        SAMPLE_CSV,
+        json.dumps({"id": "b64", "file_bytes": encoded, "filename": "orders.csv"}),
+        json.dumps({"id": "missing", "file_path": os.path.join(HERE, "no_such_file.csv")}),
+        "",
+    ]) + "\n"
+
+
+def _check(results):
+    assert len(results) == 3, "Each non-empty line should produce one result"
+
+    body = json.loads(results[0]["body"])
+    assert results[0]["statusCode"] == 200
+    assert body["valid_rows"] == 1
+    assert body["orders"][0]["業者ID"] == 12345
+
+    assert results[1]["id"] == "b64", "Request id should be echoed back"
+    assert results[1]["statusCode"] == 200
+
+    assert results[2]["id"] == "missing"
+    assert results[2]["statusCode"] == 400
+
+
+def test_worker_in_process():
+    output = io.StringIO()
+    run_worker(1, io.StringIO(_requests()), output)
+    _check([json.loads(line) for line in output.getvalue().splitlines()])
+
+
+def test_worker_pool_subprocess():
+    proc = subprocess.run(
+        [sys.executable, os.path.join(HERE, "wrapper.py"), "--worker", "--workers", "2"],
+        input=_requests(), capture_output=True, text=True, cwd=HERE, timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr
+    _check([json.loads(line) for line in proc.stdout.splitlines()])
+
+
+def test_single_shot_mode():
+    with open(SAMPLE_CSV, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("utf-8")
+    proc = subprocess.run(
+        [sys.executable, os.path.join(HERE, "wrapper.py"), encoded, "orders.csv"],
+        capture_output=True, text=True, cwd=HERE, timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads(proc.stdout)["statusCode"] == 200
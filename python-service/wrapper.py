@@ -1,47 +1,128 @@
 #!/usr/bin/env python3
+"""
+発注ファイル解析のCLIラッパー
+
+単発モード:
+    python3 wrapper.py <base64エンコードされたファイル> <ファイル名>
+
+ワーカーモード (常駐):
+    python3 wrapper.py --worker [--workers N]
+
+    標準入力から1行1リクエストを読み込み、結果を1行1JSONで標準出力に書き出す。
+    各行は以下のいずれか:
+      - ファイルパス                 例: /tmp/orders.xlsx
+      - JSONオブジェクト             例: {"id": "1", "file_path": "/tmp/orders.csv"}
+                                         {"id": "2", "file_bytes": "<base64>", "filename": "orders.xlsx"}
+    出力は入力と同じ順序で返し、JSONリクエストの "id" はそのまま結果に含める。
+"""
 import sys
 import json
-import base64
+import argparse
 import traceback
 import os
-from parse_order_lambda import lambda_handler
+import multiprocessing
+from parse_order_lambda import lambda_handler, warm_up
 
-if __name__ == '__main__':
+
+def error_response(status_code, message):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps({
+            'error': message
+        })
+    }
+
+
+def _init_worker():
+    # 重いモジュールをワーカー起動時に読み込み、リクエスト毎の import コストを避ける
+    warm_up()
+
+
+def handle_request(line):
+    """ワーカーモードの1リクエスト(1行)を処理してレスポンスを返す"""
+    request_id = None
     try:
-        if len(sys.argv) != 3:
-            print(json.dumps({
-                'statusCode': 400,
-                'body': json.dumps({
-                    'error': 'ファイル形式が正しくありません。'
-                })
-            }))
-            sys.exit(1)
-
-        file_bytes = base64.b64decode(sys.argv[1])
-        filename = sys.argv[2]
-
-        event = {
-            'file_bytes': base64.b64encode(file_bytes).decode('utf-8'),
-            'filename': filename
-        }
-        
+        line = line.strip()
+        if line.startswith('{'):
+            event = json.loads(line)
+            request_id = event.get('id')
+        else:
+            event = {'file_path': line}
+
         result = lambda_handler(event, None)
         if not result or 'statusCode' not in result:
-            print(json.dumps({
-                'statusCode': 500,
-                'body': json.dumps({
-                    'error': 'データの解析に失敗しました。'
-                })
-            }))
-            sys.exit(1)
-            
+            result = error_response(500, 'データの解析に失敗しました。')
+    except Exception as e:
+        traceback.print_exc()
+        result = error_response(500, f'ファイルの解析中にエラーが発生しました: {str(e)}')
+
+    if request_id is not None:
+        result = {'id': request_id, **result}
+    return result
+
+
+def run_worker(workers, input_stream=None, output_stream=None):
+    """標準入力のリクエストを処理し続ける。workers > 1 の場合はプロセスプールで並列処理する"""
+    if input_stream is None:
+        input_stream = sys.stdin
+    if output_stream is None:
+        output_stream = sys.stdout
+    lines = (line for line in input_stream if line.strip())
+
+    if workers <= 1:
+        _init_worker()
+        results = map(handle_request, lines)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker)
+        results = pool.imap(handle_request, lines, chunksize=1)
+
+    try:
+        for result in results:
+            output_stream.write(json.dumps(result) + '\n')
+            output_stream.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def run_once(file_bytes_b64, filename):
+    """単発モード: Base64のまま lambda_handler に渡して結果を出力する"""
+    try:
+        result = lambda_handler({
+            'file_bytes': file_bytes_b64,
+            'filename': filename
+        }, None)
+        if not result or 'statusCode' not in result:
+            print(json.dumps(error_response(500, 'データの解析に失敗しました。')))
+            return 1
+
         print(json.dumps(result))
-        
+        return 0
+
     except Exception as e:
-        print(json.dumps({
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': f'ファイルの解析中にエラーが発生しました: {str(e)}'
-            })
-        }))
+        print(json.dumps(error_response(500, f'ファイルの解析中にエラーが発生しました: {str(e)}')))
         traceback.print_exc()
+        return 1
+
+
+def main(argv):
+    if '--worker' in argv:
+        parser = argparse.ArgumentParser(description='発注ファイル解析ワーカー')
+        parser.add_argument('--worker', action='store_true')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='ワーカープロセス数 (1の場合はプロセスプールを使わない)')
+        args = parser.parse_args(argv)
+        run_worker(args.workers)
+        return 0
+
+    if len(argv) != 2:
+        print(json.dumps(error_response(400, 'ファイル形式が正しくありません。')))
+        return 1
+
+    return run_once(argv[0], argv[1])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))